@@ -0,0 +1,129 @@
+"""
+Payroll accruals
+Running per-employee, per-period totals (days worked, regular and overtime
+hours) updated on every kiosk time-out, so closing a pay period reads one
+row per employee instead of scanning attendance
+"""
+
+import logging
+import time
+from datetime import date
+import numpy as np
+from business_calendar import business_calendar
+from database import backend, get_db_connection
+from jobs import job_handler
+from payroll_engine import PayRules, apply_rules, biweekly_anchor, default_pay_frequency
+from pay_periods import pay_frequency, period_containing
+from repository import stream
+from settings_cache import settings_cache
+
+logger = logging.getLogger(__name__)
+
+# Settings that decide which period a day belongs to or how its hours split;
+# changing any of them rebuilds the accruals
+ACCRUAL_SETTINGS = ('office_hours_per_day', 'payroll_period', 'payroll_biweekly_anchor')
+
+UPSERT_SQL = '''INSERT INTO payroll_accruals(employee_ref, period, period_start, period_end,
+                                             days_worked, regular_hours, overtime_hours, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (employee_ref, period) DO UPDATE SET
+                    days_worked = payroll_accruals.days_worked + excluded.days_worked,
+                    regular_hours = payroll_accruals.regular_hours + excluded.regular_hours,
+                    overtime_hours = payroll_accruals.overtime_hours + excluded.overtime_hours,
+                    updated_at = excluded.updated_at'''
+
+def refresh_overtime(conn):
+    """Re-split every attendance day's stored hours at the current office_hours_per_day; the caller commits.
+
+    The triggers split hours when the punches are written, so rows written
+    under an older threshold keep its overtime until this runs.
+    """
+    overtime = backend.greatest('0', 'hours_worked - ?')
+    return conn.execute(f'UPDATE attendance SET overtime_hours = {overtime} WHERE hours_worked IS NOT NULL',
+                        (settings_cache.get('office_hours_per_day'),)).rowcount
+
+def record_time_out(conn, employee, attendance_id):
+    """Add a completed attendance day to the employee's accrual for its pay period.
+
+    Call in the transaction that writes the time-out (after it, so the
+    triggers have stored the day's hours); the caller commits.
+    """
+    day, hours_worked, overtime = conn.execute('SELECT date, hours_worked, overtime_hours FROM attendance WHERE id = ?',
+                                               (attendance_id,)).fetchone()
+    frequency = pay_frequency(employee['pay_frequency'], default_pay_frequency())
+    period = period_containing(frequency, date.fromisoformat(day), biweekly_anchor())
+    conn.execute(UPSERT_SQL, (employee['id'], period.key) + period.bounds() + (1, hours_worked - overtime, overtime))
+
+def rebuild_accruals(conn, employee_ref=None):
+    """Recompute accruals from attendance, for everyone or one employee; the caller commits.
+
+    Needed after a pay frequency or one of ACCRUAL_SETTINGS changes, since
+    those move days between periods or change the overtime split (run
+    refresh_overtime first for the latter).
+    """
+    started = time.perf_counter()
+    default_frequency = default_pay_frequency()
+    anchor = biweekly_anchor()
+    only = 'AND a.employee_ref = ?' if employee_ref is not None else ''
+    params = (employee_ref,) if employee_ref is not None else ()
+
+    # Deleting first takes the write lock, so no punch lands between the read and the insert
+    conn.execute(f"DELETE FROM payroll_accruals {'WHERE employee_ref = ?' if only else ''}", params)
+    cursor = conn.execute(f'''SELECT a.employee_ref, e.pay_frequency, a.date, a.hours_worked, a.overtime_hours
+                              FROM attendance a JOIN employees e ON e.id = a.employee_ref
+                              WHERE a.hours_worked IS NOT NULL {only}''', params)
+
+    periods = {}
+    totals = {}
+    for ref, frequency, day, hours_worked, overtime in stream(cursor):
+        frequency = pay_frequency(frequency, default_frequency)
+        period = periods.get((frequency, day))
+        if period is None:
+            period = periods[frequency, day] = period_containing(frequency, date.fromisoformat(day), anchor)
+        regular = hours_worked - overtime
+        entry = totals.get((ref, period))
+        if entry is None:
+            totals[ref, period] = [1, regular, overtime]
+        else:
+            entry[0] += 1
+            entry[1] += regular
+            entry[2] += overtime
+
+    conn.executemany(UPSERT_SQL, [(ref, period.key) + period.bounds() + tuple(entry)
+                                  for (ref, period), entry in totals.items()])
+    logger.info("Rebuilt %d payroll accruals in %.1f ms", len(totals), (time.perf_counter() - started) * 1000)
+    return len(totals)
+
+def earned_so_far(conn, employee, day=None):
+    """Live pay estimate for the employee's current period, read from its accrual row"""
+    frequency = pay_frequency(employee['pay_frequency'], default_pay_frequency())
+    period = period_containing(frequency, day or date.today(), biweekly_anchor())
+    row = conn.execute('''SELECT days_worked, regular_hours, overtime_hours FROM payroll_accruals
+                          WHERE employee_ref = ? AND period = ?''', (employee['id'], period.key)).fetchone()
+    days_worked, regular_hours, overtime_hours = row if row else (0, 0.0, 0.0)
+    base_salary, overtime, deductions, bonuses, net_pay = (
+        float(value[0]) for value in apply_rules(np.array([employee['salary_rate'] or 0.0]), np.array([days_worked]),
+                                                 np.array([overtime_hours]), PayRules.from_settings(),
+                                                 business_calendar().expected_days([period])[0], period.month_share))
+    return {
+        'period': period, 'days_worked': days_worked, 'regular_hours': regular_hours,
+        'overtime_hours': overtime_hours, 'base_salary': base_salary, 'overtime': overtime,
+        'deductions': deductions, 'bonuses': bonuses, 'net_pay': net_pay,
+    }
+
+@job_handler('rebuild_accruals')
+def rebuild_accruals_job(job):
+    """Background re-accrual after ACCRUAL_SETTINGS change; params say whether overtime is re-split first"""
+    conn = get_db_connection()
+    try:
+        days = 0
+        if job.params.get('refresh_overtime'):
+            job.progress(0.0, message='Re-splitting overtime at the new office hours', force=True)
+            days = refresh_overtime(conn)
+        job.progress(0.3, message='Rebuilding payroll accruals from attendance', force=True)
+        accruals = rebuild_accruals(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'attendance_days': days, 'accruals': accruals}
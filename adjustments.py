@@ -0,0 +1,115 @@
+"""
+Retroactive payroll adjustments
+Attendance written for an already-paid period marks the (employee, period)
+pair dirty (database triggers); the reconciler recomputes only those pairs
+and records each difference as an adjustment carried into the employee's
+next unpaid period, so closed periods are never regenerated
+"""
+
+import logging
+import time
+from datetime import timedelta
+from database import get_db_connection
+from jobs import job_handler
+from pay_periods import pay_frequency, period_containing
+from payroll_diff import PAYROLL_FIELDS, TOLERANCE
+from payroll_engine import PayRules, biweekly_anchor, default_pay_frequency, recompute_paid, resolve_period
+from repository import Record
+
+logger = logging.getLogger(__name__)
+
+# Periods looked at past the corrected one for an unpaid period to carry its delta into
+MAX_LOOKAHEAD = 120
+
+class Adjustment(Record):
+    __slots__ = ('id', 'employee_id', 'name', 'source_period', 'target_period', 'base_salary', 'overtime',
+                 'deductions', 'bonuses', 'net_pay', 'created_at')
+
+def dirty_count(conn):
+    return conn.execute('SELECT COUNT(*) FROM payroll_dirty').fetchone()[0]
+
+def next_unpaid_period(conn, employee_ref, frequency, after):
+    """The employee's first period of frequency starting after `after` ends with no payroll row for them yet.
+
+    With a frequency changed since `after` was paid, the period containing
+    the next day can start inside `after`; its days there would be paid twice.
+    """
+    anchor = biweekly_anchor()
+    period = period_containing(frequency, after.end + timedelta(days=1), anchor)
+    if period.start <= after.end:
+        period = period.following(anchor)
+    for _ in range(MAX_LOOKAHEAD):
+        if conn.execute('SELECT 1 FROM payroll WHERE employee_ref = ? AND period = ?',
+                        (employee_ref, period.key)).fetchone() is None:
+            break
+        period = period.following(anchor)
+    return period
+
+def reconcile_pair(conn, employee_ref, period_key, rules):
+    """Recompute one paid (employee, period) pair and record the difference; the caller commits.
+
+    The pair is recomputed from attendance under the salary rate and pay
+    rules it was paid with (see recompute_paid), plus the adjustments
+    already carried into or out of it, so only the attendance correction is
+    carried and reconciling twice never pays it twice. Returns the new
+    adjustment's id, or None when the stored pay still matches.
+    """
+    stored = conn.execute(f'''SELECT {', '.join(PAYROLL_FIELDS)}, pay_basis FROM payroll
+                              WHERE employee_ref = ? AND period = ?''', (employee_ref, period_key)).fetchone()
+    employee = conn.execute('SELECT pay_frequency FROM employees WHERE id = ?', (employee_ref,)).fetchone()
+    if stored is None or employee is None:
+        return None
+    period = resolve_period(period_key)
+    computed = recompute_paid(conn, period, employee_ref, stored[-1], rules)
+    delta = [new - (old or 0.0) for new, old in zip(computed, stored[:-1])]
+    if all(abs(amount) <= TOLERANCE for amount in delta):
+        return None
+    target = next_unpaid_period(conn, employee_ref, pay_frequency(employee[0], default_pay_frequency()), period)
+    return conn.execute(f'''INSERT INTO payroll_adjustments(employee_ref, source_period, target_period,
+                                                            {', '.join(PAYROLL_FIELDS)})
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            RETURNING id''', (employee_ref, period_key, target.key) + tuple(delta)).fetchone()[0]
+
+def reconcile(conn, progress=None):
+    """Reconcile every dirty pair, each in its own transaction.
+
+    progress(done, total) is called after each pair (background jobs).
+    Returns {'pairs': reconciled, 'adjustments': created}.
+    """
+    started = time.perf_counter()
+    rules = PayRules.from_settings()
+    pairs = conn.execute('SELECT employee_ref, period FROM payroll_dirty ORDER BY marked_at').fetchall()
+    conn.commit()
+    reconciled = created = 0
+    for number, (employee_ref, period_key) in enumerate(pairs, 1):
+        try:
+            # Deleting the mark claims the pair; a correction committed after this marks it again
+            if conn.execute('DELETE FROM payroll_dirty WHERE employee_ref = ? AND period = ?',
+                            (employee_ref, period_key)).rowcount:
+                reconciled += 1
+                created += reconcile_pair(conn, employee_ref, period_key, rules) is not None
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if progress:
+            progress(number, len(pairs))
+    logger.info("Reconciled %d payroll periods (%d adjustments) in %.1f ms", reconciled, created,
+                (time.perf_counter() - started) * 1000)
+    return {'pairs': reconciled, 'adjustments': created}
+
+def pending_adjustments(conn, limit=50):
+    """Adjustments whose target period hasn't been generated yet, newest first"""
+    rows = conn.execute(f'''SELECT a.id, e.employee_id, e.name, a.source_period, a.target_period,
+                                   {', '.join(f'a.{field}' for field in PAYROLL_FIELDS)}, a.created_at
+                            FROM payroll_adjustments a JOIN employees e ON e.id = a.employee_ref
+                            WHERE NOT EXISTS (SELECT 1 FROM payroll p WHERE p.employee_ref = a.employee_ref
+                                                                          AND p.period = a.target_period)
+                            ORDER BY a.id DESC
+                            LIMIT ?''', (limit,)).fetchall()
+    return [Adjustment(*row) for row in rows]
+
+@job_handler('reconcile_payroll')
+def reconcile_job(job):
+    """Background reconciliation of the dirty pairs"""
+    return reconcile(get_db_connection(), progress=job.progress)
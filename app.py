@@ -4,6 +4,10 @@ from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 from security_config import configure_security, UPLOAD_FOLDERS
 from datetime import timedelta
+import database
+from settings_cache import settings_cache
+from request_metrics import request_metrics
+from jobs import job_queue
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,9 +17,18 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Request latency metrics (registered first so they time every other hook)
+request_metrics.init_app(app)
+
 # Configure security
 csrf, limiter = configure_security(app)
 
+# One pooled database connection per request
+database.init_app(app)
+
+# Background job workers (payroll runs, exports)
+job_queue.init_app(app)
+
 # Configure upload folders
 for folder_type, folder_path in UPLOAD_FOLDERS.items():
     os.makedirs(folder_path, exist_ok=True)
@@ -29,14 +42,10 @@ os.makedirs('static/images', exist_ok=True)
 def load_global_context():
     if session.get('user_id'):
         # Load current logo for all authenticated pages
-        conn = database.get_db_connection()
         try:
-            logo_setting = conn.execute("SELECT setting_value FROM settings WHERE setting_name = 'system_logo'").fetchone()
-            g.current_logo = logo_setting['setting_value'] if logo_setting else None
+            g.current_logo = settings_cache.get('system_logo')
         except:
             g.current_logo = None
-        finally:
-            conn.close()
     else:
         g.current_logo = None
 
@@ -54,6 +63,7 @@ from routes.exports import exports_bp
 from routes.applications import applications_bp
 from routes.chat import chat_bp
 from routes.security import security_bp
+from routes.jobs import jobs_bp
 from auth import auth_bp
 
 app.register_blueprint(auth_bp)
@@ -66,10 +76,12 @@ app.register_blueprint(exports_bp)
 app.register_blueprint(applications_bp)
 app.register_blueprint(chat_bp)
 app.register_blueprint(security_bp)
+app.register_blueprint(jobs_bp, url_prefix='/jobs')
+# Job pages poll their status every second for as long as a job runs
+limiter.exempt(jobs_bp)
 
 from auth import login_required
 from flask import render_template, redirect, url_for, session, g
-import database
 
 @app.route('/')
 def index():
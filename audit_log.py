@@ -0,0 +1,143 @@
+"""
+Buffered security audit log
+Queues audit events and writes them to security_logs in batches from a
+background thread, so logins and kiosk punches don't wait on an audit commit
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from database import backend, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Flush every FLUSH_INTERVAL_MS or every FLUSH_BATCH_SIZE events, whichever comes first
+FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 200))
+FLUSH_BATCH_SIZE = int(os.environ.get('AUDIT_FLUSH_BATCH_SIZE', 100))
+QUEUE_MAX_SIZE = int(os.environ.get('AUDIT_QUEUE_MAX_SIZE', 10000))
+
+# How long a caller waits for room in a full queue before writing its event itself
+OVERFLOW_WAIT_MS = int(os.environ.get('AUDIT_OVERFLOW_WAIT_MS', 500))
+
+INSERT_SQL = '''INSERT INTO security_logs (event_type, user_id, ip_address, user_agent, event_description, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)'''
+
+_STOP = object()
+
+class AuditLogWriter:
+    """Group-commit writer for security_logs.
+
+    Overflow policy: the queue holds at most QUEUE_MAX_SIZE events. When it is
+    full the caller waits up to OVERFLOW_WAIT_MS for room, then writes its
+    event synchronously on a connection of its own (never the request's, whose
+    unfinished work must not be committed or rolled back with it), so audit
+    records are never dropped; under sustained overload logging just loses
+    the batching benefit until the writer catches up.
+    """
+
+    def __init__(self, interval_ms=FLUSH_INTERVAL_MS, batch_size=FLUSH_BATCH_SIZE, max_queue=QUEUE_MAX_SIZE,
+                 overflow_wait_ms=OVERFLOW_WAIT_MS):
+        self.interval = interval_ms / 1000.0
+        self.overflow_wait = overflow_wait_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.written = 0
+        self.overflowed = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def log(self, event_type, user_id, ip_address, description, user_agent=None):
+        """Queue one audit event; the timestamp is taken now, not at write time"""
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        row = (event_type, user_id, ip_address, user_agent, description, timestamp)
+        try:
+            self._ensure_started().put(row, timeout=self.overflow_wait)
+        except queue.Full:
+            self.overflowed += 1
+            with backend.dedicated_connection() as conn:
+                self._write([row], conn)
+
+    def _ensure_started(self):
+        # Threads don't survive fork(), so each worker process starts its own
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                    self._thread.start()
+        return self._queue
+
+    def _run(self):
+        events = self._queue
+        stopping = False
+        while not stopping:
+            item = events.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+        # Shutting down: write whatever is still queued
+        leftover = []
+        while True:
+            try:
+                item = events.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._write(leftover)
+
+    def _write(self, rows, conn=None):
+        conn = conn or get_db_connection()
+        try:
+            conn.executemany(INSERT_SQL, rows)
+            conn.commit()
+            self.written += len(rows)
+        except Exception:
+            conn.rollback()
+            logger.exception("Failed to write %d audit events", len(rows))
+        finally:
+            conn.close()
+
+    def close(self, timeout=5.0):
+        """Flush queued events and stop the writer thread (registered with atexit)"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'written': self.written,
+            'overflowed': self.overflowed,
+        }
+
+audit_writer = AuditLogWriter()
+atexit.register(audit_writer.close)
@@ -2,7 +2,7 @@ from flask import Blueprint, request, render_template, redirect, url_for, sessio
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from database import get_db_connection, log_security_event
-import bcrypt
+from password_hashing import verify_password, upgrade_on_login
 from datetime import datetime, timedelta
 import secrets
 import bleach
@@ -62,11 +62,14 @@ def login():
         password = request.form['password']
         
         conn = get_db_connection()
-        user = conn.execute('SELECT * FROM employees WHERE username = ? AND status = "Active"', 
+        user = conn.execute("SELECT * FROM employees WHERE username = ? AND status = 'Active'", 
                            (username,)).fetchone()
         conn.close()
         
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
+        if user and verify_password(password, user['password']):
+            # Bring hashes below the current cost policy up to date while we have the plain text
+            upgrade_on_login(get_db_connection(), user, password)
+            
             # Generate secure session token
             session_token = secrets.token_urlsafe(32)
             session['user_id'] = user['id']
@@ -9,7 +9,8 @@ import shutil
 import gzip
 import json
 from datetime import datetime, timedelta
-from database import get_db_connection, log_security_event
+from database import get_db_connection, log_security_event, get_schema_version, backend, DB_NAME
+from sql_profiler import unwrap
 import threading
 import time
 
@@ -18,7 +19,7 @@ class BackupManager:
     
     def __init__(self, backup_dir="backups"):
         self.backup_dir = backup_dir
-        self.db_name = "payroll_system.db"
+        self.db_name = DB_NAME
         self.max_backups = 30  # Keep 30 days of backups
         
         # Create backup directory
@@ -26,6 +27,9 @@ class BackupManager:
     
     def create_full_backup(self, compress=True):
         """Create a complete database backup"""
+        if backend.dialect != 'sqlite':
+            return False, "File backups are only available for SQLite; use pg_dump for PostgreSQL"
+        
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_filename = f"payroll_backup_{timestamp}"
@@ -35,13 +39,15 @@ class BackupManager:
             else:
                 backup_path = os.path.join(self.backup_dir, f"{backup_filename}.db")
             
-            # Create backup
+            # Create backup from a consistent snapshot (the raw file alone
+            # misses commits still sitting in the WAL)
+            snapshot_path = os.path.join(self.backup_dir, f"{backup_filename}.db")
+            self.snapshot_database(snapshot_path)
             if compress:
                 with gzip.open(backup_path, 'wb') as gz_file:
-                    with open(self.db_name, 'rb') as db_file:
+                    with open(snapshot_path, 'rb') as db_file:
                         shutil.copyfileobj(db_file, gz_file)
-            else:
-                shutil.copy2(self.db_name, backup_path)
+                os.remove(snapshot_path)
             
             # Create metadata file
             metadata = {
@@ -70,21 +76,31 @@ class BackupManager:
     
     def restore_backup(self, backup_path, user_id=None):
         """Restore database from backup"""
+        if backend.dialect != 'sqlite':
+            return False, "File restores are only available for SQLite; use pg_restore for PostgreSQL"
+        
         try:
             if not os.path.exists(backup_path):
                 return False, "Backup file not found"
             
             # Create a backup of current database before restore
             current_backup_path = f"{self.db_name}.pre_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            shutil.copy2(self.db_name, current_backup_path)
+            self.snapshot_database(current_backup_path)
             
             # Restore from backup
             if backup_path.endswith('.gz'):
+                restore_source = f"{self.db_name}.restore_tmp"
                 with gzip.open(backup_path, 'rb') as gz_file:
-                    with open(self.db_name, 'wb') as db_file:
+                    with open(restore_source, 'wb') as db_file:
                         shutil.copyfileobj(gz_file, db_file)
             else:
-                shutil.copy2(backup_path, self.db_name)
+                restore_source = backup_path
+            
+            try:
+                self.load_database(restore_source)
+            finally:
+                if restore_source != backup_path and os.path.exists(restore_source):
+                    os.remove(restore_source)
             
             # Log restore operation
             log_security_event('DATABASE_RESTORED', user_id, 'system', 
@@ -95,18 +111,40 @@ class BackupManager:
         except Exception as e:
             # Try to restore the pre-restore backup if restoration failed
             if 'current_backup_path' in locals() and os.path.exists(current_backup_path):
-                shutil.copy2(current_backup_path, self.db_name)
+                self.load_database(current_backup_path)
             
             log_security_event('RESTORE_FAILED', user_id, 'system', f"Restore failed: {str(e)}")
             return False, str(e)
     
+    def snapshot_database(self, target_path):
+        """Copy the live database to target_path using the SQLite online backup API"""
+        source = unwrap(get_db_connection())
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    
+    def load_database(self, source_path):
+        """Overwrite the live database with source_path through the backup API.
+        
+        Writing pages through SQLite (instead of copying over the file) keeps the
+        WAL and every open pooled connection consistent.
+        """
+        source = sqlite3.connect(source_path)
+        target = unwrap(get_db_connection())
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+    
     def get_database_version(self):
         """Get database schema version"""
         try:
             conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA user_version")
-            version = cursor.fetchone()[0]
+            version = get_schema_version(conn)
             conn.close()
             return version
         except:
@@ -247,5 +285,6 @@ class AutoBackupScheduler:
 backup_manager = BackupManager()
 auto_scheduler = AutoBackupScheduler(backup_manager)
 
-# Start automated backups (daily)
-auto_scheduler.start_scheduler(interval_hours=24)
\ No newline at end of file
+# Start automated backups (daily); PostgreSQL deployments back up with pg_dump
+if backend.dialect == 'sqlite':
+    auto_scheduler.start_scheduler(interval_hours=24)
\ No newline at end of file
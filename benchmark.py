@@ -0,0 +1,259 @@
+"""
+Benchmark suite
+Times the hot paths (payroll generation, kiosk scans, chat dashboard,
+attendance report, payroll export and full backup) through the Flask test
+client and stores the results as JSON so runs can be compared
+"""
+
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from database import get_db_connection, backend
+
+logger = logging.getLogger(__name__)
+
+# Result files land here as <timestamp>[_<label>].json
+BENCHMARK_DIR = os.environ.get('BENCHMARK_DIR', 'benchmark_results')
+
+# Longest a queued job may take before the benchmark gives up on it (seconds)
+JOB_TIMEOUT = 1800
+
+# Tables counted (before the run) into each result file, so runs at different scales aren't compared by mistake
+COUNTED_TABLES = ('employees', 'attendance', 'leaves', 'payroll', 'chat_messages', 'security_logs')
+
+BENCHMARKS = []
+
+def benchmark(fn):
+    """Register fn(run) as part of the suite; it calls run.measure() for each timed path"""
+    BENCHMARKS.append(fn)
+    return fn
+
+class BenchmarkRun:
+    """One pass over the suite: logged-in test clients, timing and the collected samples"""
+
+    def __init__(self, app, repeat=5, warmup=1, echo=logger.info):
+        self.app = app
+        self.repeat = repeat
+        self.warmup = warmup
+        self.echo = echo
+        self.results = {}
+        self.skipped = {}
+
+    def client(self, role, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, role=role, name='Benchmark', username='benchmark',
+                           login_time=datetime.now().isoformat())
+        return client
+
+    def measure(self, name, action, setup=None):
+        """Time action() `repeat` times after `warmup` untimed calls; setup() runs untimed before each"""
+        samples = []
+        for number in range(self.warmup + self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            action()
+            elapsed = (time.perf_counter() - started) * 1000
+            if number >= self.warmup:
+                samples.append(elapsed)
+        ordered = sorted(samples)
+        self.results[name] = {
+            'samples_ms': [round(sample, 3) for sample in samples],
+            'min_ms': round(ordered[0], 3),
+            'median_ms': round(statistics.median(ordered), 3),
+            'mean_ms': round(statistics.fmean(ordered), 3),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+            'max_ms': round(ordered[-1], 3),
+        }
+        self.echo(f"{name}: median {self.results[name]['median_ms']:.1f} ms "
+                  f"(min {self.results[name]['min_ms']:.1f}, max {self.results[name]['max_ms']:.1f})")
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+        self.echo(f'{name}: skipped ({reason})')
+
+def _check(response, *expected):
+    body = response.get_data()  # consume streamed templates so rendering is timed
+    if response.status_code not in expected:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}: {body[:200]!r}')
+    return response
+
+def _wait_for_job(response):
+    """Follow a job-page redirect and block until the job finishes; raises if it failed"""
+    from jobs import job_queue, FINISHED, SUCCEEDED
+    job_id = _check(response, 302).headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while True:
+        job = job_queue.get(job_id)
+        if job['status'] in FINISHED:
+            if job['status'] != SUCCEEDED:
+                raise RuntimeError(f"Job {job_id} ({job['kind']}) {job['status']}: {job['error']}")
+            return job
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'Job {job_id} did not finish within {JOB_TIMEOUT} s')
+        time.sleep(0.01)
+
+def _admin_id(conn):
+    return conn.execute("SELECT id FROM employees WHERE role = 'Admin' ORDER BY id LIMIT 1").fetchone()[0]
+
+@benchmark
+def payroll_generation(run):
+    """admin.payroll: generate the current default period, from the form post to the finished job"""
+    from payroll_engine import current_period
+    conn = get_db_connection()
+    client = run.client('Admin', _admin_id(conn))
+    period = current_period()
+
+    def clear_period():
+        conn.execute('DELETE FROM payroll WHERE period = ?', (period.key,))
+        conn.commit()
+
+    run.measure('admin.payroll', lambda: _wait_for_job(client.post('/admin/payroll', data={
+        'kind': period.kind, 'day': period.start.isoformat(), 'job_key': uuid.uuid4().hex})), setup=clear_period)
+
+@benchmark
+def kiosk_scans(run):
+    """kiosk.scan_process: a time-in and a time-out for employees who haven't punched today"""
+    conn = get_db_connection()
+    needed = run.warmup + run.repeat
+    employee_ids = [row[0] for row in conn.execute('''
+        SELECT e.employee_id FROM employees e
+        WHERE e.status = 'Active' AND NOT EXISTS (SELECT 1 FROM attendance a
+                                                  WHERE a.employee_ref = e.id AND a.date = ?)
+        ORDER BY e.id LIMIT ?''', (date.today().isoformat(), needed)).fetchall()]
+    conn.commit()
+    if len(employee_ids) < needed:
+        return run.skip('kiosk.scan_process', f'needs {needed} active employees without a punch today')
+    client = run.app.test_client()
+
+    def scan(queue):
+        response = _check(client.post('/kiosk/scan_process', json={'scanData': queue.pop()}), 200)
+        if not response.get_json()['success']:
+            raise RuntimeError(response.get_json()['message'])
+
+    time_ins, time_outs = list(employee_ids), list(employee_ids)
+    run.measure('kiosk.scan_process (time-in)', lambda: scan(time_ins))
+    run.measure('kiosk.scan_process (time-out)', lambda: scan(time_outs))
+
+@benchmark
+def chat_dashboard(run):
+    """chat.chat_dashboard for the employee who belongs to the most rooms"""
+    conn = get_db_connection()
+    row = conn.execute('''SELECT member_id FROM room_memberships WHERE member_type = 'employee'
+                          GROUP BY member_id ORDER BY COUNT(*) DESC, member_id LIMIT 1''').fetchone()
+    conn.commit()
+    if row is None:
+        return run.skip('chat.chat_dashboard', 'no chat memberships')
+    client = run.client('Employee', row[0])
+    run.measure('chat.chat_dashboard', lambda: _check(client.get('/chat'), 200))
+
+@benchmark
+def attendance_report(run):
+    client = run.client('HR', _admin_id(get_db_connection()))
+    run.measure('hr.attendance_report', lambda: _check(client.get('/hr/attendance_report'), 200))
+
+@benchmark
+def payroll_export(run):
+    """/export/payroll: every payroll row into a workbook, from the request to the finished file"""
+    client = run.client('Admin', _admin_id(get_db_connection()))
+    run.measure('exports.export_payroll',
+                lambda: _wait_for_job(client.get(f'/export/payroll?job_key={uuid.uuid4().hex}')))
+
+@benchmark
+def full_backup(run):
+    if backend.dialect != 'sqlite':
+        return run.skip('BackupManager.create_full_backup', 'file backups are SQLite only')
+    from backup_system import BackupManager
+    backup_dir = tempfile.mkdtemp(prefix='payroll_benchmark_')
+    try:
+        manager = BackupManager(backup_dir=backup_dir)
+
+        def backup():
+            ok, detail = manager.create_full_backup()
+            if not ok:
+                raise RuntimeError(detail)
+
+        run.measure('BackupManager.create_full_backup', backup)
+    finally:
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def table_counts():
+    conn = get_db_connection()
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in COUNTED_TABLES}
+    conn.commit()
+    return counts
+
+def run_benchmarks(app, repeat=5, warmup=1, only=None, label=None, output_dir=BENCHMARK_DIR, echo=logger.info):
+    """Run the suite (or the benchmarks named in only) and write a JSON result file; returns its path.
+
+    Benchmarks write to the database (payroll rows, punches, exports), so
+    point the app at a seeded copy, never at production data.
+    """
+    from jobs import job_queue, WORKERS
+    # CSRF and rate limits would reject or throttle the test client's rapid requests
+    app.config['WTF_CSRF_ENABLED'] = False
+    for limiter in app.extensions.get('limiter', ()):
+        limiter.enabled = False
+    job_queue.ensure_started(max(WORKERS, 1))
+
+    with app.app_context():
+        counts = table_counts()
+    run = BenchmarkRun(app, repeat=repeat, warmup=warmup, echo=echo)
+    started = datetime.now()
+    for fn in BENCHMARKS:
+        if only and fn.__name__ not in only:
+            continue
+        with app.app_context():
+            fn(run)
+
+    result = {
+        'label': label,
+        'started_at': started.isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backend.dialect,
+        'table_counts': counts,
+        'repeat': repeat,
+        'warmup': warmup,
+        'results': run.results,
+        'skipped': run.skipped,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    name = started.strftime('%Y%m%d_%H%M%S') + (f'_{label}' if label else '')
+    path = os.path.join(output_dir, f'{name}.json')
+    with open(path, 'w') as result_file:
+        json.dump(result, result_file, indent=2)
+    return path
+
+def compare(before_path, after_path):
+    """Lines comparing the median of every benchmark in two result files"""
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    lines = []
+    # Other tables grow with every run (punches, payroll, logs); the workforce size is what matters
+    if before.get('table_counts', {}).get('employees') != after.get('table_counts', {}).get('employees'):
+        lines.append('Warning: the runs used different numbers of employees')
+    lines.append(f"{'benchmark':<36} {'before ms':>12} {'after ms':>12} {'change':>9}")
+    for name in sorted(set(before['results']) | set(after['results'])):
+        old = before['results'].get(name, {}).get('median_ms')
+        new = after['results'].get(name, {}).get('median_ms')
+        change = f'{(new - old) / old * 100:+.1f}%' if old and new is not None else 'n/a'
+        lines.append(f"{name:<36} {old if old is not None else '-':>12} {new if new is not None else '-':>12} {change:>9}")
+    return lines
@@ -0,0 +1,184 @@
+"""
+Business calendar
+Working days from the work_week and holidays settings on NumPy business-day
+primitives, shared by payroll, leave management and the attendance report:
+expected days per period, working days inside leave ranges and absence
+counts are answered for whole arrays of ranges at once
+"""
+
+import logging
+import threading
+from datetime import date
+import numpy as np
+from repository import Record
+from settings_cache import settings_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORK_WEEK = 'Mon Tue Wed Thu Fri'
+
+_DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+def parse_work_week(text):
+    """NumPy weekmask ('1111100') from 'Mon Tue Wed Thu Fri', 'Mon-Fri' or a 7-digit mask.
+
+    Anything unreadable, or a week without working days, falls back to Monday to Friday.
+    """
+    value = (text or '').strip().lower().replace(',', ' ')
+    if len(value) == 7 and set(value) <= {'0', '1'} and '1' in value:
+        return value
+    days = set()
+    try:
+        for part in value.split():
+            first, _, last = part.partition('-')
+            start = _DAY_NAMES.index(first[:3])
+            end = _DAY_NAMES.index(last[:3]) if last else start
+            days.update(range(start, end + 1) if start <= end else [*range(start, 7), *range(end + 1)])
+    except ValueError:
+        days = set()
+    if not days:
+        logger.warning("Invalid work_week setting %r, using %s", text, DEFAULT_WORK_WEEK)
+        return '1111100'
+    return ''.join('1' if day in days else '0' for day in range(7))
+
+def as_dates(values):
+    """datetime64[D] array from dates or ISO strings; unreadable values become NaT"""
+    values = [value.isoformat() if isinstance(value, date) else value for value in np.ravel(values).tolist()]
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        # Free-text leave dates: convert one by one so a bad row can't break the whole batch
+        dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[D]')
+        for i, value in enumerate(values):
+            try:
+                dates[i] = np.datetime64(str(value).strip()[:10], 'D')
+            except ValueError:
+                pass
+        return dates
+
+def parse_holidays(text):
+    """Sorted unique datetime64[D] array of the ISO dates in a comma or whitespace separated list"""
+    holidays = as_dates([part for part in (text or '').replace(',', ' ').split()])
+    if np.isnat(holidays).any():
+        logger.warning("Ignoring invalid dates in holidays setting %r", text)
+    return np.unique(holidays[~np.isnat(holidays)])
+
+class BusinessCalendar:
+    """Working days of one work week and holiday list"""
+
+    def __init__(self, weekmask='1111100', holidays=()):
+        self.weekmask = weekmask
+        self.holidays = np.asarray(holidays, dtype='datetime64[D]')
+        self.busdaycal = np.busdaycalendar(weekmask=weekmask, holidays=self.holidays)
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def year_mask(self, year):
+        """Boolean working-day mask over every day of year, built once"""
+        mask = self._masks.get(year)
+        if mask is None:
+            first = np.datetime64(f'{year:04d}-01-01')
+            days = np.arange(first, np.datetime64(f'{year + 1:04d}-01-01'))
+            mask = np.is_busday(days, busdaycal=self.busdaycal)
+            with self._lock:
+                mask = self._masks.setdefault(year, mask)
+        return mask
+
+    def is_working_day(self, days):
+        """Boolean array: which of the dates are working days (NaT is not)"""
+        days = as_dates(days)
+        result = np.zeros(len(days), dtype=bool)
+        valid = ~np.isnat(days)
+        years = days[valid].astype('datetime64[Y]')
+        offsets = (days[valid] - years).astype(int)
+        years = years.astype(int) + 1970
+        flags = np.zeros(len(offsets), dtype=bool)
+        for year in np.unique(years).tolist():
+            rows = years == year
+            flags[rows] = self.year_mask(year)[offsets[rows]]
+        result[valid] = flags
+        return result
+
+    def working_days(self, starts, ends):
+        """Working days in each inclusive [start, end] range; empty or unreadable ranges count 0"""
+        starts, ends = as_dates(starts), as_dates(ends)
+        valid = ~(np.isnat(starts) | np.isnat(ends)) & (ends >= starts)
+        counts = np.zeros(len(starts), dtype=int)
+        counts[valid] = np.busday_count(starts[valid], ends[valid] + 1, busdaycal=self.busdaycal)
+        return counts
+
+    def expected_days(self, periods):
+        """Working days in each PayPeriod"""
+        return self.working_days([period.start for period in periods], [period.end for period in periods])
+
+    def working_dates(self, start, end):
+        """The working days from start to end inclusive, as dates"""
+        days = np.arange(as_dates([start])[0], as_dates([end])[0] + 1)
+        return days[self.is_working_day(days)].tolist()
+
+    def leave_days(self, leaves):
+        """Working days taken by each (duration, start_date, end_date); half-day leaves count half"""
+        if not leaves:
+            return np.zeros(0)
+        durations, starts, ends = zip(*leaves)
+        share = np.array([0.5 if duration == 'Half' else 1.0 for duration in durations])
+        return self.working_days(starts, ends) * share
+
+_calendar = None
+
+def business_calendar():
+    """The calendar of the current work_week and holidays settings, rebuilt when they change"""
+    global _calendar
+    key = (settings_cache.get('work_week'), settings_cache.get('holidays'))
+    calendar = _calendar
+    if calendar is None or calendar[0] != key:
+        calendar = (key, BusinessCalendar(parse_work_week(key[0]), parse_holidays(key[1])))
+        _calendar = calendar
+    return calendar[1]
+
+def leave_days_by_id(leaves, calendar=None):
+    """{id: working days} for leave rows with id, duration, start_date and end_date"""
+    days = (calendar or business_calendar()).leave_days(
+        [(leave['duration'], leave['start_date'], leave['end_date']) for leave in leaves])
+    return dict(zip((leave['id'] for leave in leaves), days.tolist()))
+
+class Absences(Record):
+    __slots__ = ('employee_ref', 'employee_id', 'name', 'department', 'expected', 'attended', 'on_leave', 'absent')
+
+def absence_counts(conn, start, end, calendar=None):
+    """Absences of every active employee over the inclusive [start, end], most absent first.
+
+    Expected is the working days in the range, attended the working days with
+    a time-in, on_leave the working days of approved leave (clipped to the
+    range) and absent what is left of expected, never below zero.
+    """
+    calendar = calendar or business_calendar()
+    start, end = as_dates([start])[0], as_dates([end])[0]
+    bounds = (str(start), str(end))
+    employees = conn.execute('''SELECT id, employee_id, name, department FROM employees
+                                WHERE status = 'Active' ORDER BY employee_id''').fetchall()
+    index = {row[0]: i for i, row in enumerate(employees)}
+    expected = int(calendar.working_days([start], [end])[0])
+
+    attendance = [(index[ref], day) for ref, day in conn.execute(
+        '''SELECT DISTINCT employee_ref, date FROM attendance
+           WHERE date BETWEEN ? AND ? AND time_in IS NOT NULL''', bounds) if ref in index]
+    attended = np.zeros(len(employees), dtype=int)
+    if attendance:
+        rows, days = zip(*attendance)
+        attended = np.bincount(np.array(rows)[calendar.is_working_day(days)], minlength=len(employees))
+
+    leaves = [(index[ref], duration, start_date, end_date) for ref, duration, start_date, end_date in conn.execute(
+        '''SELECT employee_ref, duration, start_date, end_date FROM leaves
+           WHERE status = 'Approved' AND start_date <= ? AND end_date >= ?''', bounds[::-1]) if ref in index]
+    on_leave = np.zeros(len(employees))
+    if leaves:
+        rows, durations, starts, ends = zip(*leaves)
+        starts, ends = np.maximum(as_dates(starts), start), np.minimum(as_dates(ends), end)
+        on_leave = np.bincount(np.array(rows), weights=calendar.leave_days(list(zip(durations, starts, ends))),
+                               minlength=len(employees))
+
+    absent = np.maximum(0.0, expected - attended - on_leave)
+    order = np.argsort(-absent, kind='stable')
+    return [Absences(employees[i][0], employees[i][1], employees[i][2], employees[i][3], expected,
+                     int(attended[i]), float(on_leave[i]), float(absent[i])) for i in order.tolist()]
@@ -1,21 +1,156 @@
-import sqlite3
-from datetime import datetime, date
 import re
 import os
 import hashlib
+import logging
+import time
+import click
+from flask import g, has_app_context
+from db_backends import create_backend
+import sql_profiler
 
-DB_NAME = "payroll_system.db"
+# SQLite file; point DATABASE_PATH at a scratch copy for seeded benchmark data
+DB_NAME = os.environ.get('DATABASE_PATH', "payroll_system.db")
+
+logger = logging.getLogger(__name__)
+
+# SQLite file by default; PostgreSQL when DATABASE_URL points at a server
+backend = create_backend(DB_NAME)
+
+# How often the report replica (REPORT_REPLICA_PATH) is re-copied from the live database
+REPORT_REPLICA_REFRESH_SECONDS = int(os.environ.get('REPORT_REPLICA_REFRESH_SECONDS', 300))
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return the connection for the current request, or for this thread outside a request"""
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = backend.acquire()
+            conn.request_scoped = True
+            g._db_conn = conn
+            g._db_conn_view = sql_profiler.wrap(conn)
+        return g._db_conn_view
+    return backend.thread_connection()
+
+def get_report_connection(use_replica=True):
+    """Return a read-only connection that sees one consistent snapshot for the rest of the request.
+
+    For heavy reports and exports: it never holds up kiosk writes, and it reads
+    the report replica (if REPORT_REPLICA_PATH is set) unless use_replica is False.
+    """
+    if has_app_context():
+        key = '_report_conn' if use_replica else '_report_conn_primary'
+        view = g.get(f'{key}_view')
+        if view is None:
+            conn = backend.acquire_snapshot(use_replica)
+            conn.request_scoped = True
+            setattr(g, key, conn)
+            view = sql_profiler.wrap(conn)
+            setattr(g, f'{key}_view', view)
+        return view
+    return backend.thread_snapshot(use_replica)
+
+def close_db_connection(exc=None):
+    """Release the request's connection back to the pool, discarding uncommitted work"""
+    g.pop('_db_conn_view', None)
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        backend.release(conn)
+    for key in ('_report_conn', '_report_conn_primary'):
+        g.pop(f'{key}_view', None)
+        conn = g.pop(key, None)
+        if conn is not None:
+            backend.release_snapshot(conn)
+
+def dispose_thread_connection():
+    """Close this thread's pooled connection (for shutdown or after a restore)"""
+    backend.dispose_thread_connection()
+
+def init_app(app):
+    """Register request-scoped connection handling and make sure the schema is current"""
+    app.teardown_appcontext(close_db_connection)
+    sql_profiler.init_app(app)
+    
+    @app.cli.command('bootstrap-db')
+    @click.option('--force', is_flag=True, help='Run every bootstrap step even if the schema looks current.')
+    def bootstrap_db_command(force):
+        """Create or upgrade the database schema and seed defaults."""
+        did_work = bootstrap_database(force=force)
+        click.echo('Database bootstrapped.' if did_work else 'Database already up to date.')
+        click.echo(f'Hashed {migrate_plain_text_passwords()} plain-text passwords.')
+    
+    @app.cli.command('rehash-passwords')
+    def rehash_passwords_command():
+        """Hash plain-text passwords using a process pool."""
+        click.echo(f'Hashed {migrate_plain_text_passwords()} plain-text passwords.')
+    
+    @app.cli.command('rebuild-accruals')
+    def rebuild_accruals_command():
+        """Recompute payroll accruals from attendance."""
+        from accruals import rebuild_accruals
+        conn = get_db_connection()
+        count = rebuild_accruals(conn)
+        conn.commit()
+        click.echo(f'Rebuilt {count} payroll accruals.')
+    
+    @app.cli.command('reconcile-payroll')
+    def reconcile_payroll_command():
+        """Carry attendance corrections in already-paid periods into later payroll."""
+        from adjustments import reconcile
+        result = reconcile(get_db_connection())
+        click.echo(f"Reconciled {result['pairs']} employee periods; {result['adjustments']} adjustments recorded.")
+    
+    @app.cli.command('seed-data')
+    @click.option('--scale', type=click.Choice(['1k', '10k', '100k']), help='Preset employee count and years.')
+    @click.option('--employees', type=int, help='Employees to create (overrides --scale).')
+    @click.option('--years', type=float, help='Years of attendance up to yesterday (overrides --scale).')
+    @click.option('--seed', default=42, show_default=True, help='Random seed; the same seed gives the same data.')
+    @click.option('--force', is_flag=True, help='Seed even though the database already has employees.')
+    def seed_data_command(scale, employees, years, seed, force):
+        """Fill the database with synthetic employees, attendance, leaves, payroll, chat and logs."""
+        from seed_data import SCALES, seed as seed_database
+        conn = get_db_connection()
+        existing = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
+        conn.commit()
+        if existing > 1 and not force:
+            raise click.ClickException(f'The database already has {existing} employees; use a fresh '
+                                       'DATABASE_PATH or pass --force.')
+        preset = SCALES.get(scale, SCALES['1k'])
+        counts = seed_database(employees=employees or preset['employees'], years=years or preset['years'],
+                               seed=seed, echo=click.echo)
+        click.echo(f"Seeded {counts['employees']:,} employees.")
+    
+    @app.cli.command('benchmark')
+    @click.option('--repeat', default=5, show_default=True, help='Timed runs per benchmark.')
+    @click.option('--warmup', default=1, show_default=True, help='Untimed runs before the timed ones.')
+    @click.option('--only', multiple=True, help='Run only this benchmark function (repeatable).')
+    @click.option('--label', help='Suffix for the result file name, e.g. before-index.')
+    @click.option('--compare', 'compare_with', type=click.Path(exists=True, dir_okay=False),
+                  help='Earlier result file to compare this run against.')
+    def benchmark_command(repeat, warmup, only, label, compare_with):
+        """Time the hot paths through the test client and save the results as JSON."""
+        from flask import current_app
+        from benchmark import compare, run_benchmarks
+        path = run_benchmarks(current_app._get_current_object(), repeat=repeat, warmup=warmup,
+                              only=set(only), label=label, echo=click.echo)
+        click.echo(f'Results written to {path}')
+        if compare_with:
+            for line in compare(compare_with, path):
+                click.echo(line)
+    
+    from password_hashing import has_pending_hashes
+    bootstrap_database()
+    # Every worker runs init_app, so bulk hashing is left to the CLI; logins still upgrade their own row
+    if has_pending_hashes():
+        logger.warning("Some passwords are still stored as plain text; run `flask --app main rehash-passwords`")
+    backend.start_replica_refresh(REPORT_REPLICA_REFRESH_SECONDS)
+    # Don't carry the startup connection into forked workers
+    dispose_thread_connection()
 
 def create_tables():
     conn = get_db_connection()
     c = conn.cursor()
     
-    c.execute('''CREATE TABLE IF NOT EXISTS employees(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS employees(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_id TEXT UNIQUE,           -- e.g., EMP001
         username TEXT UNIQUE,
@@ -29,18 +164,18 @@ def create_tables():
         profile_picture TEXT,              -- store file path
         nfc_id TEXT,                       -- NFC card ID for time clock access
         qr_code_path TEXT                  -- QR code image file path
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS attendance(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS attendance(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_ref INTEGER,              -- FK to employees.id
         date TEXT,                         -- YYYY-MM-DD
         time_in TEXT,                      -- HH:MM:SS
         time_out TEXT,                     -- HH:MM:SS
         FOREIGN KEY(employee_ref) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS leaves(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS leaves(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_ref INTEGER,
         type TEXT,                         -- Sick/Vacation/Unpaid/etc.
@@ -50,9 +185,9 @@ def create_tables():
         reason TEXT,
         status TEXT CHECK(status IN ('Pending','Approved','Rejected')) DEFAULT 'Pending',
         FOREIGN KEY(employee_ref) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS payroll(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_ref INTEGER,
         period TEXT,                       -- e.g., Aug-2025 or 2025-08A
@@ -62,9 +197,9 @@ def create_tables():
         bonuses REAL,
         net_pay REAL,
         FOREIGN KEY(employee_ref) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS settings(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS settings(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         setting_name TEXT UNIQUE,
         setting_value TEXT,
@@ -72,10 +207,10 @@ def create_tables():
         updated_by INTEGER,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(updated_by) REFERENCES employees(id)
-    )''')
+    )'''))
 
     # Security audit log table
-    c.execute('''CREATE TABLE IF NOT EXISTS security_logs(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS security_logs(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         event_type TEXT NOT NULL,
         user_id INTEGER,
@@ -84,9 +219,9 @@ def create_tables():
         event_description TEXT,
         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(user_id) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS applications(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS applications(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         application_id TEXT UNIQUE,
         full_name TEXT NOT NULL,
@@ -104,9 +239,9 @@ def create_tables():
         processed_date TIMESTAMP,
         notes TEXT,
         FOREIGN KEY(processed_by) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS chat_rooms(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS chat_rooms(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         room_name TEXT NOT NULL,
         room_type TEXT DEFAULT 'group',    -- 'general', 'group', 'applicant'
@@ -115,9 +250,9 @@ def create_tables():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         is_active INTEGER DEFAULT 1,
         FOREIGN KEY(created_by) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS chat_messages(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS chat_messages(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         room_id INTEGER,
         sender_id INTEGER,
@@ -126,9 +261,9 @@ def create_tables():
         sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(room_id) REFERENCES chat_rooms(id),
         FOREIGN KEY(sender_id) REFERENCES employees(id)
-    )''')
+    )'''))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS room_memberships(
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS room_memberships(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         room_id INTEGER,
         member_id INTEGER,
@@ -137,19 +272,24 @@ def create_tables():
         last_read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(room_id) REFERENCES chat_rooms(id),
         FOREIGN KEY(member_id) REFERENCES employees(id)
-    )''')
+    )'''))
+
+    # Internal key/value state (schema fingerprint, version counters)
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS system_meta(
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )'''))
     
     conn.commit()
     
     # Ensure columns exist
     ensure_columns(conn)
+    run_migrations(conn)
     conn.close()
 
 def ensure_columns(conn):
     def has_col(table, col):
-        c = conn.cursor()
-        c.execute(f"PRAGMA table_info({table})")
-        return any(r[1] == col for r in c.fetchall())
+        return backend.has_column(conn, table, col)
     
     c = conn.cursor()
     # employees: add columns if missing
@@ -160,7 +300,7 @@ def ensure_columns(conn):
     if not has_col('employees', 'status'):
         c.execute("ALTER TABLE employees ADD COLUMN status TEXT DEFAULT 'Active'")
     if not has_col('employees', 'salary_rate'):
-        c.execute("ALTER TABLE employees ADD COLUMN salary_rate REAL DEFAULT 0")
+        c.execute(backend.ddl("ALTER TABLE employees ADD COLUMN salary_rate REAL DEFAULT 0"))
     if not has_col('employees', 'role'):
         c.execute("ALTER TABLE employees ADD COLUMN role TEXT")
     if not has_col('employees', 'nfc_id'):
@@ -176,25 +316,441 @@ def ensure_columns(conn):
     
     conn.commit()
 
+def _migrate_hot_path_indexes(c):
+    # Mirrors the index set in payroll.sql, keyed on the live column names
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attendance_employee_date ON attendance(employee_ref, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_room ON chat_messages(room_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_security_logs_timestamp ON security_logs(timestamp, event_type)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leaves_status ON leaves(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_room_memberships_member ON room_memberships(member_id, room_id)")
+
+def _migrate_unique_payroll_period(c):
+    # Concurrent payroll runs could insert the same employee/period twice; keep the first row,
+    # logging every row dropped in full so an operator can restore it
+    duplicates = c.execute("""SELECT p.id, k.id, p.employee_ref, p.period, p.base_salary, p.overtime,
+                                     p.deductions, p.bonuses, p.net_pay
+                              FROM payroll p
+                              JOIN (SELECT MIN(id) AS id, employee_ref, period FROM payroll
+                                    GROUP BY employee_ref, period) k
+                                ON k.employee_ref = p.employee_ref AND k.period = p.period AND k.id <> p.id
+                              ORDER BY p.id""").fetchall()
+    for row in duplicates:
+        logger.warning("Deleting duplicate payroll row id=%s (keeping id=%s): employee_ref=%s period=%s "
+                       "base_salary=%s overtime=%s deductions=%s bonuses=%s net_pay=%s", *row)
+    c.executemany("DELETE FROM payroll WHERE id = ?", [(row[0],) for row in duplicates])
+    if duplicates:
+        logger.warning("Deleted %d duplicate payroll rows before adding the unique (employee, period) index",
+                       len(duplicates))
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payroll_employee_period ON payroll(employee_ref, period)")
+
+def _migrate_password_cost(c):
+    # Cost factor of each row's bcrypt hash; 0 marks a plain-text password awaiting hashing
+    c.execute("ALTER TABLE employees ADD COLUMN password_cost INTEGER DEFAULT 0")
+    c.execute("""UPDATE employees SET password_cost =
+                 CASE WHEN password LIKE '$2_$%' THEN CAST(substr(password, 5, 2) AS INTEGER) ELSE 0 END""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_employees_password_cost ON employees(password_cost)")
+
+def _max_id_suffix(c, sql, pattern):
+    n = 0
+    for (value,) in c.execute(sql).fetchall():
+        m = re.match(pattern, value or '')
+        if m:
+            n = max(n, int(m.group(1)))
+    return n
+
+def _migrate_sequences(c):
+    # Named counters for human-readable IDs, seeded once from the existing rows
+    c.execute('''CREATE TABLE IF NOT EXISTS sequences(
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )''')
+    seeds = [
+        ('employee_id', _max_id_suffix(c, "SELECT employee_id FROM employees WHERE employee_id IS NOT NULL", r"EMP(\d{3,})$")),
+        ('application_id', _max_id_suffix(c, "SELECT application_id FROM applications WHERE application_id IS NOT NULL", r"APP(\d{4,})$")),
+    ]
+    c.executemany("INSERT INTO sequences (name, value) VALUES (?, ?)", seeds)
+
+def _migrate_attendance_period_index(c):
+    # Lets period-wide payroll aggregates read attendance by date range from the index alone
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date_employee ON attendance(date, employee_ref, time_in, time_out)")
+
+# Payroll rules that used to be hard-coded in admin.payroll, editable on the settings page
+PAYROLL_RULE_SETTINGS = [
+    ('tax_brackets', 'flat', "Marginal tax brackets on gross pay per period as threshold:rate pairs, e.g. 0:0.10, 20000:0.15, 50000:0.25 ('flat' applies tax_rate)"),
+    ('retirement_rate', '0.05', 'Retirement fund contribution as a share of gross pay'),
+    ('attendance_bonus_days', '20', 'Days worked in a period that earn the full attendance bonus'),
+    ('attendance_bonus_pay_days', '2', 'Full attendance bonus, in days of pay'),
+]
+
+PAY_PERIOD_SETTINGS = [
+    ('payroll_period', 'monthly', 'Default pay frequency: monthly, semi-monthly or biweekly (employees can override it)'),
+    ('payroll_biweekly_anchor', '2024-01-01', 'First day of any biweekly pay period (YYYY-MM-DD); the others follow every 14 days'),
+]
+
+def _migrate_payroll_rule_settings(c):
+    c.executemany("""INSERT INTO settings (setting_name, setting_value, description) VALUES (?, ?, ?)
+                     ON CONFLICT (setting_name) DO NOTHING""", PAYROLL_RULE_SETTINGS)
+
+def _migrate_pay_periods(c):
+    # Per-employee pay frequency (NULL follows payroll_period) and each payroll row's date range
+    from pay_periods import parse_period
+    c.execute("ALTER TABLE employees ADD COLUMN pay_frequency TEXT")
+    c.execute("ALTER TABLE payroll ADD COLUMN period_start TEXT")
+    c.execute("ALTER TABLE payroll ADD COLUMN period_end TEXT")
+    ranges = []
+    for (key,) in c.execute("SELECT DISTINCT period FROM payroll").fetchall():
+        try:
+            ranges.append(parse_period(key).bounds() + (key,))
+        except ValueError:
+            logger.warning("Payroll period %r is not a known format; leaving its date range empty", key)
+    c.executemany("UPDATE payroll SET period_start = ?, period_end = ? WHERE period = ?", ranges)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payroll_period_start ON payroll(period_start, period_end)")
+    c.executemany("""INSERT INTO settings (setting_name, setting_value, description) VALUES (?, ?, ?)
+                     ON CONFLICT (setting_name) DO NOTHING""", PAY_PERIOD_SETTINGS)
+    c.execute("UPDATE settings SET description = ? WHERE setting_name = 'payroll_period'",
+              (PAY_PERIOD_SETTINGS[0][2],))
+
+def _migrate_payroll_accruals(c):
+    # Running per-employee period totals, kept by the kiosk; seeded from existing
+    # attendance by _migrate_attendance_hours, since accruals read the stored hours
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_accruals(
+        employee_ref INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start TEXT,
+        period_end TEXT,
+        days_worked INTEGER NOT NULL DEFAULT 0,
+        regular_hours REAL NOT NULL DEFAULT 0,
+        overtime_hours REAL NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (employee_ref, period),
+        FOREIGN KEY(employee_ref) REFERENCES employees(id)
+    )'''))
+
+def _migrate_jobs(c):
+    # Background job queue (see jobs.py)
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS jobs(
+        id TEXT PRIMARY KEY,
+        job_key TEXT UNIQUE,               -- idempotency key
+        kind TEXT NOT NULL,                -- payroll, export_payroll, ...
+        params TEXT,                       -- JSON
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL DEFAULT 0,           -- 0..1
+        message TEXT,
+        result TEXT,                       -- JSON summary returned by the handler
+        result_name TEXT,                  -- downloadable file, under JOB_RESULTS_DIR/<id>/
+        error TEXT,
+        cancel_requested INTEGER DEFAULT 0,
+        attempts INTEGER DEFAULT 0,
+        worker TEXT,
+        created_by INTEGER,
+        created_at REAL,                   -- epoch seconds
+        started_at REAL,
+        finished_at REAL,
+        heartbeat_at REAL,
+        FOREIGN KEY(created_by) REFERENCES employees(id)
+    )'''))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_by ON jobs(created_by, created_at)")
+
+def _migrate_payroll_staging(c):
+    # Dry-run payroll runs: computed rows wait here to be diffed against payroll (see payroll_diff.py)
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_dry_runs(
+        run_id TEXT PRIMARY KEY,
+        period TEXT NOT NULL,
+        period_start TEXT,
+        period_end TEXT,
+        created_by INTEGER,
+        created_at REAL,                   -- epoch seconds
+        FOREIGN KEY(created_by) REFERENCES employees(id)
+    )'''))
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_staging(
+        run_id TEXT NOT NULL,
+        employee_ref INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start TEXT,
+        period_end TEXT,
+        base_salary REAL,
+        overtime REAL,
+        deductions REAL,
+        bonuses REAL,
+        net_pay REAL,
+        PRIMARY KEY(run_id, employee_ref),
+        FOREIGN KEY(run_id) REFERENCES payroll_dry_runs(run_id),
+        FOREIGN KEY(employee_ref) REFERENCES employees(id)
+    )'''))
+
+# Attendance hours are stored per row by triggers, so payroll sums columns instead of parsing times.
+# A row gets hours once it has both punches (unparseable times count as 0 hours, like a NULL in SUM);
+# overtime is the part over office_hours_per_day, re-applied by refresh_overtime when that setting changes.
+_SETTING_HOURS_PER_DAY = "(SELECT setting_value FROM settings WHERE setting_name = 'office_hours_per_day')"
+
+_SQLITE_HOURS_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS attendance_hours_{event} AFTER {clause} ON attendance
+        BEGIN
+            UPDATE attendance SET
+                hours_worked = CASE WHEN NEW.time_in IS NULL OR NEW.time_out IS NULL THEN NULL
+                                    ELSE COALESCE((strftime('%s', NEW.time_out) - strftime('%s', NEW.time_in)) / 3600.0, 0) END,
+                overtime_hours = CASE WHEN NEW.time_in IS NULL OR NEW.time_out IS NULL THEN NULL
+                                      ELSE MAX(0, COALESCE((strftime('%s', NEW.time_out) - strftime('%s', NEW.time_in)) / 3600.0, 0)
+                                                  - COALESCE(CAST(NULLIF({_SETTING_HOURS_PER_DAY}, '') AS REAL), 8.0)) END
+            WHERE id = NEW.id;
+        END'''
+    for event, clause in (('insert', 'INSERT'), ('update', 'UPDATE OF time_in, time_out'))
+]
+
+_POSTGRES_HOURS_TRIGGER = [
+    f'''CREATE OR REPLACE FUNCTION attendance_hours() RETURNS trigger AS $$
+        DECLARE
+            hours_per_day TEXT;
+        BEGIN
+            IF NEW.time_in IS NULL OR NEW.time_out IS NULL THEN
+                NEW.hours_worked := NULL;
+                NEW.overtime_hours := NULL;
+                RETURN NEW;
+            END IF;
+            BEGIN
+                NEW.hours_worked := EXTRACT(EPOCH FROM (CAST(NEW.time_out AS TIME) - CAST(NEW.time_in AS TIME))) / 3600.0;
+            EXCEPTION WHEN invalid_datetime_format OR datetime_field_overflow THEN
+                NEW.hours_worked := 0;
+            END;
+            hours_per_day := {_SETTING_HOURS_PER_DAY};
+            NEW.overtime_hours := GREATEST(0, NEW.hours_worked - CASE WHEN hours_per_day ~ '^[0-9]*[.]{{0,1}}[0-9]+$'
+                                                                     THEN CAST(hours_per_day AS DOUBLE PRECISION)
+                                                                     ELSE 8.0 END);
+            RETURN NEW;
+        END
+    $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS attendance_hours ON attendance',
+    '''CREATE TRIGGER attendance_hours BEFORE INSERT OR UPDATE OF time_in, time_out ON attendance
+       FOR EACH ROW EXECUTE FUNCTION attendance_hours()''',
+]
+
+def _migrate_attendance_hours(c):
+    c.execute(backend.ddl("ALTER TABLE attendance ADD COLUMN hours_worked REAL"))
+    c.execute(backend.ddl("ALTER TABLE attendance ADD COLUMN overtime_hours REAL"))
+    for statement in (_SQLITE_HOURS_TRIGGERS if backend.dialect == 'sqlite' else _POSTGRES_HOURS_TRIGGER):
+        c.execute(backend.ddl(statement))
+    # Backfill by touching the punches, so existing rows go through the same trigger
+    c.execute("UPDATE attendance SET time_out = time_out WHERE time_in IS NOT NULL AND time_out IS NOT NULL")
+    # Period aggregates now read the stored hours; this replaces the time_in/time_out covering index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date_hours ON attendance(date, employee_ref, hours_worked, overtime_hours)")
+    c.execute("DROP INDEX IF EXISTS idx_attendance_date_employee")
+    from accruals import rebuild_accruals
+    rebuild_accruals(c)
+
+def _migrate_payroll_summaries(c):
+    # Period and department totals for the payroll pages, refreshed per period (see payroll_summary.py)
+    from payroll_summary import rebuild_summaries
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_period_summary(
+        period TEXT PRIMARY KEY,
+        period_start TEXT,
+        period_end TEXT,
+        headcount INTEGER NOT NULL,
+        base_salary REAL,
+        overtime REAL,
+        bonuses REAL,
+        gross_pay REAL,
+        deductions REAL,
+        net_pay REAL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )'''))
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_department_summary(
+        period TEXT NOT NULL,
+        department TEXT NOT NULL,
+        headcount INTEGER NOT NULL,
+        base_salary REAL,
+        overtime REAL,
+        bonuses REAL,
+        gross_pay REAL,
+        deductions REAL,
+        net_pay REAL,
+        PRIMARY KEY(period, department)
+    )'''))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payroll_period_summary_start ON payroll_period_summary(period_start, period)")
+    # Refreshing a period totals its rows; the unique (employee_ref, period) index can't find them by period
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payroll_period ON payroll(period)")
+    rebuild_summaries(c)
+
+# Attendance written for a period that was already paid marks that (employee, period) pair dirty,
+# for the reconciler in adjustments.py. The pairs come from the payroll rows' own date ranges, so
+# punches in periods nobody has been paid for yet mark nothing.
+def _mark_dirty_sql(row):
+    return f'''INSERT INTO payroll_dirty(employee_ref, period, marked_at)
+                SELECT employee_ref, period, CURRENT_TIMESTAMP FROM payroll
+                WHERE employee_ref = {row}.employee_ref AND {row}.date BETWEEN period_start AND period_end
+                ON CONFLICT (employee_ref, period) DO UPDATE SET marked_at = excluded.marked_at'''
+
+_STATEMENT_SEPARATOR = ';\n            '
+
+_SQLITE_DIRTY_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS attendance_payroll_dirty_{event} AFTER {clause} ON attendance
+        BEGIN
+            {_STATEMENT_SEPARATOR.join(_mark_dirty_sql(row) for row in rows)};
+        END'''
+    for event, clause, rows in (('insert', 'INSERT', ('NEW',)),
+                                ('update', 'UPDATE OF employee_ref, date, time_in, time_out', ('OLD', 'NEW')),
+                                ('delete', 'DELETE', ('OLD',)))
+]
+
+_POSTGRES_DIRTY_TRIGGER = [
+    f'''CREATE OR REPLACE FUNCTION attendance_payroll_dirty() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                {_mark_dirty_sql('OLD')};
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {_mark_dirty_sql('NEW')};
+            END IF;
+            RETURN NULL;
+        END
+    $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS attendance_payroll_dirty ON attendance',
+    '''CREATE TRIGGER attendance_payroll_dirty
+       AFTER INSERT OR DELETE OR UPDATE OF employee_ref, date, time_in, time_out ON attendance
+       FOR EACH ROW EXECUTE FUNCTION attendance_payroll_dirty()''',
+]
+
+def _migrate_payroll_adjustments(c):
+    # Retroactive corrections: dirty (employee, period) pairs and the deltas carried into later periods
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_dirty(
+        employee_ref INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY(employee_ref, period)
+    )'''))
+    c.execute(backend.ddl('''CREATE TABLE IF NOT EXISTS payroll_adjustments(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_ref INTEGER NOT NULL,
+        source_period TEXT NOT NULL,       -- the corrected, already-paid period
+        target_period TEXT NOT NULL,       -- the later period whose payroll carries the delta
+        base_salary REAL,
+        overtime REAL,
+        deductions REAL,
+        bonuses REAL,
+        net_pay REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(employee_ref) REFERENCES employees(id)
+    )'''))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payroll_adjustments_target ON payroll_adjustments(target_period, employee_ref)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payroll_adjustments_source ON payroll_adjustments(source_period, employee_ref)")
+    for statement in (_SQLITE_DIRTY_TRIGGERS if backend.dialect == 'sqlite' else _POSTGRES_DIRTY_TRIGGER):
+        c.execute(statement)
+
+# Working days for payroll, leave and absence counts (business_calendar.py)
+CALENDAR_SETTINGS = [
+    ('work_week', 'Mon Tue Wed Thu Fri', "Working days of the week, e.g. 'Mon Tue Wed Thu Fri' or 'Mon-Sat'"),
+    ('holidays', '', 'Non-working holidays as YYYY-MM-DD dates separated by commas'),
+]
+
+def _migrate_business_calendar(c):
+    c.executemany("""INSERT INTO settings (setting_name, setting_value, description) VALUES (?, ?, ?)
+                     ON CONFLICT (setting_name) DO NOTHING""", CALENDAR_SETTINGS)
+    c.execute("UPDATE settings SET description = ? WHERE setting_name = 'attendance_bonus_days'",
+              ("Days worked in a period that earn the full attendance bonus (at most the period's working days)",))
+
+def _migrate_payroll_pay_basis(c):
+    # What each row was computed with besides attendance (payroll_engine.pay_basis), so a
+    # reconciled correction isn't repriced at today's rates; rows stored before this stay NULL
+    c.execute("ALTER TABLE payroll ADD COLUMN pay_basis TEXT")
+    c.execute("ALTER TABLE payroll_staging ADD COLUMN pay_basis TEXT")
+
+# Every column holding a pay period key (pay_periods.PayPeriod.key)
+PERIOD_KEY_COLUMNS = [('payroll', 'period'), ('payroll_accruals', 'period'), ('payroll_dry_runs', 'period'),
+                      ('payroll_staging', 'period'), ('payroll_period_summary', 'period'),
+                      ('payroll_department_summary', 'period'), ('payroll_dirty', 'period'),
+                      ('payroll_adjustments', 'source_period'), ('payroll_adjustments', 'target_period')]
+
+def _migrate_custom_period_keys(c):
+    # Custom periods used to share the start..end key of biweekly ones, told apart only by
+    # the anchor in force; prefix the ranges that don't line up with it as custom:start..end
+    from datetime import date
+    from pay_periods import BIWEEKLY, CUSTOM_KEY_PREFIX, parse_anchor, period_containing
+    row = c.execute("SELECT setting_value FROM settings WHERE setting_name = 'payroll_biweekly_anchor'").fetchone()
+    anchor = parse_anchor(row[0] if row else None)
+    keys = set()
+    for table, column in PERIOD_KEY_COLUMNS:
+        keys.update(key for (key,) in c.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} LIKE '%..%'"))
+    renamed = []
+    for key in keys - {key for key in keys if key.startswith(CUSTOM_KEY_PREFIX)}:
+        try:
+            start, end = (date.fromisoformat(part) for part in key.split('..'))
+        except ValueError:
+            logger.warning("Payroll period %r is not a known format; leaving it as it is", key)
+            continue
+        biweekly = period_containing(BIWEEKLY, start, anchor)
+        if (biweekly.start, biweekly.end) != (start, end):
+            renamed.append((CUSTOM_KEY_PREFIX + key, key))
+    for table, column in PERIOD_KEY_COLUMNS:
+        c.executemany(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", renamed)
+    if renamed:
+        logger.info("Renamed %d custom payroll period keys", len(renamed))
+
+# Schema migrations as (version, description, function), tracked in PRAGMA user_version.
+# Only ever append: a released step must not be edited or renumbered.
+MIGRATIONS = [
+    (1, 'indexes for attendance, chat, security log, leave and membership lookups', _migrate_hot_path_indexes),
+    (2, 'unique payroll row per employee and period', _migrate_unique_payroll_period),
+    (3, 'per-row bcrypt cost factor', _migrate_password_cost),
+    (4, 'sequence counters for employee and application IDs', _migrate_sequences),
+    (5, 'covering attendance index for payroll period aggregates', _migrate_attendance_period_index),
+    (6, 'payroll rule settings', _migrate_payroll_rule_settings),
+    (7, 'pay frequencies and payroll period date ranges', _migrate_pay_periods),
+    (8, 'incremental payroll accruals', _migrate_payroll_accruals),
+    (9, 'background job queue', _migrate_jobs),
+    (10, 'payroll dry-run staging', _migrate_payroll_staging),
+    (11, 'stored attendance hours maintained by triggers', _migrate_attendance_hours),
+    (12, 'materialized payroll period and department summaries', _migrate_payroll_summaries),
+    (13, 'retroactive payroll adjustments and dirty-period tracking', _migrate_payroll_adjustments),
+    (14, 'business calendar settings', _migrate_business_calendar),
+    (15, 'pay basis stored with each payroll row', _migrate_payroll_pay_basis),
+    (16, 'distinct keys for custom pay periods', _migrate_custom_period_keys),
+]
+
+def get_schema_version(conn):
+    """Schema version (PRAGMA user_version on SQLite)"""
+    return backend.get_schema_version(conn)
+
+def run_migrations(conn):
+    """Apply pending schema migrations in order, each in its own transaction"""
+    current = get_schema_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        started = time.perf_counter()
+        backend.begin_exclusive(conn)
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migrate(conn.cursor())
+            backend.set_schema_version(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %d (%s) failed", version, description)
+            raise
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info("Applied migration %d (%s) in %.1f ms", version, description, elapsed_ms)
+        current = version
+    return current
+
 def init_default_settings():
     conn = get_db_connection()
     c = conn.cursor()
     
-    # Check if settings already exist
-    c.execute("SELECT COUNT(*) FROM settings")
-    if c.fetchone()[0] == 0:
-        # Insert default settings
-        default_settings = [
-            ('office_hours_per_day', '8', 'Standard daily work hours for payroll calculation'),
-            ('overtime_multiplier', '1.5', 'Overtime pay multiplier (e.g., 1.5 = time and a half)'),
-            ('tax_rate', '0.12', 'Standard tax deduction rate'),
-            ('insurance_deduction', '500', 'Monthly insurance deduction amount'),
-            ('company_name', 'Federal Agency', 'Company name for reports and documents'),
-            ('payroll_period', 'monthly', 'Payroll generation period (monthly/biweekly)')
-        ]
-        
-        for setting in default_settings:
-            c.execute("INSERT INTO settings (setting_name, setting_value, description) VALUES (?, ?, ?)", setting)
+    # Insert default settings that don't exist yet (admin-edited values are kept)
+    default_settings = [
+        ('office_hours_per_day', '8', 'Standard daily work hours for payroll calculation'),
+        ('overtime_multiplier', '1.5', 'Overtime pay multiplier (e.g., 1.5 = time and a half)'),
+        ('tax_rate', '0.12', 'Standard tax deduction rate'),
+        ('insurance_deduction', '500', 'Monthly insurance deduction amount'),
+        ('company_name', 'Federal Agency', 'Company name for reports and documents'),
+    ] + PAY_PERIOD_SETTINGS + PAYROLL_RULE_SETTINGS + CALENDAR_SETTINGS
+    
+    c.executemany("""INSERT INTO settings (setting_name, setting_value, description) VALUES (?, ?, ?)
+                     ON CONFLICT (setting_name) DO NOTHING""", default_settings)
     
     # Create default general chat room if it doesn't exist
     c.execute("SELECT COUNT(*) FROM chat_rooms WHERE room_type = 'general'")
@@ -219,31 +775,30 @@ def generate_join_code():
     import string
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
-def generate_application_id():
+def allocate_sequence(name, count=1):
+    """Atomically reserve `count` consecutive values of a named sequence; returns the first one.
+
+    Runs in the caller's transaction and leaves the commit to the caller, so
+    the values are only used up when the rows that take them are committed.
+    """
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT application_id FROM applications WHERE application_id IS NOT NULL")
-    ids = [row[0] for row in c.fetchall() if row[0]]
-    max_n = 0
-    for s in ids:
-        m = re.match(r"APP(\d{4,})$", s)
-        if m:
-            max_n = max(max_n, int(m.group(1)))
-    conn.close()
-    return f"APP{max_n+1:04d}"
+    sql = "UPDATE sequences SET value = value + ? WHERE name = ? RETURNING value"
+    rows = conn.execute(sql, (count, name)).fetchall()
+    if not rows:
+        conn.execute("INSERT INTO sequences (name, value) VALUES (?, 0) ON CONFLICT(name) DO NOTHING", (name,))
+        rows = conn.execute(sql, (count, name)).fetchall()
+    return rows[0][0] - count + 1
+
+def generate_application_id():
+    return f"APP{allocate_sequence('application_id'):04d}"
 
 def next_employee_id():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT employee_id FROM employees WHERE employee_id IS NOT NULL")
-    ids = [row[0] for row in c.fetchall() if row[0]]
-    max_n = 0
-    for s in ids:
-        m = re.match(r"EMP(\d{3,})$", s)
-        if m:
-            max_n = max(max_n, int(m.group(1)))
-    conn.close()
-    return f"EMP{max_n+1:03d}"
+    return f"EMP{allocate_sequence('employee_id'):03d}"
+
+def reserve_employee_ids(count):
+    """Reserve a block of employee IDs in one round trip (bulk imports)"""
+    first = allocate_sequence('employee_id', count)
+    return [f"EMP{n:03d}" for n in range(first, first + count)]
 
 def ensure_admin_exists():
     conn = get_db_connection()
@@ -251,59 +806,84 @@ def ensure_admin_exists():
     c.execute("SELECT 1 FROM employees WHERE role='Admin' LIMIT 1")
     if not c.fetchone():
         # Create default admin with hashed password
+        from password_hashing import hash_cost
         empid = next_employee_id()
         hashed_password = hash_password('admin123')
-        c.execute('''INSERT INTO employees(employee_id,username,password,name,department,position,salary_rate,role,status,profile_picture)
-                     VALUES(?,?,?,?,?,?,?,?,?,?)''',
-                  (empid, 'admin', hashed_password, 'System Administrator', 'IT', 'Administrator', 0, 'Admin', 'Active', ''))
+        c.execute('''INSERT INTO employees(employee_id,username,password,password_cost,name,department,position,salary_rate,role,status,profile_picture)
+                     VALUES(?,?,?,?,?,?,?,?,?,?,?)''',
+                  (empid, 'admin', hashed_password, hash_cost(hashed_password), 'System Administrator', 'IT', 'Administrator', 0, 'Admin', 'Active', ''))
         conn.commit()
         print(f"✅ Default admin created. Username: admin, Password: admin123, EMP ID: {empid}")
     conn.close()
 
 def migrate_plain_text_passwords():
     """Convert any remaining plain text passwords to hashed versions"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, password FROM employees")
-    users = c.fetchall()
-    
-    for user in users:
-        user_id, password = user
-        # Check if password is already hashed (bcrypt hashes start with $2b$)
-        if not password.startswith('$2b$'):
-            hashed_password = hash_password(password)
-            c.execute("UPDATE employees SET password = ? WHERE id = ?", 
-                     (hashed_password, user_id))
-            print(f"✅ Migrated password for user ID: {user_id}")
-    
-    conn.commit()
-    conn.close()
+    from password_hashing import rehash_pending
+    count = rehash_pending()
+    if count:
+        print(f"✅ Migrated {count} plain text passwords")
+    return count
 
 def log_security_event(event_type, user_id, ip_address, description, user_agent=None):
-    """Log security events for audit trail"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''INSERT INTO security_logs (event_type, user_id, ip_address, user_agent, event_description)
-                 VALUES (?, ?, ?, ?, ?)''',
-              (event_type, user_id, ip_address, user_agent, description))
-    conn.commit()
-    conn.close()
+    """Log security events for audit trail (queued and written in batches by audit_log)"""
+    from audit_log import audit_writer
+    audit_writer.log(event_type, user_id, ip_address, description, user_agent)
 
 def hash_password(password):
-    """Hash password using bcrypt"""
-    import bcrypt
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash password using bcrypt at the configured cost"""
+    from password_hashing import hash_password as bcrypt_hash
+    return bcrypt_hash(password)
 
 def verify_password(password, hashed):
     """Verify password against hash"""
-    import bcrypt
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    from password_hashing import verify_password as bcrypt_verify
+    return bcrypt_verify(password, hashed)
+
+def get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM system_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    conn.execute("""INSERT INTO system_meta (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value""", (key, str(value)))
+
+def schema_fingerprint():
+    """Hash of the schema definition; changes whenever tables, columns or migrations change"""
+    import inspect
+    source = inspect.getsource(create_tables) + inspect.getsource(ensure_columns)
+    source += repr([(version, description) for version, description, _ in MIGRATIONS])
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def _stored_fingerprint(conn):
+    try:
+        return get_meta(conn, 'schema_fingerprint')
+    except Exception:
+        # Fresh database without system_meta yet
+        conn.rollback()
+        return None
 
-# Initialize database
-create_tables()
-ensure_admin_exists()
-migrate_plain_text_passwords()
-init_default_settings()
+def bootstrap_database(force=False):
+    """Create/upgrade the schema and seed defaults, unless the stored fingerprint says it is current.
+    
+    Returns True when any work was done.
+    """
+    fingerprint = schema_fingerprint()
+    conn = get_db_connection()
+    if not force and _stored_fingerprint(conn) == fingerprint:
+        conn.close()
+        return False
+    
+    started = time.perf_counter()
+    create_tables()
+    ensure_admin_exists()
+    init_default_settings()
+    
+    conn = get_db_connection()
+    set_meta(conn, 'schema_fingerprint', fingerprint)
+    conn.commit()
+    conn.close()
+    logger.info("Database bootstrap completed in %.1f ms", (time.perf_counter() - started) * 1000)
+    return True
 
 def sanitize_input(input_text):
     """Sanitize user input to prevent XSS"""
@@ -343,3 +923,7 @@ def validate_file_upload(file, allowed_extensions, max_size_mb=16):
             return False, "File contains potentially malicious content"
     
     return True, "Valid file"
+
+if __name__ == '__main__':
+    bootstrap_database(force=True)
+    migrate_plain_text_passwords()
@@ -0,0 +1,504 @@
+"""
+Database backend abstraction
+Runs the application's SQL against SQLite (default) or a pooled PostgreSQL server
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Applied once to every new SQLite connection. WAL lets kiosk writes and report
+# reads run side by side; busy_timeout makes writers wait instead of failing
+# with "database is locked".
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', 5000),             # milliseconds
+    ('synchronous', 'NORMAL'),          # safe with WAL, one fsync per checkpoint
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),             # negative = KiB, ~16MB page cache
+    ('temp_store', 'MEMORY'),
+)
+
+# Any constant works, it only has to be the same for every worker
+MIGRATION_LOCK_ID = 7262091
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that is kept for reuse when callers close() it"""
+
+    request_scoped = False
+
+    def close(self):
+        # Inside a request the connection is released at teardown, so helpers
+        # that close it early don't break their caller.
+        if self.request_scoped:
+            return
+        # Match sqlite3 semantics: closing discards uncommitted work
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        """Really close the underlying sqlite3 connection"""
+        sqlite3.Connection.close(self)
+
+class SQLiteBackend:
+    """File database; one connection per worker thread"""
+
+    dialect = 'sqlite'
+
+    def __init__(self, path, replica_path=None):
+        self.path = path
+        self.replica_path = replica_path
+        self._local = threading.local()
+        self._replica_generation = 0
+        self._replica_lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in SQLITE_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def thread_connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited across fork() must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def acquire(self):
+        return self.thread_connection()
+
+    def release(self, conn):
+        conn.request_scoped = False
+        conn.close()
+
+    @contextmanager
+    def dedicated_connection(self):
+        """A private connection whose commits can't touch the thread's (or request's) transaction"""
+        conn = self._open()
+        try:
+            yield conn
+        finally:
+            conn.dispose()
+
+    def dispose_thread_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.dispose()
+        self._local.conn = None
+        for conn, pid, _ in getattr(self._local, 'snapshots', {}).values():
+            if pid == os.getpid():
+                conn.dispose()
+        self._local.snapshots = {}
+
+    # --- read-only report snapshots ---
+
+    def _snapshot_source(self, use_replica):
+        if use_replica and self.replica_path and os.path.exists(self.replica_path):
+            return self.replica_path, self._replica_generation
+        return self.path, 0
+
+    def acquire_snapshot(self, use_replica=True):
+        """Read-only connection inside a transaction, so every query sees the same snapshot.
+
+        Under WAL a reader never blocks the kiosk's writers, and the connection
+        is separate from the thread's read/write one. Reads go to the replica
+        file when one is configured, unless the caller needs current data.
+        """
+        path, generation = self._snapshot_source(use_replica)
+        snapshots = getattr(self._local, 'snapshots', None)
+        if snapshots is None:
+            snapshots = self._local.snapshots = {}
+        conn, pid, opened_generation = snapshots.get(path, (None, None, None))
+        # The replica file is swapped on refresh; reopen to pick up the new copy
+        if conn is None or pid != os.getpid() or opened_generation != generation:
+            if conn is not None and pid == os.getpid():
+                conn.dispose()
+            conn = sqlite3.connect(path, factory=PooledConnection, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for name, value in SQLITE_PRAGMAS:
+                if name != 'journal_mode':
+                    conn.execute(f"PRAGMA {name} = {value}")
+            conn.execute("PRAGMA query_only = ON")
+            snapshots[path] = (conn, os.getpid(), generation)
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+            # SQLite starts the read snapshot at the first read, not at BEGIN
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        return conn
+
+    def release_snapshot(self, conn):
+        conn.request_scoped = False
+        conn.close()
+
+    def thread_snapshot(self, use_replica=True):
+        return self.acquire_snapshot(use_replica)
+
+    def refresh_replica(self):
+        """Copy the live database into the replica file with the online backup API"""
+        if not self.replica_path:
+            return False
+        with self._replica_lock:
+            started = time.perf_counter()
+            tmp_path = f"{self.replica_path}.tmp"
+            source = sqlite3.connect(self.path)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+                # Rollback journal: readers of the replaced file keep no -wal/-shm behind
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            # Open report connections keep reading the old copy until they are released
+            os.replace(tmp_path, self.replica_path)
+            self._replica_generation += 1
+        logger.info("Refreshed report replica %s in %.1f ms", self.replica_path,
+                    (time.perf_counter() - started) * 1000)
+        return True
+
+    def start_replica_refresh(self, interval_seconds):
+        """Refresh the replica now and then every interval_seconds on a daemon thread"""
+        if not self.replica_path:
+            return None
+        self.refresh_replica()
+
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.refresh_replica()
+                except Exception:
+                    logger.exception("Report replica refresh failed")
+
+        thread = threading.Thread(target=run, name='report-replica-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    # --- schema helpers ---
+
+    def ddl(self, sql):
+        return sql
+
+    def has_column(self, conn, table, column):
+        return any(r[1] == column for r in conn.execute(f"PRAGMA table_info({table})").fetchall())
+
+    def get_schema_version(self, conn):
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def set_schema_version(self, conn, version):
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def begin_exclusive(self, conn):
+        """Start a transaction holding the write lock, so two workers can't migrate at once"""
+        conn.execute("BEGIN IMMEDIATE")
+
+    def database_size(self, conn):
+        return os.path.getsize(self.path)
+
+    # --- dialect-specific SQL fragments ---
+
+    def hours_between(self, start, end):
+        return f"((strftime('%s', {end}) - strftime('%s', {start})) / 3600.0)"
+
+    def greatest(self, a, b):
+        return f"MAX({a}, {b})"
+
+    def now_minus(self, interval):
+        return f"datetime('now', '-{interval}')"
+
+    def hour_of(self, column):
+        return f"strftime('%H', {column})"
+
+class PostgresCursor:
+    """DB-API cursor wrapper accepting the app's qmark-style SQL"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        if params:
+            self._cursor.execute(_to_pyformat(sql), tuple(params))
+        else:
+            self._cursor.execute(sql)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(_to_pyformat(sql), [tuple(p) for p in seq_of_params])
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        # psycopg2 only reports OIDs; every table here has a SERIAL id
+        self._cursor.execute("SELECT lastval()")
+        return self._cursor.fetchone()[0]
+
+    def close(self):
+        self._cursor.close()
+
+class PostgresConnection:
+    """psycopg2 connection with the subset of the sqlite3 API the routes use"""
+
+    request_scoped = False
+
+    def __init__(self, raw, backend):
+        self._raw = raw
+        self._backend = backend
+
+    def cursor(self):
+        from psycopg2.extras import DictCursor
+        return PostgresCursor(self._raw.cursor(cursor_factory=DictCursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    @property
+    def in_transaction(self):
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        return self._raw.get_transaction_status() != TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        if self.request_scoped:
+            return
+        if self.in_transaction:
+            self.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+class PostgresBackend:
+    """PostgreSQL server behind a thread-safe connection pool"""
+
+    dialect = 'postgresql'
+
+    def __init__(self, dsn, min_connections=1, max_connections=10, acquire_timeout=30):
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._local = threading.local()
+
+    def _get_pool(self):
+        # Pools are per process; sockets inherited across fork() are left alone
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self._pool = ThreadedConnectionPool(self.min_connections, self.max_connections, self.dsn,
+                                                        connection_factory=_connection_class())
+                    self._pool_pid = os.getpid()
+                    self._slots = threading.BoundedSemaphore(self.max_connections)
+        return self._pool
+
+    def acquire(self):
+        """Check a connection out of the pool, waiting while all are in use"""
+        pool = self._get_pool()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError("Timed out waiting for a database connection")
+        try:
+            raw = pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        return PostgresConnection(raw, self)
+
+    def release(self, conn):
+        conn.request_scoped = False
+        try:
+            conn.rollback()
+        finally:
+            self._get_pool().putconn(conn._raw)
+            self._slots.release()
+
+    @contextmanager
+    def dedicated_connection(self):
+        """A pool connection of its own, apart from the thread's (or request's) transaction"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def thread_connection(self):
+        """Connection held by this thread outside of requests (schedulers, CLI scripts)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self.acquire()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def dispose_thread_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            self.release(conn)
+        self._local.conn = None
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None and self._local.snapshot_pid == os.getpid():
+            self.release(snapshot)
+        self._local.snapshot = None
+
+    # --- read-only report snapshots ---
+
+    def _begin_snapshot(self, conn):
+        # First statement of the transaction; every later read sees the same snapshot
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        return conn
+
+    def acquire_snapshot(self, use_replica=True):
+        """Pooled connection in a read-only REPEATABLE READ transaction (MVCC readers never block writers)"""
+        conn = self.acquire()
+        try:
+            return self._begin_snapshot(conn)
+        except Exception:
+            self.release(conn)
+            raise
+
+    def release_snapshot(self, conn):
+        self.release(conn)
+
+    def thread_snapshot(self, use_replica=True):
+        conn = getattr(self._local, 'snapshot', None)
+        if conn is None or self._local.snapshot_pid != os.getpid():
+            conn = self.acquire()
+            self._local.snapshot = conn
+            self._local.snapshot_pid = os.getpid()
+        if not conn.in_transaction:
+            self._begin_snapshot(conn)
+        return conn
+
+    def refresh_replica(self):
+        return False
+
+    def start_replica_refresh(self, interval_seconds):
+        return None
+
+    # --- schema helpers ---
+
+    def ddl(self, sql):
+        sql = sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+        # SQLite REAL is 8 bytes; PostgreSQL REAL is only 4
+        return re.sub(r'\bREAL\b', 'DOUBLE PRECISION', sql)
+
+    def has_column(self, conn, table, column):
+        row = conn.execute("""SELECT 1 FROM information_schema.columns
+                              WHERE table_schema = current_schema() AND table_name = ? AND column_name = ?""",
+                           (table, column)).fetchone()
+        return row is not None
+
+    def get_schema_version(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+        return row[0] if row else 0
+
+    def set_schema_version(self, conn, version):
+        conn.execute("DELETE FROM schema_version")
+        conn.execute("INSERT INTO schema_version (version) VALUES (?)", (int(version),))
+
+    def begin_exclusive(self, conn):
+        """Transaction-scoped advisory lock, so two workers can't migrate at once"""
+        conn.execute("SELECT pg_advisory_xact_lock(?)", (MIGRATION_LOCK_ID,))
+
+    def database_size(self, conn):
+        return conn.execute("SELECT pg_database_size(current_database())").fetchone()[0]
+
+    # --- dialect-specific SQL fragments ---
+
+    def hours_between(self, start, end):
+        return f"(EXTRACT(EPOCH FROM (CAST({end} AS TIME) - CAST({start} AS TIME))) / 3600.0)"
+
+    def greatest(self, a, b):
+        return f"GREATEST({a}, {b})"
+
+    def now_minus(self, interval):
+        # Audit timestamps are written in UTC, like SQLite's CURRENT_TIMESTAMP
+        return f"(CURRENT_TIMESTAMP AT TIME ZONE 'UTC' - INTERVAL '{interval}')"
+
+    def hour_of(self, column):
+        return f"to_char({column}, 'HH24')"
+
+@lru_cache(maxsize=1024)
+def _to_pyformat(sql):
+    """Convert qmark placeholders to psycopg2's pyformat, escaping literal percent signs"""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+@lru_cache(maxsize=None)
+def _connection_class():
+    """psycopg2 connection returning dates/times as strings and NUMERIC as float, like sqlite3"""
+    from psycopg2 import extensions
+
+    # timestamp, timestamptz, date, time
+    as_text = extensions.new_type((1114, 1184, 1082, 1083), 'PAYROLL_TEXT',
+                                  lambda value, cur: value)
+    as_float = extensions.new_type(extensions.DECIMAL.values, 'PAYROLL_FLOAT',
+                                   lambda value, cur: float(value) if value is not None else None)
+
+    class PayrollConnection(extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            extensions.register_type(as_text, self)
+            extensions.register_type(as_float, self)
+
+    return PayrollConnection
+
+def create_backend(sqlite_path):
+    """Pick the backend from DATABASE_URL, falling back to the SQLite file (and optional report replica)"""
+    url = os.environ.get('DATABASE_URL', '')
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresBackend(
+            url,
+            min_connections=int(os.environ.get('DB_POOL_MIN', 1)),
+            max_connections=int(os.environ.get('DB_POOL_MAX', 10)),
+        )
+    return SQLiteBackend(sqlite_path, replica_path=os.environ.get('REPORT_REPLICA_PATH') or None)
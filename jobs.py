@@ -0,0 +1,381 @@
+"""
+Background jobs
+Database-backed job queue for payroll runs and exports: idempotent job keys,
+a worker thread pool per process (or a dedicated `flask run-jobs` process),
+progress/ETA reporting, cancellation and downloadable result files
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import click
+from werkzeug.utils import secure_filename
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per app process; 0 leaves the work to `flask --app main run-jobs`
+WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Idle workers look for queued jobs this often (seconds); local enqueues wake them at once
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+
+# A running job whose heartbeat is older than this (seconds) lost its worker and is retried
+STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 300))
+MAX_ATTEMPTS = 3
+
+# Export files live here until they expire; share it between nodes behind a load balancer
+RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR', os.path.join(tempfile.gettempdir(), 'payroll_jobs'))
+RESULT_TTL_SECONDS = int(os.environ.get('JOB_RESULT_TTL_HOURS', 24)) * 3600
+
+# Requests without an explicit key join an identical job submitted within this window
+DEDUP_SECONDS = int(os.environ.get('JOB_DEDUP_SECONDS', 60))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Progress is written at most this often (seconds) unless it is a phase change
+PROGRESS_INTERVAL = 0.5
+
+JOB_COLUMNS = '''id, job_key, kind, params, status, progress, message, result_name, result, error,
+                 cancel_requested, created_by, created_at, started_at, finished_at, attempts'''
+
+HANDLERS = {}
+
+class JobCancelled(Exception):
+    """Raised inside a handler when the job was cancelled; its work is rolled back"""
+
+def job_handler(kind):
+    """Register fn(job) as the handler for jobs of this kind; its return value is the job's result"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+def derived_key(kind, params, user_id):
+    """Key shared by identical submissions (same kind, params and user) in one DEDUP_SECONDS window"""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return f'{kind}:{digest}:{user_id}:{int(time.time() // DEDUP_SECONDS)}'
+
+class JobContext:
+    """What a handler sees: its params, progress reporting and a place for its result file"""
+
+    def __init__(self, queue, job_id, params):
+        self.id = job_id
+        self.params = params
+        self._queue = queue
+        self._reported_at = 0.0
+        self.result_name = None
+        self.result_path = None
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Report progress (done/total, or a 0..1 fraction) and stop if the job was cancelled.
+
+        Writes are throttled; nothing is written while the thread's connection
+        is inside a transaction, so a handler's own transaction is never committed early.
+        """
+        now = time.monotonic()
+        if not force and message is None and now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        fraction = min(1.0, done / total) if total else float(done)
+        self._reported_at = now
+        if self._queue._report(self.id, fraction, message):
+            raise JobCancelled()
+
+    def check_cancelled(self):
+        if self._queue._cancel_requested(self.id):
+            raise JobCancelled()
+
+    def result_file(self, filename):
+        """Path to write the downloadable result to"""
+        directory = os.path.join(self._queue.results_dir, self.id)
+        os.makedirs(directory, exist_ok=True)
+        # The download route finds the file by result_name, so write it under that same sanitized name
+        self.result_name = secure_filename(filename) or 'result'
+        self.result_path = os.path.join(directory, self.result_name)
+        return self.result_path
+
+class JobQueue:
+    """Job table access plus this process's worker threads"""
+
+    def __init__(self, workers=WORKERS, poll_interval=POLL_INTERVAL, results_dir=RESULTS_DIR):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.results_dir = results_dir
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._maintained_at = 0.0
+        self._running = set()
+        self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def init_app(self, app):
+        os.makedirs(self.results_dir, exist_ok=True)
+        # Started by the first request of each worker process, not at import (CLI commands load the app too)
+        app.before_request(self.ensure_started)
+
+        @app.cli.command('run-jobs')
+        @click.option('--workers', default=max(self.workers, 1), show_default=True, help='Worker threads.')
+        def run_jobs_command(workers):
+            """Run queued background jobs in this process."""
+            click.echo(f'Running jobs with {workers} worker thread(s); Ctrl+C to stop.')
+            self.run_forever(workers)
+
+    def ensure_started(self, workers=None):
+        # Threads don't survive fork(), so each worker process starts its own
+        workers = self.workers if workers is None else workers
+        if workers <= 0 or (self._threads and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+            self._stopping.clear()
+            self._running = set()
+            self._threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                             for i in range(workers)]
+            self._threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    # --- submitting and inspecting jobs ---
+
+    def enqueue(self, kind, params=None, key=None, user_id=None):
+        """Queue a job and return its id.
+
+        Submitting a key again returns the job already holding it, whether it is
+        still queued, running or finished; a failed or cancelled job is queued
+        again instead. Without a key, identical submissions are joined for
+        DEDUP_SECONDS.
+        """
+        if kind not in HANDLERS:
+            raise ValueError(f'Unknown job kind: {kind!r}')
+        params = params or {}
+        key = key or derived_key(kind, params, user_id)
+        conn = get_db_connection()
+        try:
+            conn.execute('''INSERT INTO jobs (id, job_key, kind, params, status, progress, created_by, created_at, attempts)
+                            VALUES (?, ?, ?, ?, ?, 0, ?, ?, 0)
+                            ON CONFLICT (job_key) DO NOTHING''',
+                         (uuid.uuid4().hex, key, kind, json.dumps(params), QUEUED, user_id, time.time()))
+            job_id, status = conn.execute('SELECT id, status FROM jobs WHERE job_key = ?', (key,)).fetchone()
+            if status in (FAILED, CANCELLED):
+                conn.execute('''UPDATE jobs SET status = ?, progress = 0, message = NULL, error = NULL,
+                                                cancel_requested = 0, attempts = 0, created_at = ?,
+                                                started_at = NULL, finished_at = NULL
+                                WHERE id = ? AND status IN (?, ?)''',
+                             (QUEUED, time.time(), job_id, FAILED, CANCELLED))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.ensure_started()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """The job as a dict with an ETA for running jobs, or None"""
+        row = get_db_connection().execute(f'SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def recent(self, user_id=None, limit=50):
+        where = 'WHERE created_by = ?' if user_id is not None else ''
+        params = (user_id,) if user_id is not None else ()
+        rows = get_db_connection().execute(f'''SELECT {JOB_COLUMNS} FROM jobs {where}
+                                               ORDER BY created_at DESC LIMIT ?''', params + (limit,)).fetchall()
+        return [_job_dict(row) for row in rows]
+
+    def result_path(self, job):
+        """Path of a finished job's result file, if it still exists"""
+        if job['status'] != SUCCEEDED or not job['result_name']:
+            return None
+        path = os.path.join(self.results_dir, job['id'], job['result_name'])
+        return path if os.path.exists(path) else None
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once, or ask a running one to stop; False if it already finished"""
+        conn = get_db_connection()
+        try:
+            cancelled = conn.execute('''UPDATE jobs SET status = ?, finished_at = ?, message = 'Cancelled'
+                                        WHERE id = ? AND status = ?''',
+                                     (CANCELLED, time.time(), job_id, QUEUED)).rowcount
+            if not cancelled:
+                cancelled = conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?',
+                                         (job_id, RUNNING)).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return bool(cancelled)
+
+    # --- worker side ---
+
+    def _claim(self):
+        conn = get_db_connection()
+        now = time.time()
+        try:
+            row = conn.execute('''UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?,
+                                                  attempts = attempts + 1
+                                  WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)
+                                    AND status = ?
+                                  RETURNING id, kind, params''',
+                               (RUNNING, self.worker_name, now, now, QUEUED, QUEUED)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return tuple(row) if row else None
+
+    def _report(self, job_id, fraction, message):
+        """Write progress and heartbeat; returns True when cancellation was requested"""
+        conn = get_db_connection()
+        if conn.in_transaction:
+            return False
+        row = conn.execute('''UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_at = ?
+                              WHERE id = ? RETURNING cancel_requested''',
+                           (fraction, message, time.time(), job_id)).fetchone()
+        conn.commit()
+        return bool(row and row[0])
+
+    def _cancel_requested(self, job_id):
+        conn = get_db_connection()
+        idle = not conn.in_transaction
+        row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if idle:
+            conn.commit()
+        return bool(row and row[0])
+
+    def _finish(self, job_id, status, message=None, result=None, result_name=None, error=None):
+        conn = get_db_connection()
+        conn.rollback()  # whatever the handler left open is not part of the result
+        conn.execute('''UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END,
+                                        message = COALESCE(?, message), result = ?, result_name = ?, error = ?,
+                                        finished_at = ?
+                        WHERE id = ?''',
+                     (status, status, message, json.dumps(result) if result is not None else None,
+                      result_name, error, time.time(), job_id))
+        conn.commit()
+
+    def run_job(self, job_id, kind, params):
+        """Run one claimed job to completion and record the outcome"""
+        job = JobContext(self, job_id, json.loads(params or '{}'))
+        started = time.perf_counter()
+        try:
+            handler = HANDLERS[kind]
+            result = handler(job)
+        except JobCancelled:
+            if job.result_path and os.path.exists(job.result_path):
+                os.remove(job.result_path)
+            self._finish(job_id, CANCELLED, message='Cancelled')
+            logger.info("Job %s (%s) cancelled", job_id, kind)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, kind)
+            self._finish(job_id, FAILED, message='Failed', error=str(e)[:1000])
+        else:
+            self._finish(job_id, SUCCEEDED, message='Done', result=result, result_name=job.result_name)
+            logger.info("Job %s (%s) finished in %.1f s", job_id, kind, time.perf_counter() - started)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim()
+                if claimed is None:
+                    self._maintain()
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                self._running.add(claimed[0])
+                try:
+                    self.run_job(*claimed)
+                finally:
+                    self._running.discard(claimed[0])
+            except Exception:
+                # Database unavailable or similar: back off instead of spinning
+                logger.exception("Job worker error")
+                self._stopping.wait(self.poll_interval * 5)
+
+    def _heartbeat(self):
+        # Separate from progress reports, so a long step can't make a live job look abandoned
+        while not self._stopping.wait(STALE_SECONDS / 5):
+            running = list(self._running)
+            if not running:
+                continue
+            conn = get_db_connection()
+            try:
+                conn.executemany('UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?',
+                                 [(time.time(), job_id, RUNNING) for job_id in running])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.exception("Could not record job heartbeats")
+
+    def _maintain(self):
+        """Every minute or so: retry jobs whose worker died, and delete expired result files"""
+        if time.monotonic() - self._maintained_at < 60:
+            return
+        self._maintained_at = time.monotonic()
+        now = time.time()
+        conn = get_db_connection()
+        try:
+            conn.execute('''UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                                            error = CASE WHEN attempts >= ? THEN 'Worker stopped responding' ELSE error END,
+                                            finished_at = CASE WHEN attempts >= ? THEN ? ELSE finished_at END,
+                                            worker = NULL
+                            WHERE status = ? AND heartbeat_at < ?''',
+                         (MAX_ATTEMPTS, FAILED, QUEUED, MAX_ATTEMPTS, MAX_ATTEMPTS, now, RUNNING, now - STALE_SECONDS))
+            expired = [row[0] for row in conn.execute('''SELECT id FROM jobs WHERE result_name IS NOT NULL
+                                                          AND finished_at < ?''', (now - RESULT_TTL_SECONDS,)).fetchall()]
+            if expired:
+                conn.executemany("UPDATE jobs SET result_name = NULL, message = 'Result expired' WHERE id = ?",
+                                 [(job_id,) for job_id in expired])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        for job_id in expired:
+            shutil.rmtree(os.path.join(self.results_dir, job_id), ignore_errors=True)
+
+    def run_forever(self, workers=None):
+        """Work the queue in this process until interrupted (the `run-jobs` command)"""
+        self.ensure_started(workers or max(self.workers, 1))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, timeout=5.0):
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+def _job_dict(row):
+    job = dict(zip([column.strip() for column in JOB_COLUMNS.split(',')], row))
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['eta_seconds'] = None
+    job['elapsed_seconds'] = None
+    if job['started_at']:
+        end = job['finished_at'] or time.time()
+        job['elapsed_seconds'] = max(0.0, end - job['started_at'])
+        if job['status'] == RUNNING and job['progress']:
+            job['eta_seconds'] = job['elapsed_seconds'] * (1 - job['progress']) / job['progress']
+    return job
+
+job_queue = JobQueue()
+atexit.register(job_queue.stop)
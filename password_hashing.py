@@ -0,0 +1,140 @@
+"""
+Password hash maintenance
+Keeps stored bcrypt hashes at the configured cost factor: plain-text rows are
+hashed in batches by a process pool from the bootstrap-db and rehash-passwords
+commands, and plain-text rows or hashes below the current cost are upgraded
+transparently at login
+"""
+
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Cost policy. Raising it makes every older hash "weak"; those are upgraded the
+# next time their owner logs in, because bcrypt needs the plain text to rehash.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+# password_cost value for rows that still hold a plain-text password
+PENDING_COST = 0
+
+_BCRYPT_PATTERN = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+_rehash_lock = threading.Lock()
+
+def hash_password(password, rounds=None):
+    """Hash password using bcrypt at the given (or configured) cost"""
+    import bcrypt
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def hash_cost(stored):
+    """Cost factor of a stored bcrypt hash, or PENDING_COST for plain text"""
+    match = _BCRYPT_PATTERN.match(stored or '')
+    return int(match.group(1)) if match else PENDING_COST
+
+def verify_password(password, stored):
+    """Check a login attempt against a stored hash (or a not-yet-hashed plain-text value)"""
+    import bcrypt
+    if not stored:
+        return False
+    if hash_cost(stored) == PENDING_COST:
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    return bcrypt.checkpw(password.encode('utf-8'), stored.encode('utf-8'))
+
+def password_for_update(submitted, current_hash):
+    """Return (hash, cost) to store from an edit form.
+
+    A blank field, or the stored hash echoed back by the form, keeps the
+    current password instead of hashing the hash.
+    """
+    if not submitted or submitted == current_hash:
+        return current_hash, hash_cost(current_hash)
+    return hash_password(submitted), BCRYPT_ROUNDS
+
+def upgrade_on_login(conn, user, password):
+    """Rehash a just-verified password if its row is below the cost policy"""
+    if hash_cost(user['password']) >= BCRYPT_ROUNDS:
+        return False
+    # Only replace the exact hash we verified, in case an admin changed it meanwhile
+    conn.execute("UPDATE employees SET password = ?, password_cost = ? WHERE id = ? AND password = ?",
+                 (hash_password(password), BCRYPT_ROUNDS, user['id'], user['password']))
+    conn.commit()
+    return True
+
+def _hash_rows(rows, rounds):
+    """Process pool worker: bcrypt a chunk of (id, stored_value) rows"""
+    results = []
+    for row_id, stored in rows:
+        cost = hash_cost(stored)
+        if cost == PENDING_COST:
+            results.append((hash_password(stored, rounds), rounds, row_id, stored))
+        else:
+            # Already a hash written without its cost; just record the cost
+            results.append((stored, cost, row_id, stored))
+    return results
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def has_pending_hashes(conn=None):
+    conn = conn or get_db_connection()
+    row = conn.execute("SELECT 1 FROM employees WHERE password_cost = ? LIMIT 1", (PENDING_COST,)).fetchone()
+    return row is not None
+
+def rehash_pending(batch_size=500, workers=None):
+    """Hash every plain-text password row, one batch per transaction.
+
+    bcrypt is CPU bound, so each batch is spread over a process pool.
+    Returns the number of rows updated.
+    """
+    # One run per process is enough; a concurrent caller just skips
+    if not _rehash_lock.acquire(blocking=False):
+        return 0
+
+    started = time.perf_counter()
+    updated = 0
+    try:
+        conn = get_db_connection()
+        if not has_pending_hashes(conn):
+            return 0
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            last_id = 0
+            while True:
+                rows = conn.execute("""SELECT id, password FROM employees
+                                       WHERE password_cost = ? AND password IS NOT NULL AND id > ?
+                                       ORDER BY id LIMIT ?""",
+                                    (PENDING_COST, last_id, batch_size)).fetchall()
+                conn.rollback()  # don't hold a read transaction while hashing
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                pending = [(row[0], row[1]) for row in rows]
+                chunk_size = max(1, len(pending) // workers)
+                results = []
+                for chunk_result in pool.map(partial(_hash_rows, rounds=BCRYPT_ROUNDS),
+                                             _chunks(pending, chunk_size)):
+                    results.extend(chunk_result)
+
+                # Guard on the old value so a password changed meanwhile isn't overwritten
+                conn.executemany("""UPDATE employees SET password = ?, password_cost = ?
+                                    WHERE id = ? AND password = ?""", results)
+                conn.commit()
+                updated += len(results)
+        conn.close()
+    finally:
+        _rehash_lock.release()
+
+    if updated:
+        logger.info("Hashed %d plain-text passwords in %.1f s", updated, time.perf_counter() - started)
+    return updated
@@ -0,0 +1,157 @@
+"""
+Pay periods
+Monthly, semi-monthly, biweekly and custom payroll periods as date ranges,
+with the period keys stored in payroll.period
+"""
+
+import re
+from datetime import date, timedelta
+
+MONTHLY = 'monthly'
+SEMI_MONTHLY = 'semi-monthly'
+BIWEEKLY = 'biweekly'
+CUSTOM = 'custom'
+
+# Kinds an employee can be paid on (payroll_period setting / employees.pay_frequency)
+PAY_FREQUENCIES = (MONTHLY, SEMI_MONTHLY, BIWEEKLY)
+PERIOD_KINDS = PAY_FREQUENCIES + (CUSTOM,)
+
+# First day of some biweekly period; every other period follows in 14-day steps
+DEFAULT_BIWEEKLY_ANCHOR = date(2024, 1, 1)
+
+# Custom periods longer than this are almost certainly a typo
+MAX_CUSTOM_DAYS = 366
+
+_MONTH_KEY = re.compile(r'^(\d{4})-(\d{2})$')
+_HALF_KEY = re.compile(r'^(\d{4})-(\d{2})([AB])$')
+_RANGE_KEY = re.compile(r'^(custom:)?(\d{4}-\d{2}-\d{2})\.\.(\d{4}-\d{2}-\d{2})$')
+
+# Custom keys carry a prefix so a range that lines up with a biweekly period stays custom
+CUSTOM_KEY_PREFIX = 'custom:'
+
+class PayPeriod:
+    """One pay period: a kind and an inclusive [start, end] date range"""
+
+    __slots__ = ('kind', 'start', 'end')
+
+    def __init__(self, kind, start, end):
+        if end < start:
+            raise ValueError(f'Pay period ends ({end}) before it starts ({start})')
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+    @property
+    def key(self):
+        """Value stored in payroll.period: 2025-08, 2025-08A/B, 2025-08-04..2025-08-17 (biweekly)
+        or custom:2025-08-04..2025-08-20"""
+        if self.kind == MONTHLY:
+            return f'{self.start:%Y-%m}'
+        if self.kind == SEMI_MONTHLY:
+            return f"{self.start:%Y-%m}{'A' if self.start.day == 1 else 'B'}"
+        key = f'{self.start.isoformat()}..{self.end.isoformat()}'
+        return CUSTOM_KEY_PREFIX + key if self.kind == CUSTOM else key
+
+    @property
+    def label(self):
+        if self.kind == MONTHLY:
+            return f'{self.start:%B %Y}'
+        start = f'{self.start:%b} {self.start.day}'
+        end = f'{self.end:%b} {self.end.day}, {self.end.year}'
+        if self.start.year != self.end.year:
+            start += f', {self.start.year}'
+        return f'{start} – {end}'
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+    @property
+    def month_share(self):
+        """Fraction of a month the period stands for, to pro-rate monthly amounts"""
+        if self.kind == MONTHLY:
+            return 1.0
+        if self.kind == SEMI_MONTHLY:
+            return 0.5
+        return self.days * 12 / 365
+
+    def bounds(self):
+        """(start, end) as ISO dates for `date BETWEEN ? AND ?`"""
+        return self.start.isoformat(), self.end.isoformat()
+
+    def following(self, anchor=DEFAULT_BIWEEKLY_ANCHOR):
+        """The next period of the same kind (custom periods repeat their length)"""
+        if self.kind == CUSTOM:
+            return custom_period(self.end + timedelta(days=1), self.end + timedelta(days=self.days))
+        return period_containing(self.kind, self.end + timedelta(days=1), anchor)
+
+    def preceding(self, anchor=DEFAULT_BIWEEKLY_ANCHOR):
+        if self.kind == CUSTOM:
+            return custom_period(self.start - timedelta(days=self.days), self.start - timedelta(days=1))
+        return period_containing(self.kind, self.start - timedelta(days=1), anchor)
+
+    def __eq__(self, other):
+        return isinstance(other, PayPeriod) and (self.kind, self.start, self.end) == (other.kind, other.start, other.end)
+
+    def __hash__(self):
+        return hash((self.kind, self.start, self.end))
+
+    def __repr__(self):
+        return f'PayPeriod({self.kind!r}, {self.start.isoformat()}, {self.end.isoformat()})'
+
+def _month_end(year, month):
+    return date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+def period_containing(kind, day, anchor=DEFAULT_BIWEEKLY_ANCHOR):
+    """The monthly, semi-monthly or biweekly period that includes day"""
+    if kind == MONTHLY:
+        return PayPeriod(MONTHLY, day.replace(day=1), _month_end(day.year, day.month))
+    if kind == SEMI_MONTHLY:
+        if day.day <= 15:
+            return PayPeriod(SEMI_MONTHLY, day.replace(day=1), day.replace(day=15))
+        return PayPeriod(SEMI_MONTHLY, day.replace(day=16), _month_end(day.year, day.month))
+    if kind == BIWEEKLY:
+        start = anchor + timedelta(days=(day - anchor).days // 14 * 14)
+        return PayPeriod(BIWEEKLY, start, start + timedelta(days=13))
+    raise ValueError(f'Unknown pay period kind: {kind!r}')
+
+def custom_period(start, end):
+    period = PayPeriod(CUSTOM, start, end)
+    if period.days > MAX_CUSTOM_DAYS:
+        raise ValueError(f'Custom pay periods can span at most {MAX_CUSTOM_DAYS} days')
+    return period
+
+def parse_period(key):
+    """PayPeriod for a payroll.period key; raises ValueError for anything else.
+
+    A key always means the same dates: a bare 14-day range is biweekly
+    whatever payroll_biweekly_anchor says now, and any other bare range
+    (a key from before custom ones were prefixed) is custom.
+    """
+    key = (key or '').strip()
+    m = _MONTH_KEY.match(key)
+    if m:
+        return period_containing(MONTHLY, date(int(m.group(1)), int(m.group(2)), 1))
+    m = _HALF_KEY.match(key)
+    if m:
+        return period_containing(SEMI_MONTHLY, date(int(m.group(1)), int(m.group(2)), 1 if m.group(3) == 'A' else 16))
+    m = _RANGE_KEY.match(key)
+    if m:
+        start, end = date.fromisoformat(m.group(2)), date.fromisoformat(m.group(3))
+        if not m.group(1) and (end - start).days == 13:
+            return PayPeriod(BIWEEKLY, start, end)
+        return custom_period(start, end)
+    raise ValueError(f'Not a pay period: {key!r}')
+
+def pay_frequency(value, default=MONTHLY):
+    """Normalise a payroll_period / pay_frequency value, falling back to default"""
+    value = (value or '').strip().lower().replace('_', '-')
+    if value == 'semimonthly':
+        value = SEMI_MONTHLY
+    return value if value in PAY_FREQUENCIES else default
+
+def parse_anchor(value):
+    try:
+        return date.fromisoformat((value or '').strip())
+    except ValueError:
+        return DEFAULT_BIWEEKLY_ANCHOR
@@ -0,0 +1,143 @@
+"""
+Payroll dry runs
+Computes a period's payroll into a staging area, diffs it field by field
+against the stored payroll rows, and applies only the new and changed rows
+in one transaction
+"""
+
+import logging
+import time
+import uuid
+from payroll_engine import PayRules, compute_payroll, resolve_period
+from payroll_summary import refresh_summaries
+
+logger = logging.getLogger(__name__)
+
+PAYROLL_FIELDS = ('base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay')
+
+# Amounts closer than this (half a cent) count as unchanged
+TOLERANCE = 0.005
+
+# Dry runs nobody applied are discarded after this many seconds
+STAGING_TTL_SECONDS = 24 * 3600
+
+# Staged row differs from the stored one (payroll aliased as p, staging as s)
+CHANGED_SQL = ' OR '.join(f'p.{field} IS NULL OR ABS(p.{field} - s.{field}) > {TOLERANCE}' for field in PAYROLL_FIELDS)
+
+class DryRunNotFound(LookupError):
+    """The dry run was applied, discarded or never existed"""
+
+def purge_expired(conn):
+    """Drop dry runs older than STAGING_TTL_SECONDS; the caller commits"""
+    cutoff = time.time() - STAGING_TTL_SECONDS
+    conn.execute('''DELETE FROM payroll_staging WHERE run_id IN
+                    (SELECT run_id FROM payroll_dry_runs WHERE created_at < ?)''', (cutoff,))
+    conn.execute('DELETE FROM payroll_dry_runs WHERE created_at < ?', (cutoff,))
+
+def dry_run(conn, period, user_id=None, rules=None):
+    """Compute a period's payroll into payroll_staging without touching payroll; returns the run id"""
+    started = time.perf_counter()
+    period = resolve_period(period)
+    rows = compute_payroll(conn, period, rules or PayRules.from_settings())
+    run_id = uuid.uuid4().hex
+    start, end = period.bounds()
+    try:
+        purge_expired(conn)
+        conn.execute('''INSERT INTO payroll_dry_runs(run_id, period, period_start, period_end, created_by, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''', (run_id, period.key, start, end, user_id, time.time()))
+        conn.executemany(f'''INSERT INTO payroll_staging(run_id, employee_ref, period, period_start, period_end,
+                                                         {', '.join(PAYROLL_FIELDS)}, pay_basis)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(run_id, row[0], period.key, start, end) + row[1:] for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Dry run %s for %s: %d employees in %.1f ms", run_id, period.key, len(rows),
+                (time.perf_counter() - started) * 1000)
+    return run_id
+
+def _run(conn, run_id):
+    row = conn.execute('SELECT period, created_at FROM payroll_dry_runs WHERE run_id = ?', (run_id,)).fetchone()
+    if row is None:
+        raise DryRunNotFound(run_id)
+    return resolve_period(row[0]), row[1]
+
+def diff(conn, run_id):
+    """Field-by-field comparison of a dry run with the stored payroll rows.
+
+    Returns the period, the new and changed rows (each with
+    {field: (stored, computed)} for the fields that differ), the number of
+    unchanged rows, and stored rows the run no longer computes (employees no
+    longer paid in the period), which applying the run leaves alone.
+    """
+    period, created_at = _run(conn, run_id)
+    fields = ', '.join(f's.{field}, p.{field}' for field in PAYROLL_FIELDS)
+    rows = conn.execute(f'''SELECT s.employee_ref, e.employee_id, e.name, p.id, {fields}
+                            FROM payroll_staging s
+                            JOIN employees e ON e.id = s.employee_ref
+                            LEFT JOIN payroll p ON p.employee_ref = s.employee_ref AND p.period = s.period
+                            WHERE s.run_id = ?
+                            ORDER BY e.employee_id''', (run_id,)).fetchall()
+    new, changed, unchanged = [], [], 0
+    for row in rows:
+        entry = {'employee_ref': row[0], 'employee_id': row[1], 'name': row[2], 'changes': {}}
+        for number, field in enumerate(PAYROLL_FIELDS):
+            computed, stored = row[4 + 2 * number], row[5 + 2 * number]
+            if stored is None or abs(stored - computed) > TOLERANCE:
+                entry['changes'][field] = (stored, computed)
+        if row[3] is None:
+            new.append(entry)
+        elif entry['changes']:
+            changed.append(entry)
+        else:
+            unchanged += 1
+    stale = conn.execute('''SELECT p.employee_ref, e.employee_id, e.name, p.net_pay
+                            FROM payroll p
+                            LEFT JOIN employees e ON e.id = p.employee_ref
+                            WHERE p.period = ? AND NOT EXISTS (SELECT 1 FROM payroll_staging s
+                                                               WHERE s.run_id = ? AND s.employee_ref = p.employee_ref)
+                            ORDER BY e.employee_id''', (period.key, run_id)).fetchall()
+    return {
+        'run_id': run_id, 'period': period, 'created_at': created_at,
+        'new': new, 'changed': changed, 'unchanged': unchanged,
+        'stale': [{'employee_ref': row[0], 'employee_id': row[1], 'name': row[2], 'net_pay': row[3]} for row in stale],
+    }
+
+def apply_run(conn, run_id):
+    """Write a dry run's new and changed rows to payroll in one transaction and discard the run.
+
+    Rows are compared again at apply time, so an unchanged row is never
+    rewritten even if payroll moved since the diff. Returns (inserted, updated).
+    """
+    period, _ = _run(conn, run_id)
+    assignments = ', '.join(f'{field} = s.{field}' for field in PAYROLL_FIELDS + ('pay_basis',))
+    try:
+        updated = conn.execute(f'''UPDATE payroll AS p SET {assignments}
+                                   FROM payroll_staging s
+                                   WHERE s.run_id = ? AND p.employee_ref = s.employee_ref
+                                         AND p.period = s.period AND ({CHANGED_SQL})''', (run_id,)).rowcount
+        inserted = conn.execute(f'''INSERT INTO payroll(employee_ref, period, period_start, period_end,
+                                                        {', '.join(PAYROLL_FIELDS)}, pay_basis)
+                                    SELECT s.employee_ref, s.period, s.period_start, s.period_end,
+                                           {', '.join(f's.{field}' for field in PAYROLL_FIELDS)}, s.pay_basis
+                                    FROM payroll_staging s
+                                    WHERE s.run_id = ? AND NOT EXISTS (SELECT 1 FROM payroll p
+                                                                       WHERE p.employee_ref = s.employee_ref
+                                                                             AND p.period = s.period)
+                                    ON CONFLICT (employee_ref, period) DO NOTHING''', (run_id,)).rowcount
+        if inserted or updated:
+            refresh_summaries(conn, [period.key])
+        conn.execute('DELETE FROM payroll_staging WHERE run_id = ?', (run_id,))
+        conn.execute('DELETE FROM payroll_dry_runs WHERE run_id = ?', (run_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Applied dry run %s for %s: %d inserted, %d updated", run_id, period.key, inserted, updated)
+    return inserted, updated
+
+def discard_run(conn, run_id):
+    conn.execute('DELETE FROM payroll_staging WHERE run_id = ?', (run_id,))
+    conn.execute('DELETE FROM payroll_dry_runs WHERE run_id = ?', (run_id,))
+    conn.commit()
@@ -0,0 +1,343 @@
+"""
+Payroll engine
+Computes a pay period's payroll for the employees paid in it from one
+aggregate attendance query, applies the settings-driven pay rules to the
+whole workforce as NumPy array operations, and writes it in a single transaction
+"""
+
+import json
+import logging
+import time
+from datetime import date
+import numpy as np
+from database import get_db_connection
+from settings_cache import settings_cache
+from business_calendar import business_calendar
+from jobs import job_handler
+from payroll_summary import refresh_summaries
+from pay_periods import PayPeriod, CUSTOM, custom_period, parse_anchor, parse_period, pay_frequency, period_containing
+
+logger = logging.getLogger(__name__)
+
+class PayRules:
+    """Pay rules for one run, read once from the settings table"""
+
+    __slots__ = ('hours_per_day', 'overtime_multiplier', 'tax_brackets', 'insurance_deduction',
+                 'retirement_rate', 'bonus_min_days', 'bonus_pay_days')
+
+    def __init__(self, hours_per_day=8.0, overtime_multiplier=1.5, tax_brackets=((0.0, 0.12),),
+                 insurance_deduction=500.0, retirement_rate=0.05, bonus_min_days=20, bonus_pay_days=2.0):
+        self.hours_per_day = hours_per_day
+        self.overtime_multiplier = overtime_multiplier
+        self.tax_brackets = tuple(tax_brackets)
+        self.insurance_deduction = insurance_deduction
+        self.retirement_rate = retirement_rate
+        self.bonus_min_days = bonus_min_days
+        self.bonus_pay_days = bonus_pay_days
+
+    @classmethod
+    def from_settings(cls, overrides=None):
+        """Rules from the settings table; overrides maps setting names to values used instead"""
+        overrides = overrides or {}
+        def get(name):
+            return overrides[name] if name in overrides else settings_cache.get(name)
+        return cls(hours_per_day=get('office_hours_per_day'),
+                   overtime_multiplier=get('overtime_multiplier'),
+                   tax_brackets=parse_tax_brackets(get('tax_brackets'), get('tax_rate')),
+                   insurance_deduction=get('insurance_deduction'),
+                   retirement_rate=get('retirement_rate'),
+                   bonus_min_days=get('attendance_bonus_days'),
+                   bonus_pay_days=get('attendance_bonus_pay_days'))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Rules from to_dict() output (JSON turns the bracket pairs into lists)"""
+        values = dict(values)
+        if 'tax_brackets' in values:
+            values['tax_brackets'] = tuple(tuple(bracket) for bracket in values['tax_brackets'])
+        return cls(**{name: values[name] for name in cls.__slots__ if name in values})
+
+def parse_tax_brackets(text, flat_rate):
+    """Parse 'threshold:rate, ...' into sorted (threshold, rate) pairs.
+
+    'flat' (the default) means one band at flat_rate, the tax_rate setting.
+    Malformed text falls back to that too, so a typo can't zero everyone's tax.
+    """
+    if (text or '').strip().lower() in ('', 'flat'):
+        return ((0.0, flat_rate),)
+    try:
+        brackets = []
+        for part in (text or '').replace(';', ',').split(','):
+            if part.strip():
+                threshold, rate = part.split(':')
+                brackets.append((float(threshold), float(rate)))
+    except ValueError:
+        logger.warning("Invalid tax_brackets setting %r, using flat tax_rate", text)
+        brackets = []
+    if not brackets:
+        return ((0.0, flat_rate),)
+    brackets.sort()
+    if brackets[0][0] > 0:
+        brackets.insert(0, (0.0, 0.0))
+    return tuple(brackets)
+
+def default_pay_frequency():
+    return pay_frequency(settings_cache.get('payroll_period'))
+
+def biweekly_anchor():
+    return parse_anchor(settings_cache.get('payroll_biweekly_anchor'))
+
+def current_period(kind=None, day=None):
+    """The period of the given kind (default: the payroll_period setting) that includes day (default: today)"""
+    return period_containing(kind or default_pay_frequency(), day or date.today(), biweekly_anchor())
+
+def resolve_period(period):
+    """A PayPeriod from a PayPeriod or a payroll.period key (see PayPeriod.key)"""
+    return period if isinstance(period, PayPeriod) else parse_period(period)
+
+def period_from_form(form):
+    """The period chosen on the payroll page: a kind plus a day inside it, or a custom start/end.
+
+    Raises ValueError for unknown kinds, bad dates or oversized custom ranges.
+    """
+    kind = form.get('kind') or default_pay_frequency()
+    if kind == CUSTOM:
+        return custom_period(date.fromisoformat(form.get('start', '')), date.fromisoformat(form.get('end', '')))
+    day = date.fromisoformat(form['day']) if form.get('day') else date.today()
+    return period_containing(kind, day, biweekly_anchor())
+
+def attendance_totals(conn, period, default_frequency=None, employee_ref=None):
+    """(employee id, salary_rate, days worked, overtime hours) for the active employees paid in period.
+
+    One grouped pass over attendance with date BETWEEN the period bounds,
+    summing the trigger-maintained hours columns (a range scan of
+    idx_attendance_date_hours); employees without attendance get zeros. A
+    custom period covers every active employee, the others only those whose
+    pay frequency (or the default) is the period's kind. With employee_ref,
+    only that employee, whatever their status or frequency now (reconciling
+    a period they were already paid in).
+    """
+    start, end = period.bounds()
+    params = [start, end]
+    one_employee = ''
+    if employee_ref is not None:
+        one_employee = 'AND employee_ref = ?'
+        params.append(employee_ref)
+        paid_here = 'e.id = ?'
+        params.append(employee_ref)
+    elif period.kind != CUSTOM:
+        paid_here = "e.status = 'Active' AND COALESCE(e.pay_frequency, ?) = ?"
+        params += [default_frequency or default_pay_frequency(), period.kind]
+    else:
+        paid_here = "e.status = 'Active'"
+    return conn.execute(f'''
+        SELECT e.id, e.salary_rate, COALESCE(a.days_worked, 0), COALESCE(a.overtime_hours, 0)
+        FROM employees e
+        LEFT JOIN (
+            SELECT employee_ref, COUNT(*) AS days_worked, SUM(overtime_hours) AS overtime_hours
+            FROM attendance
+            WHERE date BETWEEN ? AND ? AND hours_worked IS NOT NULL {one_employee}
+            GROUP BY employee_ref
+        ) a ON a.employee_ref = e.id
+        WHERE {paid_here}
+        ORDER BY e.id
+    ''', params).fetchall()
+
+def historical_totals(conn, period, default_frequency=None):
+    """Same rows as attendance_totals, for the employees who were actually paid in a past period.
+
+    A period with payroll rows covers exactly the employees in them, whatever
+    their status or pay frequency is now. One not generated yet covers who
+    generate_payroll would pay plus anyone, terminated since, with
+    attendance in it.
+    """
+    start, end = period.bounds()
+    if conn.execute('SELECT 1 FROM payroll WHERE period = ? LIMIT 1', (period.key,)).fetchone():
+        paid_here, params = 'e.id IN (SELECT employee_ref FROM payroll WHERE period = ?)', [period.key]
+    elif period.kind != CUSTOM:
+        paid_here = "(e.status = 'Active' OR a.employee_ref IS NOT NULL) AND COALESCE(e.pay_frequency, ?) = ?"
+        params = [default_frequency or default_pay_frequency(), period.kind]
+    else:
+        paid_here, params = "(e.status = 'Active' OR a.employee_ref IS NOT NULL)", []
+    return conn.execute(f'''
+        SELECT e.id, e.salary_rate, COALESCE(a.days_worked, 0), COALESCE(a.overtime_hours, 0)
+        FROM employees e
+        LEFT JOIN (
+            SELECT employee_ref, COUNT(*) AS days_worked, SUM(overtime_hours) AS overtime_hours
+            FROM attendance
+            WHERE date BETWEEN ? AND ? AND hours_worked IS NOT NULL
+            GROUP BY employee_ref
+        ) a ON a.employee_ref = e.id
+        WHERE {paid_here}
+        ORDER BY e.id
+    ''', [start, end] + params).fetchall()
+
+def accrued_totals(conn, period, default_frequency=None):
+    """Same rows as attendance_totals, read from payroll_accruals: one row per employee"""
+    return conn.execute('''
+        SELECT e.id, e.salary_rate, COALESCE(a.days_worked, 0), COALESCE(a.overtime_hours, 0)
+        FROM employees e
+        LEFT JOIN payroll_accruals a ON a.employee_ref = e.id AND a.period = ?
+        WHERE e.status = 'Active' AND COALESCE(e.pay_frequency, ?) = ?
+        ORDER BY e.id
+    ''', (period.key, default_frequency or default_pay_frequency(), period.kind)).fetchall()
+
+def bracket_tax(gross, brackets):
+    """Marginal tax on each gross amount: every band's rate applies to the part of gross inside it"""
+    thresholds = np.array([threshold for threshold, _ in brackets])
+    rates = np.array([rate for _, rate in brackets])
+    widths = np.append(np.diff(thresholds), np.inf)
+    taxable = np.clip(gross[:, None] - thresholds[None, :], 0.0, widths[None, :])
+    return taxable @ rates
+
+def apply_rules(salary_rate, days_worked, overtime_hours, rules, expected_days=None, month_share=1.0):
+    """Pay for a whole workforce at once, as arrays aligned with the inputs.
+
+    expected_days (a number or an aligned array) is the working days of each
+    row's period; full attendance then needs at most that many days worked.
+    month_share (likewise) is each period's PayPeriod.month_share, which
+    scales the monthly insurance deduction. Deductions never exceed pay, so
+    net pay is never negative.
+    Returns (base_salary, overtime, deductions, bonuses, net_pay).
+    """
+    salary_rate = np.nan_to_num(np.asarray(salary_rate, dtype=float))
+    days_worked = np.nan_to_num(np.asarray(days_worked, dtype=float))
+    overtime_hours = np.nan_to_num(np.asarray(overtime_hours, dtype=float))
+
+    base_salary = salary_rate * days_worked
+    overtime = overtime_hours * (salary_rate / rules.hours_per_day) * rules.overtime_multiplier
+    gross_pay = base_salary + overtime
+
+    # Monthly insurance pro-rated to the period, never more than the employee earned in it
+    insurance = np.minimum(rules.insurance_deduction * month_share, gross_pay)
+    deductions = bracket_tax(gross_pay, rules.tax_brackets) + insurance + gross_pay * rules.retirement_rate
+
+    # Short months, holidays and semi-monthly periods have fewer working days than bonus_min_days
+    bonus_days = rules.bonus_min_days if expected_days is None else np.minimum(rules.bonus_min_days, expected_days)
+    full_attendance = (days_worked >= bonus_days) & (days_worked > 0)
+    bonuses = np.where(full_attendance, salary_rate * rules.bonus_pay_days, 0.0)
+
+    deductions = np.minimum(deductions, gross_pay + bonuses)
+    net_pay = gross_pay + bonuses - deductions
+    return base_salary, overtime, deductions, bonuses, net_pay
+
+def adjustment_totals(conn, period_key, employee_ref=None):
+    """{employee_ref: (base_salary, overtime, deductions, bonuses, net_pay)} owed through period's payroll.
+
+    Retroactive adjustments carried into the period count positive and those
+    already carried out of it (corrections of the period itself) negative,
+    so a period's computed pay stays equal to its stored row once reconciled.
+    """
+    only = 'AND employee_ref = ?' if employee_ref is not None else ''
+    sums = ', '.join(f'SUM(CASE WHEN target_period = ? THEN {field} ELSE -{field} END)'
+                     for field in ('base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay'))
+    rows = conn.execute(f'''SELECT employee_ref, {sums} FROM payroll_adjustments
+                            WHERE (target_period = ? OR source_period = ?) {only}
+                            GROUP BY employee_ref''',
+                        (period_key,) * 7 + ((employee_ref,) if only else ())).fetchall()
+    return {row[0]: np.array(row[1:], dtype=float) for row in rows}
+
+def pay_basis(rules, salary_rate, expected_days, month_share):
+    """JSON stored as payroll.pay_basis: what a row was computed with besides attendance"""
+    return json.dumps({'salary_rate': salary_rate, 'expected_days': int(expected_days),
+                       'month_share': month_share, 'rules': rules.to_dict()})
+
+def compute_payroll(conn, period, rules, employee_ref=None):
+    """(employee_ref, base_salary, overtime, deductions, bonuses, net_pay, pay_basis) for the employees paid in period.
+
+    The attendance bonus threshold follows the period's working days.
+    Includes the period's retroactive adjustments (see adjustment_totals).
+    With employee_ref, just that employee, straight from attendance.
+    """
+    # Kiosk-maintained accruals cover every regular period; custom ranges still scan attendance
+    if period.kind == CUSTOM or employee_ref is not None:
+        totals = attendance_totals(conn, period, employee_ref=employee_ref)
+    else:
+        totals = accrued_totals(conn, period)
+    employee_refs = [row[0] for row in totals]
+    columns = np.array([tuple(row[1:]) for row in totals], dtype=float).reshape(-1, 3)
+    expected_days = business_calendar().expected_days([period])[0]
+    results = np.array(apply_rules(columns[:, 0], columns[:, 1], columns[:, 2], rules, expected_days,
+                                     period.month_share)).reshape(5, -1)
+    adjustments = adjustment_totals(conn, period.key, employee_ref)
+    if adjustments:
+        for row, employee in enumerate(employee_refs):
+            if employee in adjustments:
+                results[:, row] += adjustments[employee]
+    return [(ref,) + amounts + (pay_basis(rules, rate, expected_days, period.month_share),)
+            for ref, rate, amounts in zip(employee_refs, columns[:, 0].tolist(), zip(*results.tolist()))]
+
+def recompute_paid(conn, period, employee_ref, basis, rules):
+    """(base_salary, overtime, deductions, bonuses, net_pay) owed for one already-paid payroll row.
+
+    Only attendance is read again: the salary rate, pay rules (overtime
+    split included) and working days come from the row's pay_basis, so a
+    raise or rule change since it was paid is not back pay. Rows stored
+    before pay_basis existed fall back to rules and the current rate.
+    Includes the period's retroactive adjustments, like compute_payroll.
+    """
+    if not basis:
+        return compute_payroll(conn, period, rules, employee_ref=employee_ref)[0][1:6]
+    basis = json.loads(basis)
+    rules = PayRules.from_dict(basis['rules'])
+    days_worked, overtime_hours = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(CASE WHEN hours_worked > ? THEN hours_worked - ? ELSE 0 END), 0)
+        FROM attendance
+        WHERE employee_ref = ? AND date BETWEEN ? AND ? AND hours_worked IS NOT NULL
+    ''', (rules.hours_per_day, rules.hours_per_day, employee_ref) + period.bounds()).fetchone()
+    amounts = np.array(apply_rules(np.array([basis['salary_rate'] or 0.0]), np.array([days_worked]),
+                                   np.array([overtime_hours]), rules, basis['expected_days'],
+                                   basis['month_share'])).reshape(5)
+    adjustments = adjustment_totals(conn, period.key, employee_ref)
+    if employee_ref in adjustments:
+        amounts += adjustments[employee_ref]
+    return tuple(amounts.tolist())
+
+def generate_payroll(period, conn=None, rules=None, progress=None):
+    """Create payroll rows for the employees paid in a period (a PayPeriod or its key).
+
+    Any past or future period can be generated. Rows that already exist for
+    the period are left as they are, so a repeated or concurrent run can't
+    duplicate or change them (corrections go through payroll_diff).
+    progress(fraction, message=...) is called between steps (background
+    jobs). Returns the number of employees processed.
+    """
+    started = time.perf_counter()
+    conn = conn or get_db_connection()
+    rules = rules or PayRules.from_settings()
+    period = resolve_period(period)
+    start, end = period.bounds()
+
+    rows = [(row[0], period.key, start, end) + row[1:] for row in compute_payroll(conn, period, rules)]
+    if progress:
+        conn.commit()  # only reads so far; PostgreSQL opened a transaction for them
+        progress(0.6, message=f'Computed pay for {len(rows)} employees; writing payroll rows')
+
+    try:
+        conn.executemany('''INSERT INTO payroll(employee_ref, period, period_start, period_end,
+                                                base_salary, overtime, deductions, bonuses, net_pay, pay_basis)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (employee_ref, period) DO NOTHING''', rows)
+        refresh_summaries(conn, [period.key])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info("Generated payroll for %s: %d employees in %.1f ms", period.key, len(rows),
+                (time.perf_counter() - started) * 1000)
+    return len(rows)
+
+@job_handler('payroll')
+def payroll_job(job):
+    """Background payroll run; params hold the period as kind/start/end"""
+    params = job.params
+    period = PayPeriod(params['kind'], date.fromisoformat(params['start']), date.fromisoformat(params['end']))
+    count = generate_payroll(period, progress=job.progress)
+    return {'period': period.key, 'label': period.label, 'employees': count}
+
+def payroll_job_params(period):
+    return {'kind': period.kind, 'start': period.start.isoformat(), 'end': period.end.isoformat()}
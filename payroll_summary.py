@@ -0,0 +1,120 @@
+"""
+Payroll summaries
+Per-period and per-department totals (headcount, gross, deductions, net,
+overtime) kept in summary tables, refreshed for just the periods whose
+payroll rows were written, so the payroll pages read a few rows per period
+instead of every historical payroll row
+"""
+
+import logging
+import time
+from repository import Record, iter_payroll
+
+logger = logging.getLogger(__name__)
+
+# Periods per page on the payroll pages and the summary API
+PERIODS_PER_PAGE = 12
+
+# Payroll rows per page when a single period is opened
+ROWS_PER_PAGE = 100
+
+# Gross pay is what the agency pays out before deductions
+TOTALS_SQL = '''COUNT(*), SUM(p.base_salary), SUM(p.overtime), SUM(p.bonuses),
+                SUM(p.base_salary + p.overtime + p.bonuses), SUM(p.deductions), SUM(p.net_pay)'''
+
+class PeriodSummary(Record):
+    __slots__ = ('period', 'period_start', 'period_end', 'headcount', 'base_salary', 'overtime', 'bonuses',
+                 'gross_pay', 'deductions', 'net_pay')
+
+    @property
+    def overtime_share(self):
+        """Overtime as a fraction of gross pay"""
+        return self.overtime / self.gross_pay if self.gross_pay else 0.0
+
+class DepartmentSummary(Record):
+    __slots__ = ('department', 'headcount', 'base_salary', 'overtime', 'bonuses', 'gross_pay', 'deductions', 'net_pay')
+
+    @property
+    def overtime_share(self):
+        return self.overtime / self.gross_pay if self.gross_pay else 0.0
+
+def refresh_summaries(conn, periods):
+    """Recompute the summary rows of the given period keys from payroll; the caller commits.
+
+    Call in the transaction that writes the periods' payroll rows. Each
+    period is re-totalled from its own rows (idx_payroll_period), so the cost
+    follows the size of the periods written, not of the payroll history.
+    Departments are the employees' departments at refresh time.
+    """
+    for period in dict.fromkeys(periods):
+        conn.execute('DELETE FROM payroll_department_summary WHERE period = ?', (period,))
+        conn.execute('DELETE FROM payroll_period_summary WHERE period = ?', (period,))
+        conn.execute(f'''INSERT INTO payroll_period_summary(period, period_start, period_end, headcount, base_salary,
+                                                            overtime, bonuses, gross_pay, deductions, net_pay)
+                         SELECT p.period, MIN(p.period_start), MAX(p.period_end), {TOTALS_SQL}
+                         FROM payroll p WHERE p.period = ?
+                         GROUP BY p.period''', (period,))
+        conn.execute(f'''INSERT INTO payroll_department_summary(period, department, headcount, base_salary,
+                                                                overtime, bonuses, gross_pay, deductions, net_pay)
+                         SELECT p.period, COALESCE(NULLIF(e.department, ''), 'Unassigned'), {TOTALS_SQL}
+                         FROM payroll p LEFT JOIN employees e ON e.id = p.employee_ref
+                         WHERE p.period = ?
+                         GROUP BY p.period, COALESCE(NULLIF(e.department, ''), 'Unassigned')''', (period,))
+
+def rebuild_summaries(conn):
+    """Recompute every period's summaries; the caller commits"""
+    started = time.perf_counter()
+    periods = [row[0] for row in conn.execute('SELECT DISTINCT period FROM payroll').fetchall()]
+    conn.execute('DELETE FROM payroll_department_summary')
+    conn.execute('DELETE FROM payroll_period_summary')
+    refresh_summaries(conn, periods)
+    logger.info("Rebuilt payroll summaries for %d periods in %.1f ms", len(periods),
+                (time.perf_counter() - started) * 1000)
+    return len(periods)
+
+def period_summaries(conn, page=1):
+    """(summaries, page, page_count) for one page of periods, latest first; page is clamped to the range"""
+    total = conn.execute('SELECT COUNT(*) FROM payroll_period_summary').fetchone()[0]
+    page_count = max(1, -(-total // PERIODS_PER_PAGE))
+    page = min(max(1, page), page_count)
+    rows = conn.execute(f'''SELECT {', '.join(PeriodSummary.__slots__)} FROM payroll_period_summary
+                            ORDER BY period_start DESC, period DESC
+                            LIMIT ? OFFSET ?''', (PERIODS_PER_PAGE, (page - 1) * PERIODS_PER_PAGE)).fetchall()
+    return [PeriodSummary(*row) for row in rows], page, page_count
+
+def period_summary(conn, period):
+    row = conn.execute(f'''SELECT {', '.join(PeriodSummary.__slots__)} FROM payroll_period_summary
+                           WHERE period = ?''', (period,)).fetchone()
+    return PeriodSummary(*row) if row else None
+
+def department_summaries(conn, period):
+    rows = conn.execute(f'''SELECT {', '.join(DepartmentSummary.__slots__)} FROM payroll_department_summary
+                            WHERE period = ? ORDER BY gross_pay DESC, department''', (period,)).fetchall()
+    return [DepartmentSummary(*row) for row in rows]
+
+def as_dict(summary):
+    """JSON-ready summary with amounts rounded to centavos and the overtime share"""
+    data = {name: getattr(summary, name) for name in summary.__slots__}
+    for name in ('base_salary', 'overtime', 'bonuses', 'gross_pay', 'deductions', 'net_pay'):
+        data[name] = round(data[name] or 0.0, 2)
+    data['overtime_share'] = round(summary.overtime_share, 4)
+    return data
+
+def summary_view(conn, page=1, period=None, row_page=1):
+    """Context for the admin and HR payroll pages.
+
+    A page of period summaries, plus the departments and one page of
+    payroll rows (by employee ID) for the period opened with ?period=.
+    """
+    summaries, page, page_count = period_summaries(conn, page)
+    context = {'summaries': summaries, 'page': page, 'page_count': page_count,
+               'selected': None, 'departments': [], 'payroll_records': [], 'row_page': 1, 'row_page_count': 1}
+    selected = period_summary(conn, period) if period else None
+    if selected:
+        row_page_count = max(1, -(-selected.headcount // ROWS_PER_PAGE))
+        row_page = min(max(1, row_page), row_page_count)
+        context.update(selected=selected, departments=department_summaries(conn, period),
+                       row_page=row_page, row_page_count=row_page_count,
+                       payroll_records=list(iter_payroll(conn, period=period, by_period=True, limit=ROWS_PER_PAGE,
+                                                         offset=(row_page - 1) * ROWS_PER_PAGE)))
+    return context
@@ -0,0 +1,138 @@
+"""
+Payslips
+Printable HTML payslips rendered from payroll and employee rows. A period's
+batch is rendered across a process pool and streamed as a ZIP archive a few
+chunks at a time, so the whole batch is never held in memory
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import chain, islice
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from werkzeug.utils import secure_filename
+from repository import Record, stream
+
+logger = logging.getLogger(__name__)
+
+# Worker processes rendering a batch; 0 renders in the request's process
+WORKERS = int(os.environ.get('PAYSLIP_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Payslips per pool task, and tasks in flight per worker (bounds the memory a batch holds)
+CHUNK_SIZE = 200
+CHUNKS_PER_WORKER = 2
+
+# Never fork the web process for workers (see simulator.START_METHOD)
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+TEMPLATE = 'payslips/payslip.html'
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+class PayslipDocument(Record):
+    __slots__ = ('employee_id', 'name', 'department', 'position', 'salary_rate', 'period', 'period_start',
+                 'period_end', 'base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay', 'adjustments')
+
+    @property
+    def gross_pay(self):
+        return (self.base_salary or 0.0) + (self.overtime or 0.0) + (self.bonuses or 0.0)
+
+    @property
+    def filename(self):
+        return secure_filename(f'payslip_{self.employee_id}_{self.period}.html')
+
+# Net retroactive adjustments carried into the row's period (already included in its amounts)
+PAYSLIP_SQL = '''SELECT e.employee_id, e.name, e.department, e.position, e.salary_rate, p.period, p.period_start,
+                        p.period_end, p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay,
+                        (SELECT SUM(a.net_pay) FROM payroll_adjustments a
+                         WHERE a.employee_ref = p.employee_ref AND a.target_period = p.period)
+                 FROM payroll p JOIN employees e ON e.id = p.employee_ref'''
+
+def get_payslip(conn, employee_ref, period):
+    row = conn.execute(f'{PAYSLIP_SQL} WHERE p.employee_ref = ? AND p.period = ?', (employee_ref, period)).fetchone()
+    return PayslipDocument(*row) if row else None
+
+def iter_period_payslips(conn, period):
+    """Payslip rows of a period as plain tuples (they cross to pool processes), by employee ID"""
+    cursor = conn.execute(f'{PAYSLIP_SQL} WHERE p.period = ? ORDER BY e.employee_id', (period,))
+    return stream(cursor)
+
+_environment = None
+
+def _template():
+    # One environment per process; pool workers render without a Flask app
+    global _environment
+    if _environment is None:
+        _environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+    return _environment.get_template(TEMPLATE)
+
+def render_chunk(rows, company_name, generated_at):
+    """[(filename, document bytes)] for payslip rows; runs in a pool process"""
+    template = _template()
+    slips = [PayslipDocument(*row) for row in rows]
+    return [(slip.filename, template.render(slip=slip, company_name=company_name,
+                                            generated_at=generated_at).encode('utf-8')) for slip in slips]
+
+def _chunks(rows):
+    rows = iter(rows)
+    while chunk := [tuple(row) for row in islice(rows, CHUNK_SIZE)]:
+        yield chunk
+
+def render_batch(rows, company_name):
+    """Yield (filename, document) for every row, in order.
+
+    More than one chunk fans out over WORKERS processes, with at most
+    CHUNKS_PER_WORKER chunks per worker rendered ahead of the consumer.
+    """
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+    chunks = _chunks(rows)
+    head = list(islice(chunks, 2))
+    if WORKERS <= 0 or len(head) < 2:
+        for chunk in chain(head, chunks):
+            yield from render_chunk(chunk, company_name, generated_at)
+        return
+
+    with ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        pending = deque()
+        for chunk in chain(head, chunks):
+            if len(pending) >= WORKERS * CHUNKS_PER_WORKER:
+                yield from pending.popleft().result()
+            pending.append(pool.submit(render_chunk, chunk, company_name, generated_at))
+        while pending:
+            yield from pending.popleft().result()
+
+class _ZipStream:
+    """Write-only file for ZipFile that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+def stream_zip(rows, company_name):
+    """Yield a ZIP archive of the rows' payslips in pieces, one document at a time"""
+    started = time.perf_counter()
+    output = _ZipStream()
+    count = 0
+    # ZipFile sees an unseekable file, so each entry is written once with a trailing data descriptor
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, document in render_batch(rows, company_name):
+            archive.writestr(filename, document)
+            count += 1
+            yield output.drain()
+    yield output.drain()
+    logger.info("Streamed %d payslips in %.1f ms", count, (time.perf_counter() - started) * 1000)
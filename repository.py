@@ -0,0 +1,149 @@
+"""
+Query repository
+Employee, payroll and attendance queries shared by the admin, HR and employee
+routes, returning compact __slots__ records or streaming them in batches
+"""
+
+from itertools import chain, islice
+
+# Rows fetched from the cursor at a time by the streaming iterators
+STREAM_BATCH_SIZE = 500
+
+class Record:
+    """Compact row type; supports record.column and record['column'] like sqlite3.Row"""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return getattr(self, self.__slots__[key])
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+class EmployeeSummary(Record):
+    __slots__ = ('id', 'employee_id', 'name', 'department', 'position', 'role', 'status',
+                 'profile_picture', 'nfc_id', 'qr_code_path')
+
+class EmployeeQR(Record):
+    __slots__ = ('employee_id', 'name', 'qr_code_path')
+
+class PayrollRecord(Record):
+    __slots__ = ('employee_id', 'name', 'department', 'position', 'period',
+                 'base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay')
+
+class Payslip(Record):
+    __slots__ = ('period', 'base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay')
+
+class AttendanceRecord(Record):
+    __slots__ = ('employee_id', 'name', 'date', 'time_in', 'time_out', 'hours_worked', 'overtime_hours')
+
+class AttendanceEntry(Record):
+    __slots__ = ('date', 'time_in', 'time_out', 'hours_worked', 'overtime_hours')
+
+class RowStream:
+    """Lazily consumed result; truthiness peeks one row so templates can still use {% if rows %}"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._head = []
+
+    def __bool__(self):
+        if not self._head:
+            self._head = list(islice(self._rows, 1))
+        return bool(self._head)
+
+    def __iter__(self):
+        head, self._head = self._head, []
+        return chain(head, self._rows)
+
+def stream(cursor, make=None, batch_size=STREAM_BATCH_SIZE):
+    """Yield rows from an executed cursor one batch at a time, converted by make"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        if make is None:
+            yield from rows
+        else:
+            for row in rows:
+                yield make(*row)
+
+def _tuple(*values):
+    return values
+
+# --- employees ---
+
+def iter_employees(conn):
+    """Every employee for the admin/HR listings, by database id"""
+    cursor = conn.execute('''SELECT id, employee_id, name, department, position, role, status,
+                                    profile_picture, nfc_id, qr_code_path
+                             FROM employees ORDER BY id''')
+    return stream(cursor, EmployeeSummary)
+
+def iter_employee_directory(conn):
+    """(employee_id, name, department, position, salary_rate, role, status) tuples for exports"""
+    cursor = conn.execute('''SELECT employee_id, name, department, position, salary_rate, role, status
+                             FROM employees ORDER BY employee_id''')
+    return stream(cursor, _tuple)
+
+def get_employee_qr(conn, employee_id):
+    row = conn.execute('SELECT employee_id, name, qr_code_path FROM employees WHERE id = ?',
+                       (employee_id,)).fetchone()
+    return EmployeeQR(*row) if row else None
+
+# --- payroll ---
+
+def iter_payroll(conn, period=None, by_period=False, as_tuples=False, limit=None, offset=0):
+    """Payroll rows joined with employee details.
+
+    Newest first by default; by_period orders by period then employee ID (for
+    exports and paged period listings). as_tuples yields plain tuples in
+    PayrollRecord field order.
+    """
+    order = 'p.period DESC, e.employee_id' if by_period else 'p.id DESC'
+    where = 'WHERE p.period = ?' if period else ''
+    params = (period,) if period else ()
+    page = ''
+    if limit is not None:
+        page = 'LIMIT ? OFFSET ?'
+        params += (limit, offset)
+    cursor = conn.execute(f'''SELECT e.employee_id, e.name, e.department, e.position, p.period,
+                                     p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay
+                              FROM payroll p JOIN employees e ON e.id = p.employee_ref
+                              {where}
+                              ORDER BY {order}
+                              {page}''', params)
+    return stream(cursor, _tuple if as_tuples else PayrollRecord)
+
+def iter_employee_payslips(conn, employee_ref):
+    cursor = conn.execute('''SELECT period, base_salary, overtime, deductions, bonuses, net_pay
+                             FROM payroll WHERE employee_ref = ? ORDER BY id DESC''', (employee_ref,))
+    return stream(cursor, Payslip)
+
+# --- attendance ---
+
+def iter_employee_attendance(conn, employee_ref):
+    """All attendance of one employee, newest first"""
+    cursor = conn.execute('''SELECT date, time_in, time_out, hours_worked, overtime_hours FROM attendance
+                             WHERE employee_ref = ? ORDER BY date DESC''', (employee_ref,))
+    return stream(cursor, AttendanceEntry)
+
+def recent_attendance(conn, limit=100):
+    rows = conn.execute('''SELECT e.employee_id, e.name, a.date, a.time_in, a.time_out, a.hours_worked, a.overtime_hours
+                           FROM attendance a JOIN employees e ON e.id = a.employee_ref
+                           ORDER BY a.date DESC, e.employee_id
+                           LIMIT ?''', (limit,)).fetchall()
+    return [AttendanceRecord(*row) for row in rows]
@@ -0,0 +1,269 @@
+"""
+Request metrics
+Per-endpoint latency histograms, in-flight counts, response sizes and error
+counts, shared between gunicorn workers through small per-process files and
+rendered in the Prometheus text format
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Each worker writes its counters here; the metrics endpoint merges them
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'payroll_metrics'))
+
+# How often (seconds) a worker rewrites its file when it has new data
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+
+# p95 latency targets (milliseconds) highlighted on the system status page
+LATENCY_TARGETS_MS = {
+    'kiosk.scan_process': float(os.environ.get('KIOSK_LATENCY_TARGET_MS', 300)),
+}
+
+def _new_endpoint():
+    return {
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),  # last one is +Inf
+        'count': 0,
+        'sum': 0.0,
+        'statuses': {},
+        'errors': 0,
+        'response_bytes': 0,
+        'in_flight': 0,
+    }
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class RequestMetrics:
+    """Collects request timings for this worker and merges every worker's files on read"""
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._pid = os.getpid()
+        self._dirty = False
+        self._flusher = None
+
+    def init_app(self, app):
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _state(self):
+        # A forked worker starts its own counters instead of repeating its parent's
+        if self._pid != os.getpid():
+            self._endpoints = {}
+            self._pid = os.getpid()
+            self._flusher = None
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+        return self._endpoints
+
+    def _flush_loop(self):
+        # Writing from a thread keeps file I/O out of requests and catches a worker's last burst
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty and self._pid == os.getpid():
+                self.flush()
+
+    def _endpoint(self):
+        # Unmatched URLs share one label so scanners can't grow the label set
+        return request.endpoint or 'unmatched'
+
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        with self._lock:
+            self._state().setdefault(self._endpoint(), _new_endpoint())['in_flight'] += 1
+
+    def _after_request(self, response):
+        g._metrics_status = response.status_code
+        g._metrics_bytes = response.calculate_content_length() or response.content_length or 0
+        return response
+
+    def _teardown_request(self, exc=None):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        status = g.pop('_metrics_status', 500 if exc is not None else 200)
+        size = g.pop('_metrics_bytes', 0)
+
+        with self._lock:
+            entry = self._state().setdefault(self._endpoint(), _new_endpoint())
+            entry['in_flight'] = max(0, entry['in_flight'] - 1)
+            entry['count'] += 1
+            entry['sum'] += elapsed
+            entry['response_bytes'] += size
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            else:
+                entry['buckets'][-1] += 1
+            key = str(status)
+            entry['statuses'][key] = entry['statuses'].get(key, 0) + 1
+            if status >= 500:
+                entry['errors'] += 1
+            self._dirty = True
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def flush(self):
+        """Write this worker's counters to its file (atomically, via rename)"""
+        with self._lock:
+            data = json.dumps({'pid': os.getpid(), 'endpoints': self._state()})
+            self._dirty = False
+        path = self._path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write request metrics to %s", path)
+
+    def collect(self):
+        """Counters summed over every live worker, keyed by endpoint"""
+        self.flush()
+        merged = {}
+        workers = 0
+        for name in os.listdir(self.directory):
+            if not (name.startswith('metrics_') and name.endswith('.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[len('metrics_'):-len('.json')])
+            except ValueError:
+                continue
+            # Files of exited workers go away; Prometheus treats the drop as a counter reset
+            if not _pid_alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            workers += 1
+            for endpoint, entry in data['endpoints'].items():
+                total = merged.setdefault(endpoint, _new_endpoint())
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+                for key in ('count', 'sum', 'errors', 'response_bytes', 'in_flight'):
+                    total[key] += entry[key]
+                for status, count in entry['statuses'].items():
+                    total['statuses'][status] = total['statuses'].get(status, 0) + count
+        return merged, workers
+
+    def summary(self):
+        """Per-endpoint latency percentiles and rates for the system status page, slowest first"""
+        merged, workers = self.collect()
+        rows = []
+        for endpoint, entry in merged.items():
+            if not entry['count']:
+                continue
+            p95_ms = quantile(entry['buckets'], 0.95) * 1000
+            target_ms = LATENCY_TARGETS_MS.get(endpoint)
+            rows.append({
+                'endpoint': endpoint,
+                'requests': entry['count'],
+                'in_flight': entry['in_flight'],
+                'p50_ms': quantile(entry['buckets'], 0.50) * 1000,
+                'p95_ms': p95_ms,
+                'p99_ms': quantile(entry['buckets'], 0.99) * 1000,
+                'avg_ms': entry['sum'] / entry['count'] * 1000,
+                'error_rate': entry['errors'] / entry['count'],
+                'avg_bytes': entry['response_bytes'] / entry['count'],
+                'target_ms': target_ms,
+                'meets_target': target_ms is None or p95_ms <= target_ms,
+            })
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return rows, workers
+
+    def render_prometheus(self):
+        """All workers' counters in the Prometheus text exposition format"""
+        merged, workers = self.collect()
+        lines = [
+            '# HELP payroll_http_request_duration_seconds Request latency by endpoint.',
+            '# TYPE payroll_http_request_duration_seconds histogram',
+        ]
+        for endpoint, entry in sorted(merged.items()):
+            label = _label(endpoint)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+                cumulative += count
+                lines.append(f'payroll_http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'payroll_http_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'payroll_http_request_duration_seconds_sum{{endpoint="{label}"}} {entry["sum"]:.6f}')
+            lines.append(f'payroll_http_request_duration_seconds_count{{endpoint="{label}"}} {entry["count"]}')
+
+        lines += ['# HELP payroll_http_requests_total Completed requests by endpoint and status code.',
+                  '# TYPE payroll_http_requests_total counter']
+        for endpoint, entry in sorted(merged.items()):
+            for status, count in sorted(entry['statuses'].items()):
+                lines.append(f'payroll_http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+        lines += ['# HELP payroll_http_request_errors_total Requests that ended with a 5xx status.',
+                  '# TYPE payroll_http_request_errors_total counter']
+        for endpoint, entry in sorted(merged.items()):
+            lines.append(f'payroll_http_request_errors_total{{endpoint="{_label(endpoint)}"}} {entry["errors"]}')
+
+        lines += ['# HELP payroll_http_response_bytes_total Response body bytes sent.',
+                  '# TYPE payroll_http_response_bytes_total counter']
+        for endpoint, entry in sorted(merged.items()):
+            lines.append(f'payroll_http_response_bytes_total{{endpoint="{_label(endpoint)}"}} {entry["response_bytes"]}')
+
+        lines += ['# HELP payroll_http_requests_in_flight Requests being handled right now.',
+                  '# TYPE payroll_http_requests_in_flight gauge']
+        for endpoint, entry in sorted(merged.items()):
+            lines.append(f'payroll_http_requests_in_flight{{endpoint="{_label(endpoint)}"}} {entry["in_flight"]}')
+
+        lines += ['# HELP payroll_workers Worker processes reporting metrics.',
+                  '# TYPE payroll_workers gauge',
+                  f'payroll_workers {workers}']
+        return '\n'.join(lines) + '\n'
+
+def quantile(buckets, q):
+    """Estimate a quantile (seconds) from histogram bucket counts by linear interpolation"""
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for i, count in enumerate(buckets):
+        upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+        if count and cumulative + count >= rank:
+            if i == len(LATENCY_BUCKETS):
+                return upper  # beyond the last bound: report the bound
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = upper
+    return LATENCY_BUCKETS[-1]
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+request_metrics = RequestMetrics()
@@ -1,10 +1,22 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_file
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, flash, current_app, send_file, session, jsonify
 from werkzeug.utils import secure_filename
 from auth import login_required, role_required
-from database import get_db_connection, next_employee_id
+from database import get_db_connection, get_report_connection, next_employee_id, log_security_event
+from password_hashing import hash_password, password_for_update, BCRYPT_ROUNDS
+from payroll_engine import current_period, default_pay_frequency, period_from_form, payroll_job_params
+from jobs import job_queue
+from simulator import parse_scenarios, simulate, simulation_periods
+from payroll_diff import DryRunNotFound, apply_run, diff, discard_run, dry_run
+from payroll_summary import summary_view
+from adjustments import dirty_count, pending_adjustments
+from accruals import rebuild_accruals
+from pay_periods import PERIOD_KINDS, PAY_FREQUENCIES, pay_frequency
+from repository import RowStream
+import repository
 from qr_utils import generate_employee_qr_code, get_employee_qr_download_path
-from datetime import datetime
+from datetime import datetime, date
 import os
+import uuid
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -18,12 +30,12 @@ def dashboard():
     conn = get_db_connection()
     
     # Get statistics
-    total_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = "Active"').fetchone()[0]
+    total_employees = conn.execute("SELECT COUNT(*) FROM employees WHERE status = 'Active'").fetchone()[0]
     total_attendance_today = conn.execute(
         'SELECT COUNT(*) FROM attendance WHERE date = ?', 
         (datetime.now().strftime('%Y-%m-%d'),)
     ).fetchone()[0]
-    pending_leaves = conn.execute('SELECT COUNT(*) FROM leaves WHERE status = "Pending"').fetchone()[0]
+    pending_leaves = conn.execute("SELECT COUNT(*) FROM leaves WHERE status = 'Pending'").fetchone()[0]
     
     conn.close()
     
@@ -37,13 +49,10 @@ def dashboard():
 @role_required('Admin')
 def list_employees():
     conn = get_db_connection()
-    employees = conn.execute('''
-        SELECT id, employee_id, name, department, position, role, status, profile_picture, nfc_id, qr_code_path
-        FROM employees ORDER BY id
-    ''').fetchall()
-    conn.close()
+    employees = RowStream(repository.iter_employees(conn))
     
-    return render_template('admin/list_employees.html', employees=employees)
+    # Rows are rendered as they are read instead of being loaded up front
+    return stream_template('admin/list_employees.html', employees=employees)
 
 @admin_bp.route('/download_qr/<int:employee_id>')
 @login_required
@@ -51,8 +60,7 @@ def list_employees():
 def download_qr(employee_id):
     """Download QR code for an employee"""
     conn = get_db_connection()
-    employee = conn.execute('SELECT employee_id, name, qr_code_path FROM employees WHERE id = ?', 
-                           (employee_id,)).fetchone()
+    employee = repository.get_employee_qr(conn, employee_id)
     conn.close()
     
     if not employee or not employee['qr_code_path']:
@@ -99,17 +107,19 @@ def add_employee():
                 file.save(file_path)
                 profile_picture = filename
         
+        # Hash before taking the ID: the ID is allocated in the insert's transaction
+        hashed_password = hash_password(password)
         empid = next_employee_id()
         
         conn = get_db_connection()
         try:
             # Insert employee with NFC ID
-            conn.execute('''INSERT INTO employees(employee_id,username,password,name,department,position,salary_rate,role,status,profile_picture,nfc_id)
-                           VALUES(?,?,?,?,?,?,?,?,?,?,?)''',
-                        (empid, username, password, name, department, position, salary_rate, role, 'Active', profile_picture, nfc_id))
+            cur = conn.execute('''INSERT INTO employees(employee_id,username,password,password_cost,name,department,position,salary_rate,role,status,profile_picture,nfc_id)
+                           VALUES(?,?,?,?,?,?,?,?,?,?,?,?)''',
+                        (empid, username, hashed_password, BCRYPT_ROUNDS, name, department, position, salary_rate, role, 'Active', profile_picture, nfc_id))
             
             # Get the employee's database ID for QR code generation
-            employee_db_id = conn.lastrowid
+            employee_db_id = cur.lastrowid
             
             # Generate QR code automatically
             try:
@@ -130,72 +140,109 @@ def add_employee():
     
     return render_template('admin/add_employee.html')
 
-@admin_bp.route('/payroll')
+@admin_bp.route('/payroll', methods=['GET', 'POST'])
 @login_required
 @role_required('Admin')
 def payroll():
     conn = get_db_connection()
     
-    # Enhanced payroll generation
-    if request.args.get('generate'):
-        period = datetime.now().strftime('%Y-%m')
-        employees = conn.execute('SELECT * FROM employees WHERE status = "Active"').fetchall()
-        
-        for emp in employees:
-            # Calculate actual working days based on attendance
-            actual_days = conn.execute('''SELECT COUNT(*) FROM attendance 
-                                        WHERE employee_ref = ? AND date LIKE ? AND time_in IS NOT NULL AND time_out IS NOT NULL''',
-                                     (emp['id'], f"{period}%")).fetchone()[0]
-            
-            # Base salary calculation
-            base_salary = emp['salary_rate'] * actual_days
-            
-            # Calculate overtime (hours over 8 per day)
-            overtime_hours = conn.execute('''SELECT SUM(
-                CASE WHEN time_in IS NOT NULL AND time_out IS NOT NULL THEN
-                    MAX(0, (strftime('%s', time_out) - strftime('%s', time_in)) / 3600.0 - 8)
-                ELSE 0 END
-            ) FROM attendance WHERE employee_ref = ? AND date LIKE ?''', 
-            (emp['id'], f"{period}%")).fetchone()[0] or 0
-            
-            overtime = overtime_hours * (emp['salary_rate'] / 8) * 1.5  # 1.5x rate for overtime
-            
-            # Calculate deductions (tax, insurance, etc.)
-            gross_pay = base_salary + overtime
-            tax_deduction = gross_pay * 0.12  # 12% income tax
-            insurance_deduction = gross_pay * 0.03  # 3% health insurance
-            retirement_deduction = gross_pay * 0.05  # 5% retirement fund
-            deductions = tax_deduction + insurance_deduction + retirement_deduction
-            
-            # Performance bonuses (simplified - could be enhanced)
-            bonuses = 0
-            if actual_days >= 20:  # Full attendance bonus
-                bonuses += emp['salary_rate'] * 2
-            
-            net_pay = gross_pay + bonuses - deductions
-            
-            # Check if payroll already exists for this period
-            existing = conn.execute('SELECT id FROM payroll WHERE employee_ref = ? AND period = ?',
-                                  (emp['id'], period)).fetchone()
-            
-            if not existing:
-                conn.execute('''INSERT INTO payroll(employee_ref,period,base_salary,overtime,deductions,bonuses,net_pay)
-                               VALUES(?,?,?,?,?,?,?)''',
-                            (emp['id'], period, base_salary, overtime, deductions, bonuses, net_pay))
-        
-        conn.commit()
-        flash(f'Enhanced payroll generated for {period} with detailed calculations', 'success')
+    # Enhanced payroll generation: the current default period, or any past/future period from the form.
+    # It runs as a background job; the form's job_key makes a resubmitted form return the same job.
+    if request.method == 'POST' or request.args.get('generate'):
+        try:
+            period = period_from_form(request.form) if request.method == 'POST' else current_period()
+        except ValueError as e:
+            flash(f'Invalid pay period: {str(e)}', 'danger')
+            return redirect(url_for('admin.payroll'))
+        job_id = job_queue.enqueue('payroll', payroll_job_params(period), user_id=session.get('user_id'),
+                                   key=request.form.get('job_key'))
+        flash(f'Payroll for {period.label} ({period.key}) queued', 'info')
+        return redirect(url_for('jobs.view', job_id=job_id))
     
-    # Get payroll records
-    payroll_records = conn.execute('''
-        SELECT e.employee_id, e.name, p.period, p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay
-        FROM payroll p JOIN employees e ON e.id = p.employee_ref
-        ORDER BY p.id DESC
-    ''').fetchall()
+    # Period and department totals come from the summary tables; rows are listed one period and page at a time
+    summary = summary_view(conn, page=request.args.get('page', 1, type=int), period=request.args.get('period'),
+                           row_page=request.args.get('rows', 1, type=int))
+    dirty = dirty_count(conn)
+    adjustments = pending_adjustments(conn)
     
     conn.close()
     
-    return render_template('admin/payroll.html', payroll_records=payroll_records)
+    return stream_template('admin/payroll.html', **summary, dirty=dirty, adjustments=adjustments,
+                           period_kinds=PERIOD_KINDS, default_kind=default_pay_frequency(),
+                           current_period=current_period(), today=date.today().isoformat(),
+                           job_key=uuid.uuid4().hex)
+
+@admin_bp.route('/payroll/reconcile', methods=['POST'])
+@login_required
+@role_required('Admin')
+def reconcile_payroll():
+    """Queue reconciliation of already-paid periods whose attendance changed"""
+    job_id = job_queue.enqueue('reconcile_payroll', user_id=session.get('user_id'), key=request.form.get('job_key'))
+    return redirect(url_for('jobs.view', job_id=job_id))
+
+@admin_bp.route('/payroll/dry-run', methods=['POST'])
+@login_required
+@role_required('Admin')
+def payroll_dry_run():
+    """Recompute a period into staging and show how it differs from the stored payroll"""
+    try:
+        period = period_from_form(request.form)
+    except ValueError as e:
+        flash(f'Invalid pay period: {str(e)}', 'danger')
+        return redirect(url_for('admin.payroll'))
+    run_id = dry_run(get_db_connection(), period, user_id=session.get('user_id'))
+    return redirect(url_for('admin.payroll_diff', run_id=run_id))
+
+@admin_bp.route('/payroll/dry-run/<run_id>')
+@login_required
+@role_required('Admin')
+def payroll_diff(run_id):
+    try:
+        result = diff(get_db_connection(), run_id)
+    except DryRunNotFound:
+        flash('That dry run was already applied or has expired', 'warning')
+        return redirect(url_for('admin.payroll'))
+    return render_template('admin/payroll_diff.html', diff=result)
+
+@admin_bp.route('/payroll/dry-run/<run_id>/apply', methods=['POST'])
+@login_required
+@role_required('Admin')
+def apply_payroll_dry_run(run_id):
+    """Write only the new and changed rows of a dry run, in one transaction"""
+    try:
+        inserted, updated = apply_run(get_db_connection(), run_id)
+    except DryRunNotFound:
+        flash('That dry run was already applied or has expired', 'warning')
+        return redirect(url_for('admin.payroll'))
+    log_security_event('PAYROLL_CORRECTION', session['user_id'], request.remote_addr,
+                       f"Applied payroll dry run {run_id}: {inserted} rows added, {updated} updated")
+    flash(f'Payroll updated: {inserted} rows added, {updated} rows corrected', 'success')
+    return redirect(url_for('admin.payroll'))
+
+@admin_bp.route('/payroll/dry-run/<run_id>/discard', methods=['POST'])
+@login_required
+@role_required('Admin')
+def discard_payroll_dry_run(run_id):
+    discard_run(get_db_connection(), run_id)
+    flash('Dry run discarded; payroll was not changed', 'info')
+    return redirect(url_for('admin.payroll'))
+
+@admin_bp.route('/payroll/simulate', methods=['POST'])
+@login_required
+@role_required('Admin')
+def simulate_payroll():
+    """What-if API: evaluate rule scenarios over past periods' attendance without writing payroll.
+
+    Body: {"periods": ["2025-07", ...], "scenarios": [{"name": ..., "settings": {"tax_rate": 0.15}}]};
+    periods defaults to the last completed periods of the default frequency.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        periods = simulation_periods(data.get('periods'))
+        scenarios = parse_scenarios(data.get('scenarios'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(simulate(get_report_connection(), periods, scenarios))
 
 @admin_bp.route('/edit_employee/<int:employee_id>', methods=['GET', 'POST'])
 @login_required
@@ -205,7 +252,7 @@ def edit_employee(employee_id):
     
     if request.method == 'POST':
         username = request.form['username']
-        password = request.form['password']
+        password = request.form.get('password', '')
         name = request.form['name']
         department = request.form['department']
         position = request.form['position']
@@ -215,10 +262,13 @@ def edit_employee(employee_id):
             salary_rate = 0.0
         role = request.form['role']
         status = request.form['status']
+        # Blank means the company default (payroll_period setting)
+        frequency = pay_frequency(request.form.get('pay_frequency'), None)
         
         # Handle file upload
-        current_employee = conn.execute('SELECT profile_picture FROM employees WHERE id = ?', (employee_id,)).fetchone()
+        current_employee = conn.execute('SELECT password, profile_picture, pay_frequency FROM employees WHERE id = ?', (employee_id,)).fetchone()
         profile_picture = current_employee['profile_picture'] if current_employee else ''
+        password, password_cost = password_for_update(password, current_employee['password'] if current_employee else None)
         
         if 'profile_picture' in request.files:
             file = request.files['profile_picture']
@@ -237,9 +287,12 @@ def edit_employee(employee_id):
                 profile_picture = filename
         
         try:
-            conn.execute('''UPDATE employees SET username=?, password=?, name=?, department=?, position=?, 
-                           salary_rate=?, role=?, status=?, profile_picture=? WHERE id=?''',
-                        (username, password, name, department, position, salary_rate, role, status, profile_picture, employee_id))
+            conn.execute('''UPDATE employees SET username=?, password=?, password_cost=?, name=?, department=?, position=?, 
+                           salary_rate=?, pay_frequency=?, role=?, status=?, profile_picture=? WHERE id=?''',
+                        (username, password, password_cost, name, department, position, salary_rate, frequency, role, status, profile_picture, employee_id))
+            # Attendance already accrued moves to the periods of the new frequency
+            if current_employee and current_employee['pay_frequency'] != frequency:
+                rebuild_accruals(conn, employee_id)
             conn.commit()
             flash('Employee updated successfully', 'success')
             return redirect(url_for('admin.list_employees'))
@@ -256,7 +309,7 @@ def edit_employee(employee_id):
         flash('Employee not found', 'danger')
         return redirect(url_for('admin.list_employees'))
     
-    return render_template('admin/edit_employee.html', employee=employee)
+    return render_template('admin/edit_employee.html', employee=employee, pay_frequencies=PAY_FREQUENCIES)
 
 @admin_bp.route('/delete_employee/<int:employee_id>')
 @login_required
@@ -275,7 +328,7 @@ def delete_employee(employee_id):
                 os.remove(file_path)
         
         # Set status to Inactive instead of hard delete to preserve data integrity
-        conn.execute('UPDATE employees SET status = "Inactive" WHERE id = ?', (employee_id,))
+        conn.execute("UPDATE employees SET status = 'Inactive' WHERE id = ?", (employee_id,))
         conn.commit()
         flash(f'Employee {employee["name"]} has been deactivated', 'success')
     else:
@@ -77,7 +77,7 @@ def status_lookup():
 @login_required
 @role_required(['Admin', 'HR'])
 def manage_applications():
-    conn = database.get_db_connection()
+    conn = database.get_report_connection()
     c = conn.cursor()
     c.execute("""SELECT * FROM applications ORDER BY 
                  CASE status 
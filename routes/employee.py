@@ -1,6 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, flash, session
 from auth import login_required, role_required
 from database import get_db_connection
+from accruals import earned_so_far
+from business_calendar import business_calendar, leave_days_by_id
+from repository import RowStream
+from payslips import TEMPLATE as PAYSLIP_TEMPLATE, get_payslip
+from datetime import datetime
+from settings_cache import settings_cache
+import repository
 
 employee_bp = Blueprint('employee', __name__)
 
@@ -20,8 +27,8 @@ def dashboard():
     
     # Get employee's leave balance (simplified)
     total_leaves = conn.execute('SELECT COUNT(*) FROM leaves WHERE employee_ref = ?', (user_id,)).fetchone()[0]
-    approved_leaves = conn.execute('SELECT COUNT(*) FROM leaves WHERE employee_ref = ? AND status = "Approved"', (user_id,)).fetchone()[0]
-    pending_leaves = conn.execute('SELECT COUNT(*) FROM leaves WHERE employee_ref = ? AND status = "Pending"', (user_id,)).fetchone()[0]
+    approved_leaves = conn.execute("SELECT COUNT(*) FROM leaves WHERE employee_ref = ? AND status = 'Approved'", (user_id,)).fetchone()[0]
+    pending_leaves = conn.execute("SELECT COUNT(*) FROM leaves WHERE employee_ref = ? AND status = 'Pending'", (user_id,)).fetchone()[0]
     
     conn.close()
     
@@ -43,6 +50,12 @@ def request_leave():
         end_date = request.form['end_date']
         reason = request.form['reason']
         
+        # Count the working days now, so a range that is all weekends or holidays is caught before HR sees it
+        days = float(business_calendar().leave_days([(duration, start_date, end_date)])[0])
+        if not days:
+            flash('The leave dates must include at least one working day', 'danger')
+            return render_template('employee/request_leave.html')
+        
         conn = get_db_connection()
         conn.execute('''INSERT INTO leaves(employee_ref,type,duration,start_date,end_date,reason,status)
                        VALUES(?,?,?,?,?,?,'Pending')''',
@@ -50,7 +63,7 @@ def request_leave():
         conn.commit()
         conn.close()
         
-        flash('Leave request submitted successfully', 'success')
+        flash(f"Leave request for {days:g} working day{'' if days == 1 else 's'} submitted successfully", 'success')
         return redirect(url_for('employee.dashboard'))
     
     return render_template('employee/request_leave.html')
@@ -62,32 +75,42 @@ def stats():
     user_id = session['user_id']
     conn = get_db_connection()
     
-    # Get attendance records
-    attendance_records = conn.execute('''
-        SELECT date, time_in, time_out FROM attendance 
-        WHERE employee_ref = ? 
-        ORDER BY date DESC
-    ''', (user_id,)).fetchall()
+    # Get attendance records (streamed; this is the employee's whole history)
+    attendance_records = RowStream(repository.iter_employee_attendance(conn, user_id))
     
     # Get leave records
     leave_records = conn.execute('''
-        SELECT type, duration, start_date, end_date, status 
+        SELECT id, type, duration, start_date, end_date, status 
         FROM leaves 
         WHERE employee_ref = ? 
         ORDER BY id DESC
     ''', (user_id,)).fetchall()
     
+    leave_days = leave_days_by_id(leave_records)
+    
     # Get payroll records
-    payroll_records = conn.execute('''
-        SELECT period, base_salary, overtime, deductions, bonuses, net_pay 
-        FROM payroll 
-        WHERE employee_ref = ? 
-        ORDER BY id DESC
-    ''', (user_id,)).fetchall()
+    payroll_records = RowStream(repository.iter_employee_payslips(conn, user_id))
+    
+    # Earned so far this pay period, from the running accrual (one row)
+    employee = conn.execute('SELECT id, salary_rate, pay_frequency FROM employees WHERE id = ?', (user_id,)).fetchone()
+    earned = earned_so_far(conn, employee) if employee else None
     
     conn.close()
     
-    return render_template('employee/stats.html',
+    return stream_template('employee/stats.html',
                          attendance_records=attendance_records,
                          leave_records=leave_records,
-                         payroll_records=payroll_records)
+                         leave_days=leave_days,
+                         payroll_records=payroll_records,
+                         earned=earned)
+
+@employee_bp.route('/payslip')
+@login_required
+@role_required('Employee')
+def payslip():
+    slip = get_payslip(get_db_connection(), session['user_id'], request.args.get('period', ''))
+    if slip is None:
+        flash('Payslip not found', 'danger')
+        return redirect(url_for('employee.stats'))
+    return render_template(PAYSLIP_TEMPLATE, slip=slip, company_name=settings_cache.get('company_name'),
+                           generated_at=datetime.now().strftime('%Y-%m-%d %H:%M'))
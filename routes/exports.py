@@ -1,144 +1,121 @@
-from flask import Blueprint, request, session, make_response
+from flask import Blueprint, Response, request, session, redirect, url_for, flash, stream_with_context
 from auth import login_required, role_required
 import database
+import repository
+from settings_cache import settings_cache
+from payslips import iter_period_payslips, stream_zip
+from jobs import job_queue, job_handler
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
-import io
+from openpyxl.cell import WriteOnlyCell
 from datetime import datetime
+from werkzeug.utils import secure_filename
 
 exports_bp = Blueprint('exports', __name__)
 
+# Spreadsheets are built by background jobs; these routes queue one and show its progress page
+
 @exports_bp.route('/export/employees')
 @login_required
 @role_required(['Admin', 'HR'])
 def export_employees():
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT employee_id, name, department, position, salary_rate, role, status
-        FROM employees 
-        ORDER BY employee_id
-    """)
-    employees = c.fetchall()
-    conn.close()
-    
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Employee Directory"
-    
-    # Add header styling
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="2F4F4F", end_color="2F4F4F", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Headers
-    headers = ["Employee ID", "Full Name", "Department", "Position", "Daily Rate (₱)", "Role", "Status"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        ws.column_dimensions[get_column_letter(col)].width = 15
-    
-    # Add data
-    for row, emp in enumerate(employees, 2):
-        ws.cell(row=row, column=1, value=emp['employee_id'])
-        ws.cell(row=row, column=2, value=emp['name'])
-        ws.cell(row=row, column=3, value=emp['department'])
-        ws.cell(row=row, column=4, value=emp['position'])
-        ws.cell(row=row, column=5, value=f"₱{emp['salary_rate']:.2f}")
-        ws.cell(row=row, column=6, value=emp['role'])
-        ws.cell(row=row, column=7, value=emp['status'])
-    
-    # Save to memory
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"Employee_Directory_{timestamp}.xlsx"
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    
-    return response
+    job_id = job_queue.enqueue('export_employees', user_id=session.get('user_id'),
+                               key=request.args.get('job_key'))
+    return redirect(url_for('jobs.view', job_id=job_id))
 
 @exports_bp.route('/export/payroll')
 @login_required
 @role_required(['Admin', 'HR'])
 def export_payroll():
     period = request.args.get('period', '')
-    
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    
-    if period:
-        c.execute("""
-            SELECT e.employee_id, e.name, e.department, e.position, 
-                   p.period, p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay
-            FROM payroll p
-            JOIN employees e ON p.employee_ref = e.id
-            WHERE p.period = ?
-            ORDER BY e.employee_id
-        """, (period,))
-    else:
-        c.execute("""
-            SELECT e.employee_id, e.name, e.department, e.position, 
-                   p.period, p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay
-            FROM payroll p
-            JOIN employees e ON p.employee_ref = e.id
-            ORDER BY p.period DESC, e.employee_id
-        """)
-    
-    payroll_data = c.fetchall()
-    conn.close()
-    
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Payroll Report"
-    
-    # Add header styling
+    job_id = job_queue.enqueue('export_payroll', {'period': period}, user_id=session.get('user_id'),
+                               key=request.args.get('job_key'))
+    return redirect(url_for('jobs.view', job_id=job_id))
+
+# Payslips stream straight into the response: the ZIP is written as the pool renders, so it needs no job or file
+@exports_bp.route('/export/payslips')
+@login_required
+@role_required(['Admin', 'HR'])
+def export_payslips():
+    period = request.args.get('period', '')
+    conn = database.get_report_connection()
+    if not period or conn.execute('SELECT 1 FROM payroll WHERE period = ? LIMIT 1', (period,)).fetchone() is None:
+        flash('No payroll has been generated for that period', 'warning')
+        return redirect(url_for('admin.payroll' if session.get('role') == 'Admin' else 'hr.payroll_report', period=period))
+    archive = stream_zip(iter_period_payslips(conn, period), settings_cache.get('company_name'))
+    return Response(stream_with_context(archive), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename=Payslips_{secure_filename(period)}.zip'})
+
+@job_handler('export_employees')
+def build_employee_directory(job):
+    conn = database.get_report_connection()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
+        
+        # Write-only workbook: rows go straight from the cursor to the sheet
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Employee Directory")
+        
+        # Headers
+        headers = ["Employee ID", "Full Name", "Department", "Position", "Daily Rate (₱)", "Role", "Status"]
+        ws.append(_header_row(ws, headers, "2F4F4F"))
+        
+        # Add data
+        for done, (employee_id, name, department, position, salary_rate, role, status) in enumerate(
+                repository.iter_employee_directory(conn), 1):
+            ws.append((employee_id, name, department, position, f"₱{salary_rate:.2f}", role, status))
+            job.progress(done, total)
+    finally:
+        conn.close()
+    
+    job.progress(1.0, message='Saving workbook')
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    wb.save(job.result_file(f"Employee_Directory_{timestamp}.xlsx"))
+    return {'rows': total}
+
+@job_handler('export_payroll')
+def build_payroll_report(job):
+    period = job.params.get('period', '')
+    
+    conn = database.get_report_connection()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM payroll {'WHERE period = ?' if period else ''}",
+                             (period,) if period else ()).fetchone()[0]
+        
+        # Write-only workbook: rows go straight from the cursor to the sheet
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Payroll Report")
+        
+        # Headers
+        headers = ["Employee ID", "Name", "Department", "Position", "Period", "Base Salary", "Overtime", "Deductions", "Bonuses", "Net Pay"]
+        ws.append(_header_row(ws, headers, "8B0000"))
+        
+        # Add data
+        for done, record in enumerate(repository.iter_payroll(conn, period=period or None, by_period=True, as_tuples=True), 1):
+            ws.append(record[:5] + tuple(f"₱{amount:.2f}" for amount in record[5:]))
+            job.progress(done, total)
+    finally:
+        conn.close()
+    
+    job.progress(1.0, message='Saving workbook')
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    period_suffix = f"_{period}" if period else ""
+    wb.save(job.result_file(f"Payroll_Report{period_suffix}_{timestamp}.xlsx"))
+    return {'rows': total}
+
+def _header_row(ws, headers, color):
+    """Styled header cells for a write-only sheet (column widths must be set before rows)"""
     header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="8B0000", end_color="8B0000", fill_type="solid")
+    header_fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
     header_alignment = Alignment(horizontal="center", vertical="center")
     
-    # Headers
-    headers = ["Employee ID", "Name", "Department", "Position", "Period", "Base Salary", "Overtime", "Deductions", "Bonuses", "Net Pay"]
+    cells = []
     for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
+        ws.column_dimensions[get_column_letter(col)].width = 15
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = header_font
         cell.fill = header_fill
         cell.alignment = header_alignment
-        ws.column_dimensions[get_column_letter(col)].width = 15
-    
-    # Add data
-    for row, record in enumerate(payroll_data, 2):
-        ws.cell(row=row, column=1, value=record['employee_id'])
-        ws.cell(row=row, column=2, value=record['name'])
-        ws.cell(row=row, column=3, value=record['department'])
-        ws.cell(row=row, column=4, value=record['position'])
-        ws.cell(row=row, column=5, value=record['period'])
-        ws.cell(row=row, column=6, value=f"₱{record['base_salary']:.2f}")
-        ws.cell(row=row, column=7, value=f"₱{record['overtime']:.2f}")
-        ws.cell(row=row, column=8, value=f"₱{record['deductions']:.2f}")
-        ws.cell(row=row, column=9, value=f"₱{record['bonuses']:.2f}")
-        ws.cell(row=row, column=10, value=f"₱{record['net_pay']:.2f}")
-    
-    # Save to memory
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    period_suffix = f"_{period}" if period else ""
-    filename = f"Payroll_Report{period_suffix}_{timestamp}.xlsx"
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    
-    return response
\ No newline at end of file
+        cells.append(cell)
+    return cells
@@ -1,12 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_file
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, flash, current_app, send_file, jsonify, session
 from auth import login_required, role_required
-from database import get_db_connection
+from database import get_db_connection, get_report_connection, log_security_event
+from password_hashing import hash_password, password_for_update, BCRYPT_ROUNDS
+from accruals import rebuild_accruals
+from business_calendar import absence_counts, leave_days_by_id
+from adjustments import dirty_count
+from jobs import job_queue
+from pay_periods import PAY_FREQUENCIES, pay_frequency
+from payroll_engine import current_period
+from repository import RowStream
+from payroll_summary import summary_view
+import payroll_summary
+import repository
 from qr_utils import generate_employee_qr_code, get_employee_qr_download_path
-from datetime import datetime
+from datetime import datetime, date
 import os
+import uuid
 
 hr_bp = Blueprint('hr', __name__)
 
+# Most-absent employees listed on the attendance report
+ABSENTEES_SHOWN = 25
+
 @hr_bp.route('/add_employee', methods=['GET', 'POST'])
 @login_required
 @role_required('HR')
@@ -41,18 +56,20 @@ def add_employee():
                     file.save(file_path)
                     profile_picture = filename
         
+        # Hash before taking the ID: the ID is allocated in the insert's transaction
+        hashed_password = hash_password(password)
         from database import next_employee_id
         empid = next_employee_id()
         
         conn = get_db_connection()
         try:
             # Insert employee with NFC ID
-            conn.execute('''INSERT INTO employees(employee_id,username,password,name,department,position,salary_rate,role,status,profile_picture,nfc_id)
-                           VALUES(?,?,?,?,?,?,?,?,?,?,?)''',
-                        (empid, username, password, name, department, position, salary_rate, role, 'Active', profile_picture, nfc_id))
+            cur = conn.execute('''INSERT INTO employees(employee_id,username,password,password_cost,name,department,position,salary_rate,role,status,profile_picture,nfc_id)
+                           VALUES(?,?,?,?,?,?,?,?,?,?,?,?)''',
+                        (empid, username, hashed_password, BCRYPT_ROUNDS, name, department, position, salary_rate, role, 'Active', profile_picture, nfc_id))
             
             # Get the employee's database ID for QR code generation
-            employee_db_id = conn.lastrowid
+            employee_db_id = cur.lastrowid
             
             # Generate QR code automatically
             try:
@@ -80,8 +97,8 @@ def dashboard():
     conn = get_db_connection()
     
     # Get statistics
-    pending_leaves = conn.execute('SELECT COUNT(*) FROM leaves WHERE status = "Pending"').fetchone()[0]
-    total_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = "Active"').fetchone()[0]
+    pending_leaves = conn.execute("SELECT COUNT(*) FROM leaves WHERE status = 'Pending'").fetchone()[0]
+    total_employees = conn.execute("SELECT COUNT(*) FROM employees WHERE status = 'Active'").fetchone()[0]
     
     conn.close()
     
@@ -104,6 +121,9 @@ def manage_leaves():
             conn.commit()
             flash(f'Leave request {action.lower()} successfully', 'success')
     
+    # Both lists come from one snapshot; after a decision, read the live data
+    conn = get_report_connection(use_replica=request.method == 'GET')
+    
     # Get pending leave requests
     pending_leaves = conn.execute('''
         SELECT l.id, e.employee_id, e.name, l.type, l.duration, l.start_date, l.end_date, l.reason, l.status
@@ -121,55 +141,129 @@ def manage_leaves():
     
     conn.close()
     
-    return render_template('hr/leaves.html', pending_leaves=pending_leaves, all_leaves=all_leaves)
+    # Working days each request takes, from the shared calendar (pending requests are in the history too)
+    leave_days = leave_days_by_id(all_leaves)
+    
+    return render_template('hr/leaves.html', pending_leaves=pending_leaves, all_leaves=all_leaves,
+                           leave_days=leave_days)
 
 @hr_bp.route('/attendance_report')
 @login_required
 @role_required('HR')
 def attendance_report():
-    conn = get_db_connection()
+    conn = get_report_connection()
     
     # Get attendance records
-    attendance_records = conn.execute('''
-        SELECT e.employee_id, e.name, a.date, a.time_in, a.time_out
-        FROM attendance a JOIN employees e ON e.id = a.employee_ref
-        ORDER BY a.date DESC, e.employee_id
-        LIMIT 100
-    ''').fetchall()
+    attendance_records = repository.recent_attendance(conn, limit=100)
+    
+    # Absences in the current default pay period so far, counted on the shared business calendar
+    period = current_period()
+    through = min(period.end, date.today())
+    absentees = [row for row in absence_counts(conn, period.start, through) if row.absent > 0]
     
     conn.close()
     
-    return render_template('hr/attendance_report.html', attendance_records=attendance_records)
+    return render_template('hr/attendance_report.html', attendance_records=attendance_records,
+                           absence_period=period, absence_through=through, absentee_count=len(absentees),
+                           absentees=absentees[:ABSENTEES_SHOWN], today=date.today().isoformat(),
+                           job_key=uuid.uuid4().hex)
+
+def _punch_time(value):
+    """HH:MM or HH:MM:SS from the form as HH:MM:SS, None when blank; raises ValueError"""
+    value = value.strip()
+    if not value:
+        return None
+    return datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M').strftime('%H:%M:%S')
+
+@hr_bp.route('/attendance/correct', methods=['POST'])
+@login_required
+@role_required('HR')
+def correct_attendance():
+    """Set or clear one employee's punches for a day; paid periods are reconciled in the background"""
+    try:
+        day = date.fromisoformat(request.form.get('date', '')).isoformat()
+        time_in, time_out = _punch_time(request.form.get('time_in', '')), _punch_time(request.form.get('time_out', ''))
+    except ValueError:
+        flash('Enter a valid date and times (HH:MM)', 'danger')
+        return redirect(url_for('hr.attendance_report'))
+    if time_out and not time_in:
+        flash('A time-out needs a time-in', 'danger')
+        return redirect(url_for('hr.attendance_report'))
+
+    conn = get_db_connection()
+    employee = conn.execute('SELECT id, name FROM employees WHERE employee_id = ?',
+                            (request.form.get('employee_id', '').strip(),)).fetchone()
+    if employee is None:
+        flash('Employee not found', 'danger')
+        return redirect(url_for('hr.attendance_report'))
+    try:
+        if time_in is None:
+            conn.execute('DELETE FROM attendance WHERE employee_ref = ? AND date = ?', (employee['id'], day))
+        elif not conn.execute('UPDATE attendance SET time_in = ?, time_out = ? WHERE employee_ref = ? AND date = ?',
+                              (time_in, time_out, employee['id'], day)).rowcount:
+            conn.execute('INSERT INTO attendance(employee_ref, date, time_in, time_out) VALUES (?, ?, ?, ?)',
+                         (employee['id'], day, time_in, time_out))
+        rebuild_accruals(conn, employee['id'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    log_security_event('ATTENDANCE_CORRECTION', session['user_id'], request.remote_addr,
+                       f"Set attendance of {employee['name']} on {day} to {time_in or '-'} / {time_out or '-'}")
+
+    # The triggers marked any already-paid period this day falls in; its delta goes into a later payroll
+    if dirty_count(conn):
+        job_id = job_queue.enqueue('reconcile_payroll', key=request.form.get('job_key'), user_id=session.get('user_id'))
+        flash(f"Attendance corrected for {employee['name']}; differences in already-paid periods "
+              "are being carried into the next payroll", 'info')
+        return redirect(url_for('jobs.view', job_id=job_id))
+    flash(f"Attendance corrected for {employee['name']}", 'success')
+    return redirect(url_for('hr.attendance_report'))
 
 @hr_bp.route('/payroll_report')
 @login_required
 @role_required('HR')
 def payroll_report():
-    conn = get_db_connection()
+    conn = get_report_connection()
     
-    # Get payroll records
-    payroll_records = conn.execute('''
-        SELECT e.employee_id, e.name, p.period, p.base_salary, p.overtime, p.deductions, p.bonuses, p.net_pay
-        FROM payroll p JOIN employees e ON e.id = p.employee_ref
-        ORDER BY p.id DESC
-    ''').fetchall()
+    # Period and department totals come from the summary tables; rows are listed one period and page at a time
+    summary = summary_view(conn, page=request.args.get('page', 1, type=int), period=request.args.get('period'),
+                           row_page=request.args.get('rows', 1, type=int))
     
     conn.close()
     
-    return render_template('hr/payroll_report.html', payroll_records=payroll_records)
+    return render_template('hr/payroll_report.html', **summary)
+
+@hr_bp.route('/api/payroll_summary')
+@login_required
+@role_required('HR')
+def api_payroll_summary():
+    """Period totals, a page at a time (?page=), or one period's totals and departments (?period=)"""
+    conn = get_report_connection()
+    period = request.args.get('period')
+    if period:
+        selected = payroll_summary.period_summary(conn, period)
+        if selected is None:
+            conn.close()
+            return jsonify({'error': f'No payroll for period {period}'}), 404
+        departments = payroll_summary.department_summaries(conn, period)
+        conn.close()
+        return jsonify({'period': payroll_summary.as_dict(selected),
+                        'departments': [payroll_summary.as_dict(row) for row in departments]})
+    summaries, page, page_count = payroll_summary.period_summaries(conn, request.args.get('page', 1, type=int))
+    conn.close()
+    return jsonify({'page': page, 'page_count': page_count,
+                    'periods': [payroll_summary.as_dict(row) for row in summaries]})
 
 @hr_bp.route('/employees')
 @login_required
 @role_required('HR')
 def list_employees():
     conn = get_db_connection()
-    employees = conn.execute('''
-        SELECT id, employee_id, name, department, position, role, status, profile_picture, nfc_id, qr_code_path
-        FROM employees ORDER BY id
-    ''').fetchall()
-    conn.close()
+    employees = RowStream(repository.iter_employees(conn))
     
-    return render_template('hr/list_employees.html', employees=employees)
+    # Rows are rendered as they are read instead of being loaded up front
+    return stream_template('hr/list_employees.html', employees=employees)
 
 @hr_bp.route('/download_qr/<int:employee_id>')
 @login_required
@@ -177,8 +271,7 @@ def list_employees():
 def download_qr(employee_id):
     """Download QR code for an employee"""
     conn = get_db_connection()
-    employee = conn.execute('SELECT employee_id, name, qr_code_path FROM employees WHERE id = ?', 
-                           (employee_id,)).fetchone()
+    employee = repository.get_employee_qr(conn, employee_id)
     conn.close()
     
     if not employee or not employee['qr_code_path']:
@@ -203,7 +296,7 @@ def edit_employee(employee_id):
     
     if request.method == 'POST':
         username = request.form['username']
-        password = request.form['password']
+        password = request.form.get('password', '')
         name = request.form['name']
         department = request.form['department']
         position = request.form['position']
@@ -212,13 +305,16 @@ def edit_employee(employee_id):
         except ValueError:
             salary_rate = 0.0
         status = request.form['status']
+        # Blank means the company default (payroll_period setting)
+        frequency = pay_frequency(request.form.get('pay_frequency'), None)
         
         # HR can only edit Employee roles, not Admin/HR roles
         role = 'Employee'
         
         # Handle file upload
-        current_employee = conn.execute('SELECT profile_picture FROM employees WHERE id = ?', (employee_id,)).fetchone()
+        current_employee = conn.execute('SELECT password, profile_picture, pay_frequency FROM employees WHERE id = ?', (employee_id,)).fetchone()
         profile_picture = current_employee['profile_picture'] if current_employee else ''
+        password, password_cost = password_for_update(password, current_employee['password'] if current_employee else None)
         
         if 'profile_picture' in request.files:
             file = request.files['profile_picture']
@@ -241,9 +337,12 @@ def edit_employee(employee_id):
                     profile_picture = filename
         
         try:
-            conn.execute('''UPDATE employees SET username=?, password=?, name=?, department=?, position=?, 
-                           salary_rate=?, role=?, status=?, profile_picture=? WHERE id=? AND role != 'Admin' ''',
-                        (username, password, name, department, position, salary_rate, role, status, profile_picture, employee_id))
+            conn.execute('''UPDATE employees SET username=?, password=?, password_cost=?, name=?, department=?, position=?, 
+                           salary_rate=?, pay_frequency=?, role=?, status=?, profile_picture=? WHERE id=? AND role != 'Admin' ''',
+                        (username, password, password_cost, name, department, position, salary_rate, frequency, role, status, profile_picture, employee_id))
+            # Attendance already accrued moves to the periods of the new frequency
+            if current_employee and current_employee['pay_frequency'] != frequency:
+                rebuild_accruals(conn, employee_id)
             conn.commit()
             flash('Employee updated successfully', 'success')
             return redirect(url_for('hr.list_employees'))
@@ -253,11 +352,11 @@ def edit_employee(employee_id):
             conn.close()
     
     # GET request - fetch employee data (HR can only edit non-Admin employees)
-    employee = conn.execute('SELECT * FROM employees WHERE id = ? AND role != "Admin"', (employee_id,)).fetchone()
+    employee = conn.execute("SELECT * FROM employees WHERE id = ? AND role != 'Admin'", (employee_id,)).fetchone()
     conn.close()
     
     if not employee:
         flash('Employee not found or access denied', 'danger')
         return redirect(url_for('hr.list_employees'))
     
-    return render_template('hr/edit_employee.html', employee=employee)
+    return render_template('hr/edit_employee.html', employee=employee, pay_frequencies=PAY_FREQUENCIES)
@@ -0,0 +1,80 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort
+from auth import login_required, role_required
+from jobs import job_queue, FINISHED, SUCCEEDED
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# Human-readable job kinds for the job pages
+JOB_TITLES = {
+    'payroll': 'Payroll Generation',
+    'export_employees': 'Employee Directory Export',
+    'export_payroll': 'Payroll Report Export',
+    'reconcile_payroll': 'Retroactive Payroll Reconciliation',
+    'rebuild_accruals': 'Payroll Accrual Rebuild',
+}
+
+def _own_job(job_id):
+    """The job if it exists and belongs to the current user (Admins see every job)"""
+    job = job_queue.get(job_id)
+    if job is None or (session.get('role') != 'Admin' and job['created_by'] != session.get('user_id')):
+        abort(404)
+    return job
+
+def _status(job):
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'title': JOB_TITLES.get(job['kind'], job['kind']),
+        'status': job['status'],
+        'finished': job['status'] in FINISHED,
+        'progress': round(job['progress'] or 0.0, 4),
+        'message': job['message'],
+        'error': job['error'],
+        'result': job['result'],
+        'elapsed_seconds': job['elapsed_seconds'],
+        'eta_seconds': job['eta_seconds'],
+        'download_url': url_for('jobs.download', job_id=job['id']) if job_queue.result_path(job) else None,
+    }
+
+@jobs_bp.route('/')
+@login_required
+@role_required(['Admin', 'HR'])
+def list_jobs():
+    user_id = None if session.get('role') == 'Admin' else session.get('user_id')
+    jobs = [_status(job) for job in job_queue.recent(user_id)]
+    return render_template('jobs/list.html', jobs=jobs)
+
+@jobs_bp.route('/<job_id>')
+@login_required
+@role_required(['Admin', 'HR'])
+def view(job_id):
+    return render_template('jobs/view.html', job=_status(_own_job(job_id)))
+
+@jobs_bp.route('/<job_id>/status')
+@login_required
+@role_required(['Admin', 'HR'])
+def status(job_id):
+    """Polled by the job page: status, progress (0..1), ETA and download link"""
+    return jsonify(_status(_own_job(job_id)))
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+@login_required
+@role_required(['Admin', 'HR'])
+def cancel(job_id):
+    _own_job(job_id)
+    cancelled = job_queue.cancel(job_id)
+    if request.is_json:
+        return jsonify({'success': cancelled})
+    flash('Cancellation requested' if cancelled else 'The job has already finished', 'info' if cancelled else 'warning')
+    return redirect(url_for('jobs.view', job_id=job_id))
+
+@jobs_bp.route('/<job_id>/download')
+@login_required
+@role_required(['Admin', 'HR'])
+def download(job_id):
+    job = _own_job(job_id)
+    path = job_queue.result_path(job)
+    if job['status'] != SUCCEEDED or path is None:
+        flash('This job has no result to download (it may have expired)', 'warning')
+        return redirect(url_for('jobs.view', job_id=job_id))
+    return send_file(path, as_attachment=True, download_name=job['result_name'])
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from database import get_db_connection
 from datetime import datetime, date
 from qr_utils import verify_qr_scan_data
+from accruals import record_time_out
 
 kiosk_bp = Blueprint('kiosk', __name__)
 
@@ -29,7 +30,7 @@ def punch():
         # Search by employee_id or nfc_id
         employee = conn.execute('''SELECT * FROM employees 
                                   WHERE (employee_id = ? OR nfc_id = ?) 
-                                  AND status = "Active"''',
+                                  AND status = 'Active' ''',
                                (employee_id, employee_id)).fetchone()
         
         if not employee:
@@ -58,6 +59,7 @@ def punch():
                 # Time-out
                 conn.execute('UPDATE attendance SET time_out = ? WHERE id = ?', 
                            (now_time, attendance_record['id']))
+                record_time_out(conn, employee, attendance_record['id'])
                 conn.commit()
                 message = f"✅ TIME-OUT recorded at {now_time}"
                 message_type = "success"
@@ -95,7 +97,7 @@ def scan_process():
         # Search by employee_id or nfc_id
         employee = conn.execute('''SELECT * FROM employees 
                                   WHERE (employee_id = ? OR nfc_id = ?) 
-                                  AND status = "Active"''',
+                                  AND status = 'Active' ''',
                                (employee_id, scanned_data)).fetchone()
         
         if not employee:
@@ -125,6 +127,7 @@ def scan_process():
                 # Time-out
                 conn.execute('UPDATE attendance SET time_out = ? WHERE id = ?', 
                            (now_time, attendance_record['id']))
+                record_time_out(conn, employee, attendance_record['id'])
                 conn.commit()
                 action = "TIME-OUT"
             else:
@@ -3,11 +3,15 @@ Security management routes
 Admin-only security dashboard and configuration
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, Response
 from auth import login_required, role_required
-from database import get_db_connection, log_security_event
+from database import get_db_connection, log_security_event, backend
 from backup_system import backup_manager
+from sql_profiler import profile_registry
+from request_metrics import request_metrics
 from datetime import datetime, timedelta
+import hmac
+import os
 
 security_bp = Blueprint('security', __name__)
 
@@ -30,12 +34,13 @@ def dashboard():
     security_logs = c.fetchall()
     
     # Get security statistics
-    c.execute("""
+    since_24h = backend.now_minus('24 hours')
+    c.execute(f"""
         SELECT 
-            COUNT(CASE WHEN event_type = 'LOGIN_SUCCESS' AND timestamp > datetime('now', '-24 hours') THEN 1 END) as logins_24h,
-            COUNT(CASE WHEN event_type = 'LOGIN_FAILED' AND timestamp > datetime('now', '-24 hours') THEN 1 END) as failed_logins_24h,
-            COUNT(CASE WHEN event_type = 'SESSION_TIMEOUT' AND timestamp > datetime('now', '-24 hours') THEN 1 END) as timeouts_24h,
-            COUNT(CASE WHEN timestamp > datetime('now', '-7 days') THEN 1 END) as total_events_7d
+            COUNT(CASE WHEN event_type = 'LOGIN_SUCCESS' AND timestamp > {since_24h} THEN 1 END) as logins_24h,
+            COUNT(CASE WHEN event_type = 'LOGIN_FAILED' AND timestamp > {since_24h} THEN 1 END) as failed_logins_24h,
+            COUNT(CASE WHEN event_type = 'SESSION_TIMEOUT' AND timestamp > {since_24h} THEN 1 END) as timeouts_24h,
+            COUNT(CASE WHEN timestamp > {backend.now_minus('7 days')} THEN 1 END) as total_events_7d
         FROM security_logs
     """)
     stats = c.fetchone()
@@ -165,23 +170,23 @@ def api_security_stats():
         c = conn.cursor()
         
         # Get hourly login statistics for the last 24 hours
-        c.execute("""
+        c.execute(f"""
             SELECT 
-                strftime('%H', timestamp) as hour,
+                {backend.hour_of('timestamp')} as hour,
                 COUNT(CASE WHEN event_type = 'LOGIN_SUCCESS' THEN 1 END) as successful_logins,
                 COUNT(CASE WHEN event_type = 'LOGIN_FAILED' THEN 1 END) as failed_logins
             FROM security_logs
-            WHERE timestamp > datetime('now', '-24 hours')
-            GROUP BY strftime('%H', timestamp)
+            WHERE timestamp > {backend.now_minus('24 hours')}
+            GROUP BY {backend.hour_of('timestamp')}
             ORDER BY hour
         """)
         hourly_stats = c.fetchall()
         
         # Get event type distribution
-        c.execute("""
+        c.execute(f"""
             SELECT event_type, COUNT(*) as count
             FROM security_logs
-            WHERE timestamp > datetime('now', '-7 days')
+            WHERE timestamp > {backend.now_minus('7 days')}
             GROUP BY event_type
             ORDER BY count DESC
         """)
@@ -197,6 +202,34 @@ def api_security_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@security_bp.route('/security/api/sql_profile')
+@login_required
+@role_required('Admin')
+def api_sql_profile():
+    """Per-endpoint SQL statistics and likely N+1 statements for this worker"""
+    return jsonify(profile_registry.snapshot())
+
+@security_bp.route('/security/api/sql_profile/reset', methods=['POST'])
+@login_required
+@role_required('Admin')
+def reset_sql_profile():
+    """Start collecting SQL statistics from scratch"""
+    profile_registry.reset()
+    log_security_event('SQL_PROFILE_RESET', session['user_id'], request.remote_addr,
+                       f"SQL profile reset by {session['name']}")
+    return jsonify({'success': True})
+
+@security_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint; needs METRICS_TOKEN as a bearer token, or an Admin session"""
+    token = os.environ.get('METRICS_TOKEN')
+    authorized = session.get('role') == 'Admin'
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        authorized = True
+    if not authorized:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(request_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @security_bp.route('/security/system/status')
 @login_required
 @role_required('Admin')
@@ -204,7 +237,6 @@ def system_status():
     """System health and security status"""
     try:
         import psutil
-        import os
         
         # Get system information
         system_info = {
@@ -214,22 +246,23 @@ def system_status():
             'uptime': datetime.now() - datetime.fromtimestamp(psutil.boot_time())
         }
         
+        conn = get_db_connection()
+        c = conn.cursor()
+        
         # Database size
-        db_size = os.path.getsize('payroll_system.db') / (1024 * 1024)  # MB
+        db_size = backend.database_size(conn) / (1024 * 1024)  # MB
         
         # Check for security issues
         security_alerts = []
         
         # Check for multiple failed login attempts
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("""
+        c.execute(f"""
             SELECT ip_address, COUNT(*) as failed_attempts
             FROM security_logs
             WHERE event_type = 'LOGIN_FAILED' 
-            AND timestamp > datetime('now', '-1 hour')
+            AND timestamp > {backend.now_minus('1 hour')}
             GROUP BY ip_address
-            HAVING failed_attempts >= 5
+            HAVING COUNT(*) >= 5
         """)
         suspicious_ips = c.fetchall()
         
@@ -258,11 +291,16 @@ def system_status():
         
         conn.close()
         
+        # Request latency across all workers
+        route_latency, metrics_workers = request_metrics.summary()
+        
         return render_template('admin/system_status.html',
                              system_info=system_info,
                              db_size=db_size,
                              security_alerts=security_alerts,
-                             suspicious_ips=suspicious_ips)
+                             suspicious_ips=suspicious_ips,
+                             route_latency=route_latency,
+                             metrics_workers=metrics_workers)
                              
     except ImportError:
         flash('psutil package required for system monitoring', 'warning')
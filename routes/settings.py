@@ -1,8 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from auth import login_required, role_required
 import database
+from settings_cache import VERSION_KEY, settings_cache, bump_settings_version
+from accruals import ACCRUAL_SETTINGS
+from jobs import job_queue
 from datetime import datetime
 import os
+import uuid
 
 settings_bp = Blueprint('settings', __name__)
 
@@ -20,7 +24,8 @@ def settings():
     current_logo = logo_setting['setting_value'] if logo_setting else None
     
     conn.close()
-    return render_template('settings/settings.html', settings=settings_list, current_logo=current_logo)
+    return render_template('settings/settings.html', settings=settings_list, current_logo=current_logo,
+                           job_key=uuid.uuid4().hex)
 
 @settings_bp.route('/settings/update', methods=['POST'])
 @login_required
@@ -51,13 +56,28 @@ def update_settings():
                     c.execute("INSERT INTO settings (setting_name, setting_value, description, updated_by, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)", 
                              ('system_logo', filename, 'System logo image file', session['user_id']))
     
+    accrual_settings = {name: settings_cache.get(name) for name in ACCRUAL_SETTINGS}
+    
     for key, value in request.form.items():
         if key.startswith('setting_'):
             setting_name = key.replace('setting_', '')
             c.execute("UPDATE settings SET setting_value = ?, updated_by = ?, updated_at = CURRENT_TIMESTAMP WHERE setting_name = ?", 
                      (value, session['user_id'], setting_name))
     
+    # Other workers reload their cached settings when they see the new version
+    bump_settings_version(conn)
     conn.commit()
+    settings_cache.invalidate()
+    version = database.get_meta(conn, VERSION_KEY)
     conn.close()
+    
+    # Period boundaries or the overtime threshold changed: re-accrue attendance under the new values.
+    # That reads the whole attendance history, so it runs as a background job (one per settings version)
+    if any(settings_cache.get(name) != value for name, value in accrual_settings.items()):
+        hours_changed = settings_cache.get('office_hours_per_day') != accrual_settings['office_hours_per_day']
+        job_id = job_queue.enqueue('rebuild_accruals', {'refresh_overtime': hours_changed, 'settings_version': version},
+                                   key=request.form.get('job_key'), user_id=session.get('user_id'))
+        flash('Settings updated. Payroll accruals are being recalculated in the background.', 'info')
+        return redirect(url_for('jobs.view', job_id=job_id))
     flash('Settings updated successfully!', 'success')
     return redirect(url_for('settings.settings'))
\ No newline at end of file
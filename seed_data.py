@@ -0,0 +1,208 @@
+"""
+Synthetic data generator
+Fills a database with a seeded, reproducible workforce (employees, years of
+attendance, leaves, payroll, chat and security logs) at production-like
+scale for benchmarking
+"""
+
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from business_calendar import business_calendar
+from database import get_db_connection, reserve_employee_ids, hash_password
+from password_hashing import hash_cost
+from pay_periods import MONTHLY, SEMI_MONTHLY, period_containing
+from payroll_engine import biweekly_anchor, default_pay_frequency, generate_payroll
+from accruals import rebuild_accruals
+
+logger = logging.getLogger(__name__)
+
+# Preset sizes for `flask seed-data --scale`
+SCALES = {
+    '1k': {'employees': 1_000, 'years': 3},
+    '10k': {'employees': 10_000, 'years': 2},
+    '100k': {'employees': 100_000, 'years': 1},
+}
+
+# Every generated account logs in with this password
+SEED_PASSWORD = 'password123'
+
+# Rows per executemany/commit
+BATCH_SIZE = 20_000
+
+DEPARTMENTS = {
+    'Operations Department': ('Procurement', 'Logistics Officer', 'Operations Analyst', 'Driver'),
+    'Finance Department': ('Accountant', 'Budget Officer', 'Cashier', 'Auditor'),
+    'HR': ('HR Officer', 'Recruiter', 'Training Specialist'),
+    'IT': ('Developer', 'System Administrator', 'Help Desk Technician', 'Network Engineer'),
+    'Legal Department': ('Legal Officer', 'Paralegal', 'Records Clerk'),
+    'Field Services': ('Field Inspector', 'Technician', 'Site Supervisor', 'Maintenance Staff'),
+}
+FIRST_NAMES = ('Maria', 'Jose', 'Juan', 'Ana', 'Mark', 'Angelica', 'John', 'Kristine', 'Paolo', 'Marie Joy',
+               'Carlo', 'Jasmine', 'Miguel', 'Patricia', 'Rafael', 'Camille', 'Adrian', 'Nicole', 'Ramon', 'Bea')
+LAST_NAMES = ('Santos', 'Reyes', 'Cruz', 'Bautista', 'Garcia', 'Mendoza', 'Torres', 'De Guzman', 'Villanueva',
+              'Ramos', 'Aquino', 'Castillo', 'Flores', 'Rivera', 'Gonzales', 'Navarro', 'Dizon', 'Lim')
+LEAVE_TYPES = ('Sick', 'Vacation', 'Emergency', 'Unpaid')
+CHAT_LINES = ('Good morning team', 'Please check the latest memo', 'Noted, thank you', 'Meeting moved to 2 PM',
+              'Who has the updated schedule?', 'Report submitted', 'On my way', 'Thanks everyone!')
+
+# HH:MM:SS for every second of the day, indexed by seconds since midnight
+_CLOCK = [f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in range(86400)]
+
+def _timestamps(rng, start, end, count):
+    """count random 'YYYY-MM-DD HH:MM:SS' strings between two dates"""
+    origin = datetime.combine(start, datetime.min.time())
+    offsets = rng.integers(0, int((end - start).days * 86400) + 1, size=count)
+    return [(origin + timedelta(seconds=int(offset))).strftime('%Y-%m-%d %H:%M:%S') for offset in offsets]
+
+def _insert(conn, sql, rows):
+    """executemany in BATCH_SIZE chunks, committing each; returns the row count"""
+    total = 0
+    for offset in range(0, len(rows), BATCH_SIZE):
+        conn.executemany(sql, rows[offset:offset + BATCH_SIZE])
+        conn.commit()
+        total += len(rows[offset:offset + BATCH_SIZE])
+    return total
+
+def seed_employees(conn, count, py_random):
+    """Insert count employees; returns their (id, active) pairs"""
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM employees').fetchone()[0]
+    hashed = hash_password(SEED_PASSWORD)
+    cost = hash_cost(hashed)
+    departments = list(DEPARTMENTS)
+    rows = []
+    for employee_id in reserve_employee_ids(count):
+        department = py_random.choice(departments)
+        pick = py_random.random()
+        frequency = MONTHLY if pick < 0.10 else SEMI_MONTHLY if pick < 0.15 else None
+        rows.append((employee_id, employee_id.lower(), hashed, cost,
+                     f'{py_random.choice(FIRST_NAMES)} {py_random.choice(LAST_NAMES)}', department,
+                     py_random.choice(DEPARTMENTS[department]), round(py_random.uniform(500, 3000), 2),
+                     'HR' if py_random.random() < 0.01 else 'Employee',
+                     'Active' if py_random.random() < 0.97 else 'Inactive', '', frequency))
+    _insert(conn, '''INSERT INTO employees(employee_id, username, password, password_cost, name, department,
+                                           position, salary_rate, role, status, profile_picture, pay_frequency)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    return conn.execute("SELECT id, status = 'Active' FROM employees WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+
+def seed_attendance(conn, employee_refs, start, end, rng, presence=0.93):
+    """One punch pair per present employee per working day; about 1% never timed out"""
+    refs = np.array(employee_refs)
+    sql = 'INSERT INTO attendance(employee_ref, date, time_in, time_out) VALUES (?, ?, ?, ?)'
+    pending, total = [], 0
+    for day in business_calendar().working_dates(start, end):
+        present = refs[rng.random(len(refs)) < presence]
+        time_in = rng.integers(7 * 3600 + 1800, 9 * 3600 + 1800, size=len(present))
+        worked = np.clip(rng.normal(9 * 3600, 3600, size=len(present)), 4 * 3600, 12 * 3600).astype(int)
+        time_out = np.minimum(time_in + worked, 86399)
+        still_in = rng.random(len(present)) < 0.01
+        iso = day.isoformat()
+        pending.extend((ref, iso, _CLOCK[t_in], None if open_ else _CLOCK[t_out])
+                       for ref, t_in, t_out, open_ in zip(present.tolist(), time_in.tolist(),
+                                                          time_out.tolist(), still_in.tolist()))
+        if len(pending) >= BATCH_SIZE:
+            total += _insert(conn, sql, pending)
+            pending = []
+    return total + _insert(conn, sql, pending)
+
+def seed_leaves(conn, employee_refs, start, end, py_random, per_year=3):
+    days = (end - start).days
+    rows = []
+    for ref in employee_refs:
+        for _ in range(max(0, round(py_random.gauss(per_year * days / 365, 1)))):
+            first = start + timedelta(days=py_random.randrange(days + 1))
+            pick = py_random.random()
+            rows.append((ref, py_random.choice(LEAVE_TYPES), 'Half' if py_random.random() < 0.1 else 'Full',
+                         first.isoformat(), (first + timedelta(days=py_random.randrange(5))).isoformat(),
+                         'Synthetic leave request',
+                         'Approved' if pick < 0.7 else 'Pending' if pick < 0.85 else 'Rejected'))
+    return _insert(conn, '''INSERT INTO leaves(employee_ref, type, duration, start_date, end_date, reason, status)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+
+def seed_payroll(conn, start, end):
+    """Accrue the generated attendance and generate every completed period since start"""
+    rebuild_accruals(conn)
+    conn.commit()
+    kinds = {default_pay_frequency()} | {row[0] for row in conn.execute(
+        'SELECT DISTINCT pay_frequency FROM employees WHERE pay_frequency IS NOT NULL')}
+    total = 0
+    for kind in sorted(kinds):
+        period = period_containing(kind, start, biweekly_anchor())
+        while period.end <= end:
+            total += generate_payroll(period, conn=conn)
+            period = period.following(biweekly_anchor())
+    return total
+
+def seed_chat(conn, employee_refs, start, end, rng, py_random, messages_per_employee=5):
+    """Group rooms of 5-30 members, everyone in General Discussion, and messages between members"""
+    general = conn.execute("SELECT id FROM chat_rooms WHERE room_type = 'general' ORDER BY id LIMIT 1").fetchone()
+    room_members = {}
+    if general:
+        room_members[general[0]] = list(employee_refs)
+    for number in range(max(1, len(employee_refs) // 100)):
+        room_id = conn.execute('''INSERT INTO chat_rooms(room_name, room_type, join_code, created_by)
+                                  VALUES (?, 'group', ?, ?) RETURNING id''',
+                               (f'Team {number + 1}', f'{py_random.getrandbits(48):012X}', py_random.choice(employee_refs))).fetchone()[0]
+        room_members[room_id] = py_random.sample(employee_refs, min(len(employee_refs), py_random.randint(5, 30)))
+    conn.commit()
+
+    memberships = [(room_id, ref, read_at) for room_id, refs in room_members.items()
+                   for ref, read_at in zip(refs, _timestamps(rng, start, end, len(refs)))]
+    _insert(conn, '''INSERT INTO room_memberships(room_id, member_id, member_type, last_read_at)
+                     VALUES (?, ?, 'employee', ?)''', memberships)
+
+    rooms = list(room_members)
+    count = len(employee_refs) * messages_per_employee
+    messages = []
+    for sent_at in sorted(_timestamps(rng, start, end, count)):
+        room_id = py_random.choice(rooms)
+        messages.append((room_id, py_random.choice(room_members[room_id]), py_random.choice(CHAT_LINES), sent_at))
+    return _insert(conn, '''INSERT INTO chat_messages(room_id, sender_id, sender_type, message, sent_at)
+                            VALUES (?, ?, 'employee', ?, ?)''', messages)
+
+def seed_security_logs(conn, employee_refs, start, end, rng, py_random, per_employee_year=50):
+    count = int(len(employee_refs) * per_employee_year * (end - start).days / 365)
+    rows = []
+    for sent_at in sorted(_timestamps(rng, start, end, count)):
+        failed = py_random.random() < 0.05
+        ref = py_random.choice(employee_refs)
+        rows.append(('LOGIN_FAILED' if failed else 'LOGIN_SUCCESS', ref,
+                     f'10.{py_random.randrange(256)}.{py_random.randrange(256)}.{py_random.randrange(1, 255)}',
+                     'Mozilla/5.0 (synthetic)',
+                     'Invalid password' if failed else 'User logged in', sent_at))
+    return _insert(conn, '''INSERT INTO security_logs(event_type, user_id, ip_address, user_agent,
+                                                      event_description, timestamp)
+                            VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+def seed(employees=1_000, years=1, seed=42, end=None, echo=logger.info):
+    """Generate a synthetic workforce into the configured database; returns row counts per table.
+
+    The same arguments always produce the same data (apart from ids in an
+    already-populated database). Attendance covers `years` up to end
+    (default yesterday); payroll covers every completed period in that range.
+    """
+    conn = get_db_connection()
+    rng = np.random.default_rng(seed)
+    py_random = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    start = end - timedelta(days=round(365 * years) - 1)
+    counts = {}
+
+    def step(table, fn, *args):
+        started = time.perf_counter()
+        counts[table] = fn(*args)
+        echo(f'{table}: {counts[table]:,} rows in {time.perf_counter() - started:.1f} s')
+
+    staff = seed_employees(conn, employees, py_random)
+    counts['employees'] = len(staff)
+    echo(f'employees: {len(staff):,} rows')
+    active = [ref for ref, is_active in staff if is_active]
+    everyone = [ref for ref, _ in staff]
+    step('attendance', seed_attendance, conn, active, start, end, rng)
+    step('leaves', seed_leaves, conn, everyone, start, end, py_random)
+    step('payroll', seed_payroll, conn, start, end)
+    step('chat_messages', seed_chat, conn, active, start, end, rng, py_random)
+    step('security_logs', seed_security_logs, conn, everyone, start, end, rng, py_random)
+    return counts
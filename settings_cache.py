@@ -0,0 +1,98 @@
+"""
+Settings cache
+Loads the settings table once per process and serves typed values, reloading
+only when another worker has bumped the shared settings version
+"""
+
+import logging
+import os
+import threading
+import time
+from database import get_db_connection, get_meta
+
+logger = logging.getLogger(__name__)
+
+# Known settings: name -> (type, default used when the row is missing or invalid)
+SETTING_TYPES = {
+    'office_hours_per_day': (float, 8.0),
+    'overtime_multiplier': (float, 1.5),
+    'tax_rate': (float, 0.12),
+    'insurance_deduction': (float, 500.0),
+    'tax_brackets': (str, 'flat'),
+    'retirement_rate': (float, 0.05),
+    'attendance_bonus_days': (int, 20),
+    'attendance_bonus_pay_days': (float, 2.0),
+    'company_name': (str, 'Federal Agency'),
+    'payroll_period': (str, 'monthly'),
+    'payroll_biweekly_anchor': (str, '2024-01-01'),
+    'work_week': (str, 'Mon Tue Wed Thu Fri'),
+    'holidays': (str, ''),
+    'system_logo': (str, None),
+}
+
+VERSION_KEY = 'settings_version'
+
+# How often (seconds) a worker asks the database whether settings changed elsewhere
+VERSION_CHECK_INTERVAL = float(os.environ.get('SETTINGS_VERSION_CHECK_INTERVAL', 2.0))
+
+class SettingsCache:
+    """Process-wide settings snapshot with version-based invalidation"""
+
+    def __init__(self, check_interval=VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._values = None
+        self._version = None
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def get(self, name, default=None):
+        """Typed value of a setting; unknown names come back as raw strings"""
+        raw = self._snapshot().get(name)
+        kind, fallback = SETTING_TYPES.get(name, (str, default))
+        if default is not None:
+            fallback = default
+        if raw is None or raw == '':
+            return fallback
+        try:
+            return kind(raw)
+        except (TypeError, ValueError):
+            logger.warning("Setting %s has invalid value %r, using %r", name, raw, fallback)
+            return fallback
+
+    def all(self):
+        return dict(self._snapshot())
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next read reloads it"""
+        with self._lock:
+            self._values = None
+
+    def _snapshot(self):
+        values = self._values
+        if values is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return values
+        with self._lock:
+            conn = get_db_connection()
+            # Don't end a transaction the caller has open on this thread's connection
+            owns_transaction = not conn.in_transaction
+            try:
+                version = get_meta(conn, VERSION_KEY, '0')
+                if self._values is None or version != self._version:
+                    rows = conn.execute("SELECT setting_name, setting_value FROM settings").fetchall()
+                    self._values = {row['setting_name']: row['setting_value'] for row in rows}
+                    self._version = version
+                    self.loads += 1
+                self._checked_at = time.monotonic()
+            finally:
+                if owns_transaction:
+                    conn.close()
+            return self._values
+
+def bump_settings_version(conn):
+    """Mark settings as changed for every worker; call inside the transaction that updates them"""
+    conn.execute('''INSERT INTO system_meta (key, value) VALUES (?, '1')
+                    ON CONFLICT (key) DO UPDATE SET value = CAST(CAST(system_meta.value AS INTEGER) + 1 AS TEXT)''',
+                 (VERSION_KEY,))
+
+settings_cache = SettingsCache()
@@ -0,0 +1,188 @@
+"""
+Payroll simulator
+What-if runs of the pay rules over past periods' attendance: each scenario
+overrides some payroll settings and is evaluated in a process pool, giving
+per-department, per-period and total deltas against the current rules
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from business_calendar import business_calendar
+from payroll_engine import PayRules, apply_rules, biweekly_anchor, current_period, default_pay_frequency, historical_totals, resolve_period
+from settings_cache import SETTING_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Settings a scenario may override (everything PayRules.from_settings reads)
+SCENARIO_SETTINGS = ('tax_rate', 'tax_brackets', 'overtime_multiplier', 'insurance_deduction', 'retirement_rate',
+                     'attendance_bonus_days', 'attendance_bonus_pay_days', 'office_hours_per_day')
+
+# Worker processes for scenario runs; 0 evaluates them in the request's process
+WORKERS = int(os.environ.get('SIMULATION_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Workers start from a clean process: a fork of a request thread would copy locks held
+# by the app's audit, job and metrics threads, and a child could hang on one
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+MAX_SCENARIOS = 20
+MAX_PERIODS = 60
+
+# Completed periods of the default frequency simulated when the request names none
+DEFAULT_PERIODS = 12
+
+# Summed per department and period; cost is what the agency pays out (base + overtime + bonuses)
+AMOUNTS = ('base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay', 'cost')
+
+def parse_scenarios(items):
+    """[(name, overrides)] from [{"name": ..., "settings": {"tax_rate": 0.15, ...}}, ...].
+
+    Raises ValueError for a missing list, unknown settings or values of the wrong type.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('Give at least one scenario')
+    if len(items) > MAX_SCENARIOS:
+        raise ValueError(f'At most {MAX_SCENARIOS} scenarios can be simulated at once')
+    scenarios = []
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or not isinstance(item.get('settings', {}), dict):
+            raise ValueError(f'Scenario {number} must be an object with a settings object')
+        name = str(item.get('name') or f'Scenario {number}')
+        overrides = {}
+        for setting, value in item.get('settings', {}).items():
+            if setting not in SCENARIO_SETTINGS:
+                raise ValueError(f'{name}: {setting} is not a payroll rule setting')
+            try:
+                overrides[setting] = SETTING_TYPES[setting][0](value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{name}: invalid value {value!r} for {setting}') from None
+        if overrides.get('office_hours_per_day', 1) <= 0:
+            raise ValueError(f'{name}: office_hours_per_day must be positive')
+        scenarios.append((name, overrides))
+    return scenarios
+
+def simulation_periods(keys=None):
+    """PayPeriods for the requested keys, or the last DEFAULT_PERIODS completed default periods"""
+    if not keys:
+        periods = [current_period().preceding(biweekly_anchor())]
+        while len(periods) < DEFAULT_PERIODS:
+            periods.append(periods[-1].preceding(biweekly_anchor()))
+        return periods[::-1]
+    if not isinstance(keys, list):
+        raise ValueError('periods must be a list of pay period keys')
+    periods = list(dict.fromkeys(resolve_period(str(key)) for key in keys))
+    if len(periods) > MAX_PERIODS:
+        raise ValueError(f'At most {MAX_PERIODS} periods can be simulated at once')
+    return periods
+
+def load_history(conn, periods):
+    """Arrays describing who was paid in each period and every attendance day's hours.
+
+    Days worked don't depend on the rules, but the overtime split does
+    (office_hours_per_day), so hours stay per day and each scenario totals them.
+    """
+    default_frequency = default_pay_frequency()
+    departments = {}
+    employee_departments = {ref: department or 'Unassigned'
+                            for ref, department in conn.execute('SELECT id, department FROM employees')}
+    salary_rate, days_worked, department_index, period_index = [], [], [], []
+    day_rows, day_hours = [], []
+    for number, period in enumerate(periods):
+        first_row = len(salary_rate)
+        rows = {}
+        # Who was paid in the period, not who is active now; the stored overtime follows today's
+        # office_hours_per_day, so scenarios split hours_worked themselves
+        for ref, rate, days, _ in historical_totals(conn, period, default_frequency):
+            rows[ref] = len(salary_rate)
+            salary_rate.append(rate)
+            days_worked.append(days)
+            department = employee_departments.get(ref, 'Unassigned')
+            department_index.append(departments.setdefault(department, len(departments)))
+            period_index.append(number)
+        if len(salary_rate) == first_row:
+            continue
+        for ref, hours in conn.execute('''SELECT employee_ref, hours_worked FROM attendance
+                                          WHERE date BETWEEN ? AND ? AND hours_worked IS NOT NULL''', period.bounds()):
+            row = rows.get(ref)
+            if row is not None:
+                day_rows.append(row)
+                day_hours.append(hours)
+    period_index = np.array(period_index, dtype=np.intp)
+    history = {
+        'salary_rate': np.array(salary_rate, dtype=float),
+        'days_worked': np.array(days_worked, dtype=float),
+        'departments': np.array(department_index, dtype=np.intp),
+        'periods': period_index,
+        'day_rows': np.array(day_rows, dtype=np.intp),
+        'day_hours': np.array(day_hours, dtype=float),
+        'department_count': len(departments),
+        'period_count': len(periods),
+        'expected_days': business_calendar().expected_days(periods)[period_index],
+        'month_share': np.array([period.month_share for period in periods])[period_index],
+    }
+    return history, list(departments)
+
+def evaluate(rules, history):
+    """(by_department, by_period) sums of AMOUNTS under rules; runs in a pool process"""
+    overtime_hours = np.bincount(history['day_rows'],
+                                 weights=np.maximum(0.0, history['day_hours'] - rules.hours_per_day),
+                                 minlength=len(history['salary_rate']))
+    base_salary, overtime, deductions, bonuses, net_pay = apply_rules(
+        history['salary_rate'], history['days_worked'], overtime_hours, rules, history['expected_days'],
+        history['month_share'])
+    amounts = (base_salary, overtime, deductions, bonuses, net_pay, base_salary + overtime + bonuses)
+    by_department = np.array([np.bincount(history['departments'], weights=column,
+                                          minlength=history['department_count']) for column in amounts])
+    by_period = np.array([np.bincount(history['periods'], weights=column,
+                                      minlength=history['period_count']) for column in amounts])
+    return by_department.reshape(len(AMOUNTS), -1), by_period.reshape(len(AMOUNTS), -1)
+
+def _amounts(column):
+    return {name: round(float(value), 2) for name, value in zip(AMOUNTS, column)}
+
+def _summary(by_department, by_period, departments, periods):
+    return {
+        'totals': _amounts(by_department.sum(axis=1)),
+        'departments': {name: _amounts(by_department[:, i]) for i, name in enumerate(departments)},
+        'periods': {period.key: _amounts(by_period[:, i]) for i, period in enumerate(periods)},
+    }
+
+def simulate(conn, periods, scenarios):
+    """Evaluate each (name, overrides) scenario and the current rules over periods.
+
+    Reads attendance only; nothing is written to payroll. Deltas are
+    scenario minus the current rules on the same attendance.
+    """
+    started = time.perf_counter()
+    history, departments = load_history(conn, periods)
+    rule_sets = [PayRules.from_settings()] + [PayRules.from_settings(overrides) for _, overrides in scenarios]
+
+    if WORKERS > 0 and len(history['salary_rate']):
+        with ProcessPoolExecutor(max_workers=min(WORKERS, len(rule_sets)),
+                                 mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+            results = list(pool.map(evaluate, rule_sets, [history] * len(rule_sets)))
+    else:
+        results = [evaluate(rules, history) for rules in rule_sets]
+
+    (base_department, base_period), outcomes = results[0], results[1:]
+    response = {
+        'periods': [{'key': period.key, 'label': period.label,
+                     'employees': int(np.count_nonzero(history['periods'] == i))} for i, period in enumerate(periods)],
+        'baseline': _summary(base_department, base_period, departments, periods),
+        'scenarios': [],
+    }
+    for (name, overrides), (by_department, by_period) in zip(scenarios, outcomes):
+        scenario = _summary(by_department, by_period, departments, periods)
+        scenario['name'] = name
+        scenario['settings'] = overrides
+        scenario['delta'] = _summary(by_department - base_department, by_period - base_period, departments, periods)
+        response['scenarios'].append(scenario)
+
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info("Simulated %d scenarios over %d periods (%d employee-periods) in %.1f ms",
+                len(scenarios), len(periods), len(history['salary_rate']), elapsed)
+    response['elapsed_ms'] = round(elapsed, 1)
+    return response
@@ -0,0 +1,257 @@
+"""
+SQL profiler
+Records every statement a request runs (duration, rows, call counts), flags
+repeated identical statements as likely N+1 patterns, and keeps per-endpoint
+aggregates for the admin SQL profile page
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from flask import g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+# Set SQL_PROFILING=0 to hand out unwrapped connections
+ENABLED = os.environ.get('SQL_PROFILING', '1') != '0'
+
+# The same statement text this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+# Distinct statements remembered per endpoint, to bound memory
+MAX_STATEMENTS_PER_ENDPOINT = 200
+
+_WHITESPACE = re.compile(r'\s+')
+
+class StatementStats:
+    """Counters for one statement text"""
+
+    __slots__ = ('calls', 'total_ms', 'max_ms', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def add(self, elapsed_ms, rows=0):
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+        }
+
+class RequestProfile:
+    """Statements run while handling one request"""
+
+    def __init__(self):
+        self.statements = {}
+
+    def stats_for(self, sql):
+        key = _WHITESPACE.sub(' ', sql).strip()
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats()
+        return stats
+
+    @property
+    def query_count(self):
+        return sum(s.calls for s in self.statements.values())
+
+    @property
+    def total_ms(self):
+        return sum(s.total_ms for s in self.statements.values())
+
+    def repeated(self):
+        return {sql: s.calls for sql, s in self.statements.items() if s.calls >= N_PLUS_ONE_THRESHOLD}
+
+class ProfiledCursor:
+    """Cursor proxy timing execute and fetch calls"""
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+        self._stats = None
+
+    def execute(self, sql, params=()):
+        self._stats = self._profile.stats_for(sql)
+        self._stats.calls += 1
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._stats.add((time.perf_counter() - started) * 1000)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._stats = self._profile.stats_for(sql)
+        self._stats.calls += 1
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._stats.add((time.perf_counter() - started) * 1000)
+        return self
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        if self._stats is not None:
+            rows = len(result) if isinstance(result, list) else int(result is not None)
+            self._stats.add((time.perf_counter() - started) * 1000, rows)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        for row in self._cursor:
+            if self._stats is not None:
+                self._stats.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledConnection:
+    """Connection proxy that records statements into the current request's profile"""
+
+    def __init__(self, conn, profile):
+        self._conn = conn
+        self._profile = profile
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def cursor(self):
+        return ProfiledCursor(self._conn.cursor(), self._profile)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def unwrap(conn):
+    """The driver connection behind a profiled one (for APIs such as sqlite3 backup)"""
+    return conn.raw if isinstance(conn, ProfiledConnection) else conn
+
+def wrap(conn):
+    """Profile conn for the current request; outside requests it is returned as is"""
+    if not ENABLED or not has_request_context():
+        return conn
+    profile = g.get('_sql_profile')
+    if profile is None:
+        profile = g._sql_profile = RequestProfile()
+    return ProfiledConnection(conn, profile)
+
+class ProfileRegistry:
+    """Per-endpoint SQL aggregates for this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.endpoints = {}
+
+    def record(self, endpoint, profile):
+        repeated = profile.repeated()
+        with self._lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'total_ms': 0.0, 'max_queries': 0,
+                    'statements': {}, 'n_plus_one': {},
+                }
+            query_count = profile.query_count
+            entry['requests'] += 1
+            entry['queries'] += query_count
+            entry['total_ms'] += profile.total_ms
+            entry['max_queries'] = max(entry['max_queries'], query_count)
+
+            for sql, stats in profile.statements.items():
+                total = entry['statements'].get(sql)
+                if total is None:
+                    if len(entry['statements']) >= MAX_STATEMENTS_PER_ENDPOINT:
+                        continue
+                    total = entry['statements'][sql] = StatementStats()
+                total.calls += stats.calls
+                total.total_ms += stats.total_ms
+                total.max_ms = max(total.max_ms, stats.max_ms)
+                total.rows += stats.rows
+
+            for sql, calls in repeated.items():
+                flagged = entry['n_plus_one'].setdefault(sql, {'requests': 0, 'max_repeats': 0})
+                flagged['requests'] += 1
+                flagged['max_repeats'] = max(flagged['max_repeats'], calls)
+
+        for sql, calls in repeated.items():
+            logger.info("Possible N+1 in %s: statement ran %d times: %s", endpoint, calls, sql[:200])
+
+    def snapshot(self):
+        """Aggregates as plain data, slowest endpoints first"""
+        with self._lock:
+            endpoints = []
+            for name, entry in self.endpoints.items():
+                statements = sorted(((sql, s.to_dict()) for sql, s in entry['statements'].items()),
+                                    key=lambda item: item[1]['total_ms'], reverse=True)
+                endpoints.append({
+                    'endpoint': name,
+                    'requests': entry['requests'],
+                    'queries': entry['queries'],
+                    'avg_queries': round(entry['queries'] / entry['requests'], 1),
+                    'max_queries': entry['max_queries'],
+                    'total_ms': round(entry['total_ms'], 3),
+                    'avg_ms': round(entry['total_ms'] / entry['requests'], 3),
+                    'statements': [dict(stats, sql=sql) for sql, stats in statements],
+                    'n_plus_one': [dict(flag, sql=sql) for sql, flag in entry['n_plus_one'].items()],
+                })
+        endpoints.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'pid': os.getpid(),
+            'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'n_plus_one_threshold': N_PLUS_ONE_THRESHOLD,
+            'endpoints': endpoints,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.started_at = time.time()
+
+profile_registry = ProfileRegistry()
+
+def record_request(exc=None):
+    """teardown_request hook: fold this request's statements into the aggregates"""
+    profile = g.pop('_sql_profile', None)
+    if profile is not None and profile.statements:
+        profile_registry.record(request.endpoint or request.path, profile)
+
+def init_app(app):
+    if ENABLED:
+        app.teardown_request(record_request)
@@ -0,0 +1,73 @@
+"""
+Shared fixtures: the session gets a fresh SQLite database (never the
+DATABASE_URL server) and every test starts with no attendance, leave,
+payroll or employees besides the bootstrap admin
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.pop('DATABASE_URL', None)
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='payroll_tests_'), 'payroll.db')
+
+import database
+from accruals import rebuild_accruals
+from settings_cache import settings_cache
+
+# Children first, so nothing is left pointing at a deleted row
+RESET_TABLES = ('payroll_adjustments', 'payroll_dirty', 'payroll_staging', 'payroll_dry_runs',
+                'payroll_period_summary', 'payroll_department_summary', 'payroll', 'payroll_accruals',
+                'attendance', 'leaves')
+
+@pytest.fixture(scope='session')
+def schema():
+    database.bootstrap_database(force=True)
+    database.dispose_thread_connection()
+
+@pytest.fixture
+def conn(schema):
+    conn = database.get_db_connection()
+    for table in RESET_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute("DELETE FROM employees WHERE role = 'Employee'")
+    conn.commit()
+    settings_cache.invalidate()
+    yield conn
+    conn.rollback()
+
+@pytest.fixture
+def add_employee(conn):
+    """add_employee(salary_rate=600, pay_frequency='monthly') -> employees.id"""
+    count = iter(range(1, 1000))
+    def add(salary_rate=600.0, pay_frequency='monthly', status='Active'):
+        number = next(count)
+        employee_ref = conn.execute('''INSERT INTO employees(employee_id, username, password, name, department,
+                                                             position, salary_rate, role, status, pay_frequency)
+                                       VALUES (?, ?, 'x', ?, 'Operations', 'Clerk', ?, 'Employee', ?, ?)
+                                       RETURNING id''',
+                                    (f'T{number:03d}', f'test{number}', f'Test {number}', salary_rate, status,
+                                     pay_frequency)).fetchone()[0]
+        conn.commit()
+        return employee_ref
+    return add
+
+def weekdays(start, end):
+    """Monday to Friday dates from start to end inclusive"""
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return [day for day in days if day.weekday() < 5]
+
+@pytest.fixture
+def attend(conn):
+    """attend(employee_ref, days, time_in, time_out): punches for each day, with accruals rebuilt"""
+    def punch(employee_ref, days, time_in='08:00:00', time_out='16:00:00'):
+        conn.executemany('INSERT INTO attendance(employee_ref, date, time_in, time_out) VALUES (?, ?, ?, ?)',
+                         [(employee_ref, day.isoformat(), time_in, time_out) for day in days])
+        rebuild_accruals(conn)
+        conn.commit()
+    return punch
+
+AUGUST_2025 = weekdays(date(2025, 8, 1), date(2025, 8, 31))
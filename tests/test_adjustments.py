@@ -0,0 +1,130 @@
+from datetime import date
+import pytest
+from conftest import AUGUST_2025, weekdays
+from adjustments import dirty_count, next_unpaid_period, pending_adjustments, reconcile, reconcile_pair
+from pay_periods import BIWEEKLY, MONTHLY
+from payroll_engine import PayRules, generate_payroll, resolve_period
+
+RULES = PayRules(tax_brackets=((0.0, 0.10),), insurance_deduction=0.0, retirement_rate=0.0, bonus_pay_days=0.0)
+
+def adjustments(conn, employee_ref):
+    return conn.execute('''SELECT source_period, target_period, base_salary, overtime, deductions, bonuses, net_pay
+                           FROM payroll_adjustments WHERE employee_ref = ? ORDER BY id''', (employee_ref,)).fetchall()
+
+@pytest.fixture
+def paid_august(conn, add_employee, attend):
+    """A 500/day employee paid for 10 days of August 2025"""
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:10])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+    return employee
+
+def test_a_correction_is_carried_into_the_next_unpaid_period(conn, attend, paid_august):
+    attend(paid_august, AUGUST_2025[10:12])
+    assert dirty_count(conn) == 1
+
+    assert reconcile(conn) == {'pairs': 1, 'adjustments': 1}
+
+    [(source, target, base_salary, overtime, deductions, bonuses, net_pay)] = adjustments(conn, paid_august)
+    assert (source, target) == ('2025-08', '2025-09')
+    assert (base_salary, overtime, deductions, bonuses, net_pay) == pytest.approx((1000.0, 0.0, 100.0, 0.0, 900.0))
+    assert conn.execute("SELECT net_pay FROM payroll WHERE employee_ref = ? AND period = '2025-08'",
+                        (paid_august,)).fetchone()[0] == pytest.approx(4500.0)
+
+def test_the_target_periods_payroll_includes_the_adjustment(conn, attend, paid_august):
+    attend(paid_august, AUGUST_2025[10:12])
+    reconcile(conn)
+    september = weekdays(date(2025, 9, 1), date(2025, 9, 30))
+    attend(paid_august, september[:5])
+
+    generate_payroll('2025-09', conn=conn, rules=RULES)
+
+    assert conn.execute("SELECT net_pay FROM payroll WHERE employee_ref = ? AND period = '2025-09'",
+                        (paid_august,)).fetchone()[0] == pytest.approx(2250.0 + 900.0)
+    assert pending_adjustments(conn) == []
+
+def test_reconciling_a_pair_twice_pays_the_correction_once(conn, attend, paid_august):
+    attend(paid_august, AUGUST_2025[10:11])
+
+    assert reconcile_pair(conn, paid_august, '2025-08', RULES) is not None
+    assert reconcile_pair(conn, paid_august, '2025-08', RULES) is None
+    assert len(adjustments(conn, paid_august)) == 1
+
+def test_touching_a_paid_period_without_changing_it_records_nothing(conn, attend, paid_august):
+    attend(paid_august, AUGUST_2025[10:11])
+    reconcile(conn)
+    conn.execute('UPDATE attendance SET time_out = time_out WHERE employee_ref = ?', (paid_august,))
+    conn.commit()
+
+    assert reconcile(conn) == {'pairs': 1, 'adjustments': 0}
+    assert reconcile(conn) == {'pairs': 0, 'adjustments': 0}
+    assert len(adjustments(conn, paid_august)) == 1
+
+def test_removed_attendance_is_carried_as_a_negative_adjustment(conn, paid_august):
+    conn.execute('DELETE FROM attendance WHERE employee_ref = ? AND date = ?',
+                 (paid_august, AUGUST_2025[0].isoformat()))
+    conn.commit()
+
+    reconcile(conn)
+
+    [row] = adjustments(conn, paid_august)
+    assert row[2] == pytest.approx(-500.0) and row[6] == pytest.approx(-450.0)
+
+def test_a_raise_since_the_period_closed_is_not_back_pay(conn, attend, paid_august):
+    conn.execute('UPDATE employees SET salary_rate = 900 WHERE id = ?', (paid_august,))
+    conn.commit()
+    attend(paid_august, AUGUST_2025[10:11])
+
+    reconcile(conn)
+
+    [row] = adjustments(conn, paid_august)
+    assert row[2] == pytest.approx(500.0)
+
+def test_a_rule_change_since_the_period_closed_is_not_back_pay(conn, attend, paid_august):
+    attend(paid_august, AUGUST_2025[10:11])
+
+    reconcile_pair(conn, paid_august, '2025-08', PayRules(tax_brackets=((0.0, 0.5),)))
+
+    [row] = adjustments(conn, paid_august)
+    assert row[4] == pytest.approx(50.0)
+
+def test_rows_without_a_pay_basis_use_the_current_rate(conn, attend, paid_august):
+    conn.execute('UPDATE payroll SET pay_basis = NULL WHERE employee_ref = ?', (paid_august,))
+    conn.execute('UPDATE employees SET salary_rate = 600 WHERE id = ?', (paid_august,))
+    conn.commit()
+    attend(paid_august, AUGUST_2025[10:11])
+
+    reconcile_pair(conn, paid_august, '2025-08', RULES)
+
+    [row] = adjustments(conn, paid_august)
+    assert row[2] == pytest.approx(11 * 600.0 - 10 * 500.0)
+
+def test_a_frequency_change_carries_into_a_period_after_the_corrected_one(conn, attend, paid_august):
+    conn.execute("UPDATE employees SET pay_frequency = 'biweekly' WHERE id = ?", (paid_august,))
+    conn.commit()
+    attend(paid_august, [date(2025, 8, 29)])
+
+    reconcile(conn)
+
+    [row] = adjustments(conn, paid_august)
+    target = resolve_period(row[1])
+    assert target.kind == BIWEEKLY
+    assert target.start > date(2025, 8, 31)
+    assert (target.start, target.end) == (date(2025, 9, 8), date(2025, 9, 21))
+
+def test_next_unpaid_period_skips_periods_already_paid(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:1])
+    for key in ('2025-08', '2025-09', '2025-10'):
+        generate_payroll(key, conn=conn, rules=RULES)
+
+    assert next_unpaid_period(conn, employee, MONTHLY, resolve_period('2025-08')).key == '2025-11'
+
+def test_next_unpaid_period_never_overlaps_the_corrected_period(conn, add_employee):
+    employee = add_employee(500.0)
+    august = resolve_period('2025-08')
+
+    target = next_unpaid_period(conn, employee, BIWEEKLY, august)
+
+    assert target.start > august.end
+    assert (target.start - august.end).days <= 14
@@ -0,0 +1,79 @@
+from datetime import date
+import numpy as np
+import pytest
+from conftest import AUGUST_2025
+from business_calendar import BusinessCalendar, absence_counts, as_dates, parse_holidays, parse_work_week
+from pay_periods import MONTHLY, SEMI_MONTHLY, custom_period, period_containing
+
+CHRISTMAS = BusinessCalendar('1111100', parse_holidays('2025-12-25, 2026-01-01'))
+
+@pytest.mark.parametrize('text, mask', [
+    ('Mon Tue Wed Thu Fri', '1111100'),
+    ('mon-sat', '1111110'),
+    ('Fri-Mon', '1000111'),
+    ('Mon, Wed, Fri', '1010100'),
+    ('0111110', '0111110'),
+])
+def test_parse_work_week(text, mask):
+    assert parse_work_week(text) == mask
+
+@pytest.mark.parametrize('text', ['', 'someday', '0000000', 'Mon-Xyz'])
+def test_unreadable_work_weeks_fall_back_to_monday_to_friday(text):
+    assert parse_work_week(text) == '1111100'
+
+def test_parse_holidays_skips_invalid_dates_and_duplicates():
+    holidays = parse_holidays('2026-01-01 2025-12-25, soon, 2025-12-25')
+    assert holidays.tolist() == [date(2025, 12, 25), date(2026, 1, 1)]
+
+def test_working_days_across_a_year_end_skip_weekends_and_holidays():
+    # Dec 22 2025 (Mon) .. Jan 4 2026 (Sun): 10 weekdays, 2 of them holidays
+    assert CHRISTMAS.working_days([date(2025, 12, 22)], [date(2026, 1, 4)]).tolist() == [8]
+
+def test_empty_and_unreadable_ranges_count_zero():
+    counts = CHRISTMAS.working_days(['2025-12-10', 'soon', '2025-12-06'], ['2025-12-01', '2025-12-31', '2025-12-07'])
+    assert counts.tolist() == [0, 0, 0]
+
+def test_is_working_day():
+    days = ['2025-12-24', '2025-12-25', '2025-12-27', '2026-01-02', 'soon']
+    assert CHRISTMAS.is_working_day(days).tolist() == [True, False, False, True, False]
+
+def test_expected_days_per_period():
+    periods = [period_containing(MONTHLY, date(2025, 8, 1)), period_containing(SEMI_MONTHLY, date(2025, 12, 20)),
+               custom_period(date(2025, 12, 24), date(2026, 1, 2))]
+    # Dec 16-31 has 12 weekdays and Christmas; Dec 24 - Jan 2 has 8 and both holidays
+    assert CHRISTMAS.expected_days(periods).tolist() == [len(AUGUST_2025), 11, 6]
+
+def test_working_dates():
+    assert CHRISTMAS.working_dates(date(2025, 12, 24), date(2025, 12, 29)) == [
+        date(2025, 12, 24), date(2025, 12, 26), date(2025, 12, 29)]
+
+def test_leave_days_count_working_days_and_half_days():
+    leaves = [('Full', '2025-12-22', '2025-12-28'), ('Half', '2025-12-29', '2025-12-29'),
+              ('Full', '2025-12-27', '2025-12-28')]
+    assert CHRISTMAS.leave_days(leaves).tolist() == [4.0, 0.5, 0.0]
+    assert CHRISTMAS.leave_days([]).tolist() == []
+
+def test_as_dates_marks_bad_values_nat():
+    dates = as_dates([date(2025, 8, 1), '2025-08-02', '2025-08-03 09:00', 'nope'])
+    assert dates[:3].tolist() == [date(2025, 8, 1), date(2025, 8, 2), date(2025, 8, 3)]
+    assert np.isnat(dates[3])
+
+def test_absence_counts(conn, add_employee, attend):
+    regular, on_leave = add_employee(), add_employee()
+    attend(regular, AUGUST_2025[:15])
+    attend(on_leave, AUGUST_2025[:5])
+    attend(on_leave, [date(2025, 8, 2)])  # a Saturday doesn't count toward attended
+    conn.execute('''INSERT INTO leaves(employee_ref, type, duration, start_date, end_date, status)
+                    VALUES (?, 'Vacation', 'Full', '2025-08-04', '2025-08-15', 'Approved')''', (on_leave,))
+    conn.execute('''INSERT INTO leaves(employee_ref, type, duration, start_date, end_date, status)
+                    VALUES (?, 'Sick', 'Full', '2025-08-18', '2025-08-22', 'Pending')''', (on_leave,))
+    conn.commit()
+
+    rows = {row.employee_ref: row for row in absence_counts(conn, '2025-08-01', '2025-08-31',
+                                                            BusinessCalendar())}
+
+    expected = len(AUGUST_2025)
+    assert (rows[regular].expected, rows[regular].attended, rows[regular].absent) == (expected, 15, expected - 15)
+    # Only the approved leave counts, and the Saturday punch is not a working day
+    assert (rows[on_leave].attended, rows[on_leave].on_leave) == (5, 10.0)
+    assert rows[on_leave].absent == expected - 5 - 10
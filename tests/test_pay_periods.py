@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+import pytest
+import database
+from pay_periods import (BIWEEKLY, CUSTOM, MAX_CUSTOM_DAYS, MONTHLY, SEMI_MONTHLY, PayPeriod, custom_period,
+                         parse_anchor, parse_period, pay_frequency, period_containing)
+
+ANCHOR = date(2024, 1, 1)
+
+def bounds(period):
+    return period.start, period.end
+
+@pytest.mark.parametrize('kind, day, start, end', [
+    (MONTHLY, date(2025, 2, 14), date(2025, 2, 1), date(2025, 2, 28)),
+    (MONTHLY, date(2024, 2, 29), date(2024, 2, 1), date(2024, 2, 29)),
+    (MONTHLY, date(2025, 12, 31), date(2025, 12, 1), date(2025, 12, 31)),
+    (SEMI_MONTHLY, date(2025, 8, 15), date(2025, 8, 1), date(2025, 8, 15)),
+    (SEMI_MONTHLY, date(2025, 8, 16), date(2025, 8, 16), date(2025, 8, 31)),
+    (SEMI_MONTHLY, date(2024, 2, 20), date(2024, 2, 16), date(2024, 2, 29)),
+    (BIWEEKLY, date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 14)),
+    (BIWEEKLY, date(2024, 1, 14), date(2024, 1, 1), date(2024, 1, 14)),
+    (BIWEEKLY, date(2024, 1, 15), date(2024, 1, 15), date(2024, 1, 28)),
+    (BIWEEKLY, date(2023, 12, 31), date(2023, 12, 18), date(2023, 12, 31)),
+    (BIWEEKLY, date(2025, 9, 1), date(2025, 8, 25), date(2025, 9, 7)),
+])
+def test_period_containing(kind, day, start, end):
+    assert bounds(period_containing(kind, day, ANCHOR)) == (start, end)
+
+def test_period_containing_rejects_custom_and_unknown_kinds():
+    for kind in (CUSTOM, 'weekly'):
+        with pytest.raises(ValueError):
+            period_containing(kind, date(2025, 8, 1))
+
+@pytest.mark.parametrize('kind', [MONTHLY, SEMI_MONTHLY, BIWEEKLY])
+def test_following_and_preceding_tile_the_calendar_across_a_year_end(kind):
+    period = period_containing(kind, date(2025, 11, 20), ANCHOR)
+    for _ in range(6):
+        following = period.following(ANCHOR)
+        assert following.kind == kind
+        assert (following.start - period.end).days == 1
+        assert following.preceding(ANCHOR) == period
+        period = following
+    assert period.start.year == 2026
+
+def test_following_across_the_anchor():
+    anchor = date(2025, 3, 5)
+    before = period_containing(BIWEEKLY, date(2025, 3, 4), anchor)
+    assert bounds(before) == (date(2025, 2, 19), date(2025, 3, 4))
+    assert bounds(before.following(anchor)) == (anchor, date(2025, 3, 18))
+
+def test_custom_periods_repeat_their_length():
+    period = custom_period(date(2025, 12, 25), date(2026, 1, 3))
+    assert bounds(period.following()) == (date(2026, 1, 4), date(2026, 1, 13))
+    assert bounds(period.preceding()) == (date(2025, 12, 15), date(2025, 12, 24))
+
+def test_periods_must_not_end_before_they_start():
+    with pytest.raises(ValueError):
+        PayPeriod(MONTHLY, date(2025, 8, 31), date(2025, 8, 1))
+
+def test_custom_periods_have_a_maximum_length():
+    start = date(2025, 1, 1)
+    assert custom_period(start, start + timedelta(days=MAX_CUSTOM_DAYS - 1)).days == MAX_CUSTOM_DAYS
+    with pytest.raises(ValueError):
+        custom_period(start, start + timedelta(days=MAX_CUSTOM_DAYS))
+
+@pytest.mark.parametrize('period, key', [
+    (period_containing(MONTHLY, date(2025, 8, 9)), '2025-08'),
+    (period_containing(SEMI_MONTHLY, date(2025, 8, 9)), '2025-08A'),
+    (period_containing(SEMI_MONTHLY, date(2025, 12, 31)), '2025-12B'),
+    (period_containing(BIWEEKLY, date(2025, 9, 1), ANCHOR), '2025-08-25..2025-09-07'),
+    (custom_period(date(2025, 8, 4), date(2025, 8, 20)), 'custom:2025-08-04..2025-08-20'),
+])
+def test_keys_round_trip(period, key):
+    assert period.key == key
+    assert parse_period(key) == period
+
+def test_an_anchor_aligned_custom_period_stays_custom():
+    aligned = custom_period(date(2025, 8, 25), date(2025, 9, 7))
+    assert aligned.key == 'custom:2025-08-25..2025-09-07'
+    assert parse_period(aligned.key).kind == CUSTOM
+
+def test_biweekly_keys_keep_their_dates_whatever_the_anchor():
+    # 2025-08-26 doesn't line up with the default anchor; the key still means these 14 days
+    period = parse_period('2025-08-26..2025-09-08')
+    assert (period.kind, bounds(period)) == (BIWEEKLY, (date(2025, 8, 26), date(2025, 9, 8)))
+
+def test_bare_ranges_that_are_not_14_days_are_custom():
+    assert parse_period('2025-09-01..2025-09-30').kind == CUSTOM
+
+@pytest.mark.parametrize('key', ['', 'Aug-2025', '2025-13', '2025-08C', '2025-08-10..2025-08-01',
+                                 'custom:2025-08-01', '2025-01-01..2026-12-31'])
+def test_parse_period_rejects_anything_else(key):
+    with pytest.raises(ValueError):
+        parse_period(key)
+
+def test_month_share():
+    assert period_containing(MONTHLY, date(2025, 2, 1)).month_share == 1.0
+    assert period_containing(SEMI_MONTHLY, date(2025, 2, 20)).month_share == 0.5
+    assert period_containing(BIWEEKLY, date(2025, 2, 1)).month_share == pytest.approx(14 * 12 / 365)
+    year = custom_period(date(2025, 1, 1), date(2025, 12, 31))
+    assert year.month_share == pytest.approx(12.0)
+
+def test_pay_frequency_and_anchor_parsing():
+    assert pay_frequency('Semi_Monthly') == SEMI_MONTHLY
+    assert pay_frequency('semimonthly') == SEMI_MONTHLY
+    assert pay_frequency('weekly', BIWEEKLY) == BIWEEKLY
+    assert pay_frequency(None) == MONTHLY
+    assert parse_anchor('2025-03-05') == date(2025, 3, 5)
+    assert parse_anchor('soon') == ANCHOR
+
+def test_migration_prefixes_legacy_custom_keys(conn, add_employee):
+    employee = add_employee()
+    conn.executemany('INSERT INTO payroll(employee_ref, period, net_pay) VALUES (?, ?, 1)',
+                     [(employee, '2025-08-04..2025-08-20'), (employee, '2025-08-25..2025-09-07'),
+                      (employee, '2025-08'), (employee, 'custom:2025-09-01..2025-09-30')])
+    conn.execute('''INSERT INTO payroll_adjustments(employee_ref, source_period, target_period, net_pay)
+                    VALUES (?, '2025-08-04..2025-08-20', '2025-08-25..2025-09-07', 1)''', (employee,))
+
+    database._migrate_custom_period_keys(conn.cursor())
+
+    keys = {row[0] for row in conn.execute('SELECT period FROM payroll WHERE employee_ref = ?', (employee,))}
+    assert keys == {'custom:2025-08-04..2025-08-20', '2025-08-25..2025-09-07', '2025-08',
+                    'custom:2025-09-01..2025-09-30'}
+    assert tuple(conn.execute('SELECT source_period, target_period FROM payroll_adjustments').fetchone()) == (
+        'custom:2025-08-04..2025-08-20', '2025-08-25..2025-09-07')
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from payroll_engine import PayRules, apply_rules, bracket_tax, parse_tax_brackets
+
+def pay(rules, salary_rate=1000.0, days_worked=10, overtime_hours=0.0, expected_days=None, month_share=1.0):
+    """apply_rules for one employee, as a dict of floats"""
+    amounts = apply_rules(np.array([salary_rate]), np.array([days_worked]), np.array([overtime_hours]), rules,
+                          expected_days, month_share)
+    return dict(zip(('base_salary', 'overtime', 'deductions', 'bonuses', 'net_pay'),
+                    (float(amount[0]) for amount in amounts)))
+
+def test_defaults_for_a_regular_month():
+    result = pay(PayRules(), salary_rate=1000.0, days_worked=10, overtime_hours=4.0)
+    overtime = 4.0 * 1000.0 / 8.0 * 1.5
+    gross = 10000.0 + overtime
+    assert result['base_salary'] == pytest.approx(10000.0)
+    assert result['overtime'] == pytest.approx(overtime)
+    assert result['deductions'] == pytest.approx(gross * 0.12 + 500.0 + gross * 0.05)
+    assert result['bonuses'] == 0.0
+    assert result['net_pay'] == pytest.approx(gross - result['deductions'])
+
+def test_zero_days_pays_and_deducts_nothing():
+    result = pay(PayRules(), days_worked=0)
+    assert result == {'base_salary': 0.0, 'overtime': 0.0, 'deductions': 0.0, 'bonuses': 0.0, 'net_pay': 0.0}
+
+def test_zero_days_earns_no_bonus_even_when_the_period_has_no_working_days():
+    result = pay(PayRules(bonus_min_days=20), days_worked=0, expected_days=0)
+    assert result['bonuses'] == 0.0 and result['net_pay'] == 0.0
+
+def test_deductions_above_gross_are_capped_at_pay():
+    rules = PayRules(tax_brackets=((0.0, 0.6),), retirement_rate=0.5, insurance_deduction=500.0)
+    result = pay(rules, salary_rate=100.0, days_worked=1)
+    assert result['deductions'] == pytest.approx(100.0)
+    assert result['net_pay'] == 0.0
+
+def test_deduction_cap_includes_the_bonus():
+    rules = PayRules(tax_brackets=((0.0, 0.9),), retirement_rate=0.5, insurance_deduction=0.0,
+                     bonus_min_days=1, bonus_pay_days=2.0)
+    result = pay(rules, salary_rate=100.0, days_worked=1)
+    assert result['bonuses'] == pytest.approx(200.0)
+    assert result['deductions'] == pytest.approx(140.0)
+    assert result['net_pay'] == pytest.approx(160.0)
+
+def test_net_pay_is_never_negative():
+    rules = PayRules(tax_brackets=((0.0, 0.99),), retirement_rate=0.99, insurance_deduction=10000.0)
+    rates = np.array([0.0, 1.0, 50.0, 1000.0])
+    *_, net_pay = apply_rules(rates, np.array([0, 1, 3, 22]), np.array([0.0, 0.0, 7.0, 40.0]), rules)
+    assert (net_pay >= 0.0).all()
+
+def test_insurance_is_never_more_than_gross():
+    rules = PayRules(tax_brackets=((0.0, 0.0),), retirement_rate=0.0, insurance_deduction=500.0)
+    assert pay(rules, salary_rate=100.0, days_worked=2)['deductions'] == pytest.approx(200.0)
+
+@pytest.mark.parametrize('month_share, insurance', [(1.0, 500.0), (0.5, 250.0), (14 * 12 / 365, 500.0 * 14 * 12 / 365)])
+def test_insurance_is_prorated_by_month_share(month_share, insurance):
+    rules = PayRules(tax_brackets=((0.0, 0.0),), retirement_rate=0.0, insurance_deduction=500.0)
+    assert pay(rules, month_share=month_share)['deductions'] == pytest.approx(insurance)
+
+def test_month_share_can_differ_per_row():
+    rules = PayRules(tax_brackets=((0.0, 0.0),), retirement_rate=0.0, insurance_deduction=600.0)
+    _, _, deductions, _, _ = apply_rules(np.array([1000.0, 1000.0]), np.array([10, 10]), np.zeros(2), rules,
+                                         month_share=np.array([1.0, 0.5]))
+    assert deductions.tolist() == pytest.approx([600.0, 300.0])
+
+def test_bonus_threshold_follows_the_periods_working_days():
+    rules = PayRules(bonus_min_days=20, bonus_pay_days=2.0)
+    assert pay(rules, days_worked=11, expected_days=11)['bonuses'] == pytest.approx(2000.0)
+    assert pay(rules, days_worked=10, expected_days=11)['bonuses'] == 0.0
+    assert pay(rules, days_worked=11)['bonuses'] == 0.0
+
+def test_missing_values_count_as_zero():
+    result = pay(PayRules(), salary_rate=np.nan, days_worked=np.nan, overtime_hours=np.nan)
+    assert result['net_pay'] == 0.0
+
+def test_bracket_tax_is_marginal():
+    brackets = ((0.0, 0.10), (20000.0, 0.20), (50000.0, 0.30))
+    taxes = bracket_tax(np.array([0.0, 10000.0, 20000.0, 30000.0, 60000.0]), brackets)
+    assert taxes.tolist() == pytest.approx([0.0, 1000.0, 2000.0, 4000.0, 11000.0])
+
+def test_parse_tax_brackets():
+    assert parse_tax_brackets('flat', 0.12) == ((0.0, 0.12),)
+    assert parse_tax_brackets('', 0.12) == ((0.0, 0.12),)
+    assert parse_tax_brackets('20000:0.2; 0:0.1', 0.12) == ((0.0, 0.1), (20000.0, 0.2))
+    # Income below the first threshold is untaxed
+    assert parse_tax_brackets('10000:0.15', 0.12) == ((0.0, 0.0), (10000.0, 0.15))
+
+def test_malformed_tax_brackets_fall_back_to_the_flat_rate():
+    assert parse_tax_brackets('0:abc, 5000', 0.12) == ((0.0, 0.12),)
+
+def test_rules_round_trip_through_a_dict():
+    rules = PayRules(hours_per_day=7.5, tax_brackets=((0.0, 0.1), (20000.0, 0.2)), insurance_deduction=300.0)
+    assert PayRules.from_dict(rules.to_dict()).to_dict() == rules.to_dict()
@@ -0,0 +1,98 @@
+import pytest
+from conftest import AUGUST_2025
+from payroll_diff import DryRunNotFound, apply_run, diff, discard_run, dry_run
+from payroll_engine import PayRules, generate_payroll
+
+RULES = PayRules(tax_brackets=((0.0, 0.10),), insurance_deduction=0.0, retirement_rate=0.0, bonus_pay_days=0.0)
+
+def payroll_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM payroll WHERE period = '2025-08'").fetchone()[0]
+
+def entries(result, key, employee_ref):
+    return [entry for entry in result[key] if entry['employee_ref'] == employee_ref]
+
+def test_dry_run_writes_nothing_and_lists_new_rows(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+
+    result = diff(conn, dry_run(conn, '2025-08', rules=RULES))
+
+    assert payroll_count(conn) == 0
+    [entry] = entries(result, 'new', employee)
+    assert entry['changes']['base_salary'] == (None, pytest.approx(2000.0))
+    assert entry['changes']['net_pay'] == (None, pytest.approx(1800.0))
+
+def test_unchanged_rows_are_counted_not_listed(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+
+    result = diff(conn, dry_run(conn, '2025-08', rules=RULES))
+
+    assert not entries(result, 'new', employee) and not entries(result, 'changed', employee)
+    assert result['unchanged'] == payroll_count(conn)
+
+def test_changed_rows_list_only_the_fields_that_differ(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+    attend(employee, AUGUST_2025[4:5])
+
+    [entry] = entries(diff(conn, dry_run(conn, '2025-08', rules=RULES)), 'changed', employee)
+
+    assert set(entry['changes']) == {'base_salary', 'deductions', 'net_pay'}
+    assert entry['changes']['base_salary'] == (pytest.approx(2000.0), pytest.approx(2500.0))
+
+def test_stale_rows_are_reported_and_kept(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+    conn.execute("UPDATE employees SET status = 'Inactive' WHERE id = ?", (employee,))
+    conn.commit()
+
+    run_id = dry_run(conn, '2025-08', rules=RULES)
+    assert [row['employee_ref'] for row in diff(conn, run_id)['stale']] == [employee]
+    apply_run(conn, run_id)
+
+    assert conn.execute("SELECT COUNT(*) FROM payroll WHERE employee_ref = ?", (employee,)).fetchone()[0] == 1
+
+def test_apply_writes_new_and_changed_rows_only(conn, add_employee, attend):
+    unchanged, changed = add_employee(500.0), add_employee(800.0)
+    for employee in (unchanged, changed):
+        attend(employee, AUGUST_2025[:4])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+    newcomer = add_employee(300.0)
+    attend(newcomer, AUGUST_2025[:2])
+    attend(changed, AUGUST_2025[4:6])
+    before = payroll_count(conn)
+
+    inserted, updated = apply_run(conn, dry_run(conn, '2025-08', rules=RULES))
+
+    assert (inserted, updated) == (1, 1)
+    assert payroll_count(conn) == before + 1
+    net_pay = dict(conn.execute("SELECT employee_ref, net_pay FROM payroll WHERE period = '2025-08'").fetchall())
+    assert net_pay[changed] == pytest.approx(800.0 * 6 * 0.9)
+    assert net_pay[newcomer] == pytest.approx(300.0 * 2 * 0.9)
+    assert conn.execute('SELECT net_pay FROM payroll_period_summary WHERE period = ?',
+                        ('2025-08',)).fetchone()[0] == pytest.approx(sum(net_pay.values()))
+
+def test_applying_again_finds_nothing_to_change(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+    apply_run(conn, dry_run(conn, '2025-08', rules=RULES))
+
+    assert apply_run(conn, dry_run(conn, '2025-08', rules=RULES)) == (0, 0)
+
+def test_applied_and_discarded_runs_are_gone(conn, add_employee, attend):
+    employee = add_employee(500.0)
+    attend(employee, AUGUST_2025[:4])
+    applied, discarded = dry_run(conn, '2025-08', rules=RULES), dry_run(conn, '2025-08', rules=RULES)
+    apply_run(conn, applied)
+    discard_run(conn, discarded)
+
+    for run_id in (applied, discarded, 'never-existed'):
+        with pytest.raises(DryRunNotFound):
+            diff(conn, run_id)
+        with pytest.raises(DryRunNotFound):
+            apply_run(conn, run_id)
+    assert conn.execute('SELECT COUNT(*) FROM payroll_staging').fetchone()[0] == 0
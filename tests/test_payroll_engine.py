@@ -0,0 +1,66 @@
+import json
+from datetime import date
+import pytest
+from conftest import AUGUST_2025, weekdays
+from pay_periods import custom_period
+from payroll_engine import PayRules, compute_payroll, generate_payroll, resolve_period
+
+RULES = PayRules(tax_brackets=((0.0, 0.10),), insurance_deduction=0.0, retirement_rate=0.0, bonus_pay_days=0.0)
+
+def stored(conn, employee_ref, period_key):
+    return conn.execute('''SELECT base_salary, overtime, deductions, bonuses, net_pay, pay_basis FROM payroll
+                           WHERE employee_ref = ? AND period = ?''', (employee_ref, period_key)).fetchone()
+
+def test_generate_pays_each_employee_from_accrued_attendance(conn, add_employee, attend):
+    clerk, manager = add_employee(500.0), add_employee(1000.0)
+    attend(clerk, AUGUST_2025[:10])
+    attend(manager, AUGUST_2025[:4], time_out='18:00:00')  # 2 overtime hours a day
+
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+
+    assert stored(conn, clerk, '2025-08')[:5] == pytest.approx((5000.0, 0.0, 500.0, 0.0, 4500.0))
+    overtime = 4 * 2 * (1000.0 / 8) * 1.5
+    base_salary, row_overtime, _, _, net_pay, _ = stored(conn, manager, '2025-08')
+    assert (base_salary, row_overtime) == pytest.approx((4000.0, overtime))
+    assert net_pay == pytest.approx((4000.0 + overtime) * 0.9)
+
+def test_generate_leaves_existing_rows_alone(conn, add_employee, attend):
+    employee = add_employee()
+    attend(employee, AUGUST_2025[:5])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+    first = stored(conn, employee, '2025-08')
+
+    attend(employee, AUGUST_2025[5:10])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+
+    assert stored(conn, employee, '2025-08') == first
+    assert conn.execute('SELECT COUNT(*) FROM payroll WHERE employee_ref = ?', (employee,)).fetchone()[0] == 1
+
+def test_generate_stores_the_pay_basis(conn, add_employee, attend):
+    employee = add_employee(750.0)
+    attend(employee, AUGUST_2025[:3])
+    generate_payroll('2025-08', conn=conn, rules=RULES)
+
+    basis = json.loads(stored(conn, employee, '2025-08')[5])
+    assert basis['salary_rate'] == 750.0
+    assert basis['expected_days'] == len(AUGUST_2025)
+    assert basis['month_share'] == 1.0
+    assert PayRules.from_dict(basis['rules']).to_dict() == RULES.to_dict()
+
+def test_only_employees_on_the_periods_frequency_are_paid(conn, add_employee, attend):
+    monthly, biweekly = add_employee(pay_frequency='monthly'), add_employee(pay_frequency='biweekly')
+    attend(monthly, AUGUST_2025[:2])
+    attend(biweekly, AUGUST_2025[:2])
+
+    paid = {row[0] for row in compute_payroll(conn, resolve_period('2025-08'), RULES)}
+
+    assert monthly in paid and biweekly not in paid
+
+def test_custom_period_totals_attendance_in_its_range(conn, add_employee, attend):
+    employee = add_employee(100.0)
+    attend(employee, AUGUST_2025)
+    period = custom_period(date(2025, 8, 4), date(2025, 8, 8))
+
+    row = next(row for row in compute_payroll(conn, period, RULES) if row[0] == employee)
+
+    assert row[1] == pytest.approx(100.0 * len(weekdays(period.start, period.end)))